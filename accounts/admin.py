@@ -1,11 +1,15 @@
 from django.contrib import admin
 
-from accounts.models import UserDetails, Post, FriendRequest, PendingUser, Like, Comment, Bookmark
+from accounts.models import UserDetails, Post, FriendRequest, Friendship, UserStats, PendingUser, OutboundEmail, FanoutJob, Like, Comment, Bookmark
 
 admin.site.register(UserDetails)
 admin.site.register(Post)   
 admin.site.register(FriendRequest) 
+admin.site.register(Friendship)
+admin.site.register(UserStats)
 admin.site.register(PendingUser)
+admin.site.register(OutboundEmail)
+admin.site.register(FanoutJob)
 admin.site.register(Like)
 admin.site.register(Comment)
 admin.site.register(Bookmark)  # Register Bookmark modela 
\ No newline at end of file
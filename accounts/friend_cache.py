@@ -0,0 +1,109 @@
+"""
+Cached friend-ID sets.
+
+Each user's friend IDs are kept as a frozenset in a small process-local LRU,
+backed by the Django cache so other workers can share the result. Membership
+checks (``are_friends``) are then O(1) instead of a query per call.
+
+Entries are invalidated whenever a Friendship edge is created or removed.
+The local LRU also expires entries after FRIEND_CACHE_LOCAL_TTL seconds, which
+bounds how long another process can serve a stale set.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+
+_local = OrderedDict()  # user_id -> (expires_at, frozenset of friend ids)
+_lock = threading.Lock()
+_stats = {'local_hits': 0, 'shared_hits': 0, 'misses': 0, 'invalidations': 0}
+
+
+def _key(user_id):
+    return f"friend_ids:{user_id}"
+
+
+def _local_size():
+    return getattr(settings, 'FRIEND_CACHE_LOCAL_SIZE', 1024)
+
+
+def _local_ttl():
+    return getattr(settings, 'FRIEND_CACHE_LOCAL_TTL', 30)
+
+
+def _shared_ttl():
+    return getattr(settings, 'FRIEND_CACHE_TTL', 60 * 60)
+
+
+def _count(name):
+    with _lock:
+        _stats[name] += 1
+
+
+def _remember(user_id, friend_ids):
+    with _lock:
+        _local[user_id] = (time.monotonic() + _local_ttl(), friend_ids)
+        _local.move_to_end(user_id)
+        while len(_local) > _local_size():
+            _local.popitem(last=False)
+
+
+def get_friend_ids(user_id):
+    """Return the friend IDs of ``user_id`` as a frozenset."""
+    with _lock:
+        entry = _local.get(user_id)
+        if entry is not None:
+            if entry[0] > time.monotonic():
+                _local.move_to_end(user_id)
+                _stats['local_hits'] += 1
+                return entry[1]
+            del _local[user_id]
+
+    friend_ids = cache.get(_key(user_id))
+    if friend_ids is not None:
+        _count('shared_hits')
+    else:
+        from accounts.models import Friendship
+        friend_ids = frozenset(
+            Friendship.objects.filter(user_id=user_id).values_list('friend_id', flat=True)
+        )
+        cache.set(_key(user_id), friend_ids, _shared_ttl())
+        _count('misses')
+
+    _remember(user_id, friend_ids)
+    return friend_ids
+
+
+def are_friends(user_id, other_id):
+    return other_id in get_friend_ids(user_id)
+
+
+def invalidate(*user_ids):
+    """Drop cached friend sets for the given users (local and shared)."""
+    with _lock:
+        for user_id in user_ids:
+            _local.pop(user_id, None)
+        _stats['invalidations'] += len(user_ids)
+    cache.delete_many([_key(user_id) for user_id in user_ids])
+
+
+def clear():
+    with _lock:
+        _local.clear()
+
+
+def get_stats():
+    with _lock:
+        stats = dict(_stats)
+        stats['local_entries'] = len(_local)
+    lookups = stats['local_hits'] + stats['shared_hits'] + stats['misses']
+    stats['hit_ratio'] = round((stats['local_hits'] + stats['shared_hits']) / lookups, 4) if lookups else None
+    return stats
+
+
+def reset_stats():
+    with _lock:
+        for name in _stats:
+            _stats[name] = 0
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from accounts import friend_cache
+from accounts.models import FriendRequest, Friendship
+
+
+class Command(BaseCommand):
+    help = "Rebuild the symmetric Friendship edge table from accepted friend requests."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+
+        wanted = set()
+        accepted = FriendRequest.objects.filter(is_accepted=True).values_list('from_user_id', 'to_user_id')
+        for from_id, to_id in accepted.iterator(chunk_size=batch_size):
+            wanted.add((from_id, to_id))
+            wanted.add((to_id, from_id))
+
+        existing = set(Friendship.objects.values_list('user_id', 'friend_id').iterator(chunk_size=batch_size))
+        missing = [Friendship(user_id=u, friend_id=f) for u, f in wanted - existing]
+        stale = existing - wanted
+
+        with transaction.atomic():
+            Friendship.objects.bulk_create(missing, batch_size=batch_size, ignore_conflicts=True)
+            stale = list(stale)
+            for i in range(0, len(stale), batch_size):
+                query = Q()
+                for user_id, friend_id in stale[i:i + batch_size]:
+                    query |= Q(user_id=user_id, friend_id=friend_id)
+                Friendship.objects.filter(query).delete()
+
+        friend_cache.invalidate(*{user_id for user_id, _ in (wanted ^ existing)})
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Friendship edges: {len(missing)} created, {len(stale)} removed, {len(wanted)} total."
+        ))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from accounts.suggestions import DEFAULT_TOP_K, rebuild_suggestions
+
+
+class Command(BaseCommand):
+    help = "Recompute ranked friend suggestions (mutual-friend counts). Run periodically, e.g. from cron."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top-k', type=int, default=DEFAULT_TOP_K)
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        total = rebuild_suggestions(top_k=options['top_k'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Stored {total} friend suggestions."))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts import search
+from socio import fts
+
+# Index -> extra arguments for fts.rebuild, for indexes with computed columns.
+INDEXES = {
+    search.FTS_TABLE: {
+        'table': search.FTS_CONTENT_TABLE, 'columns': search.FTS_COLUMNS, 'expressions': search.FTS_EXPRESSIONS,
+    },
+    'accounts_post_fts': {},
+    'accounts_comment_fts': {},
+}
+
+
+class Command(BaseCommand):
+    help = "Repopulate the FTS5 search indexes (people, posts, comments) from their tables."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--index', action='append', choices=list(INDEXES), dest='indexes', help="Only rebuild this index (repeatable).")
+
+    def handle(self, *args, **options):
+        if not fts.available():
+            raise CommandError("Full-text indexes only exist on SQLite.")
+        for fts_table in options['indexes'] or INDEXES:
+            fts.rebuild(fts_table, **INDEXES[fts_table])
+            self.stdout.write(f"Rebuilt {fts_table}.")
+        self.stdout.write(self.style.SUCCESS("Search indexes rebuilt."))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from accounts import timeline
+
+
+class Command(BaseCommand):
+    help = "Recompute materialized home timelines from posts and friendships."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append', dest='user_ids', help="Only rebuild these user IDs (repeatable).")
+
+    def handle(self, *args, **options):
+        total = timeline.rebuild(user_ids=options['user_ids'])
+        self.stdout.write(self.style.SUCCESS(f"Wrote {total} timeline entries."))
@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from accounts.models import Comment, Like, Post
+
+
+def compute_post_counters(post_ids):
+    """Recount likes and comments for ``post_ids`` from the source tables."""
+    likes = dict(Like.objects.filter(post_id__in=post_ids).values_list('post_id').annotate(n=Count('id')).order_by())
+    comments = dict(Comment.objects.filter(post_id__in=post_ids).values_list('post_id').annotate(n=Count('id')).order_by())
+    return {post_id: (likes.get(post_id, 0), comments.get(post_id, 0)) for post_id in post_ids}
+
+
+def _count_subquery(model):
+    counts = model.objects.filter(post=OuterRef('pk')).order_by().values('post').annotate(n=Count('id')).values('n')
+    return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+
+class Command(BaseCommand):
+    help = "Recompute denormalized Post.like_count/comment_count in id-ordered chunks, fixing only drifted rows."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        last_id = 0
+        checked = fixed = 0
+        while True:
+            chunk = list(
+                Post.objects.filter(id__gt=last_id).order_by('id')
+                .values_list('id', 'like_count', 'comment_count')[:chunk_size]
+            )
+            if not chunk:
+                break
+            last_id = chunk[-1][0]
+            actual = compute_post_counters([post_id for post_id, _, _ in chunk])
+            drifted = [
+                post_id for post_id, like_count, comment_count in chunk
+                if (like_count, comment_count) != actual[post_id]
+            ]
+            if drifted:
+                # Recount inside the UPDATE itself so likes written since the
+                # read above are not overwritten with a stale number.
+                Post.objects.filter(id__in=drifted).update(
+                    like_count=_count_subquery(Like),
+                    comment_count=_count_subquery(Comment),
+                )
+            checked += len(chunk)
+            fixed += len(drifted)
+        self.stdout.write(self.style.SUCCESS(f"Checked {checked} posts, fixed {fixed} drifted counters."))
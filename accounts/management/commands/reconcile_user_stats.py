@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+
+from accounts.models import Friendship, Like, Post, UserDetails, UserStats
+
+
+def compute_user_stats(user_ids=None):
+    """Recount every counter from the source tables, grouped per user."""
+    posts = Post.objects.filter(is_active=True)
+    friendships = Friendship.objects.all()
+    likes = Like.objects.all()
+    if user_ids is not None:
+        posts = posts.filter(user_id__in=user_ids)
+        friendships = friendships.filter(user_id__in=user_ids)
+        likes = likes.filter(post__user_id__in=user_ids)
+    return {
+        'posts_count': dict(posts.values_list('user_id').annotate(n=Count('id')).order_by()),
+        'friends_count': dict(friendships.values_list('user_id').annotate(n=Count('id')).order_by()),
+        'likes_received_count': dict(likes.values_list('post__user_id').annotate(n=Count('id')).order_by()),
+    }
+
+
+class Command(BaseCommand):
+    help = "Recompute denormalized per-user counters (posts, friends, likes received) in bulk."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        user_ids = list(UserDetails.objects.order_by('id').values_list('id', flat=True))
+        fields = ['posts_count', 'friends_count', 'likes_received_count']
+        fixed = 0
+        for start in range(0, len(user_ids), batch_size):
+            batch = user_ids[start:start + batch_size]
+            counts = compute_user_stats(batch)
+            current = {s.user_id: s for s in UserStats.objects.filter(user_id__in=batch)}
+            rows = []
+            for user_id in batch:
+                row = UserStats(user_id=user_id, **{f: counts[f].get(user_id, 0) for f in fields})
+                old = current.get(user_id)
+                if old is None or any(getattr(old, f) != getattr(row, f) for f in fields):
+                    rows.append(row)
+            UserStats.objects.bulk_create(
+                rows,
+                update_conflicts=True,
+                unique_fields=['user'],
+                update_fields=fields,
+            )
+            fixed += len(rows)
+        self.stdout.write(self.style.SUCCESS(f"Reconciled stats for {len(user_ids)} users, {fixed} rows rewritten."))
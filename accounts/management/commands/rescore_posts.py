@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from accounts import ranking
+from accounts.models import Post
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute ranked-feed scores from likes, comments and bookmarks in id-ordered chunks. "
+        "By default only posts inside the ranking window are touched."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help="Rescore every post, not just recent ones.")
+        parser.add_argument('--chunk-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        posts = Post.objects.all()
+        if not options['all']:
+            posts = posts.filter(created_at__gte=timezone.now() - ranking.window())
+        last_id = 0
+        total = 0
+        while True:
+            chunk = list(posts.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:options['chunk_size']])
+            if not chunk:
+                break
+            last_id = chunk[-1]
+            total += ranking.rescore(chunk)
+        self.stdout.write(self.style.SUCCESS(f"Rescored {total} posts."))
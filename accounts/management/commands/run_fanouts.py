@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from accounts import timeline
+
+
+class Command(BaseCommand):
+    help = "Deliver new posts to friends' timelines, retrying failed fan-outs with backoff."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-jobs', type=int, default=None, help="Stop after running this many jobs.")
+        parser.add_argument('--loop', action='store_true', help="Keep polling for jobs instead of exiting when none are due.")
+        parser.add_argument('--interval', type=float, default=5.0, help="Seconds to sleep between polls with --loop.")
+
+    def handle(self, *args, **options):
+        while True:
+            delivered, failed, rescheduled = timeline.drain(max_jobs=options['max_jobs'])
+            if delivered or failed or rescheduled or not options['loop']:
+                self.stdout.write(self.style.SUCCESS(
+                    f"Delivered {delivered} posts, {failed} failed, {rescheduled} rescheduled."
+                ))
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
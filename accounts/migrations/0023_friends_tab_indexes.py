@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0022_friendsuggestion'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='friendrequest',
+            index=models.Index(fields=['to_user', 'is_accepted', '-created_at'], name='friendrequest_inbox_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='friendrequest',
+            index=models.Index(fields=['from_user', 'is_accepted', '-created_at'], name='friendrequest_outbox_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='friendship',
+            index=models.Index(fields=['user', '-created_at'], name='friendship_recent_idx'),
+        ),
+    ]
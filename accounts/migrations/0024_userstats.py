@@ -0,0 +1,55 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:02
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_user_stats(apps, schema_editor):
+    UserDetails = apps.get_model('accounts', 'UserDetails')
+    UserStats = apps.get_model('accounts', 'UserStats')
+    Post = apps.get_model('accounts', 'Post')
+    Friendship = apps.get_model('accounts', 'Friendship')
+    Like = apps.get_model('accounts', 'Like')
+    posts = dict(Post.objects.filter(is_active=True).values_list('user_id').annotate(n=Count('id')).order_by())
+    friends = dict(Friendship.objects.values_list('user_id').annotate(n=Count('id')).order_by())
+    likes = dict(Like.objects.values_list('post__user_id').annotate(n=Count('id')).order_by())
+    UserStats.objects.bulk_create(
+        [
+            UserStats(
+                user_id=user_id,
+                posts_count=posts.get(user_id, 0),
+                friends_count=friends.get(user_id, 0),
+                likes_received_count=likes.get(user_id, 0),
+            )
+            for user_id in UserDetails.objects.values_list('id', flat=True)
+        ],
+        batch_size=1000,
+        ignore_conflicts=True,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0023_friends_tab_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('posts_count', models.PositiveIntegerField(default=0)),
+                ('friends_count', models.PositiveIntegerField(default=0)),
+                ('likes_received_count', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'User Stats',
+                'verbose_name_plural': 'User Stats',
+            },
+        ),
+        migrations.RunPython(backfill_user_stats, migrations.RunPython.noop),
+    ]
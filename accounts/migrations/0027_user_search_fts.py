@@ -0,0 +1,32 @@
+from django.db import migrations
+
+from socio import fts
+
+FTS_TABLE = 'accounts_userdetails_fts'
+TABLE = 'accounts_userdetails'
+COLUMNS = ['username', 'first_name', 'last_name', 'email']
+
+
+def create_fts(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for statement in fts.create_index_sql(FTS_TABLE, TABLE, COLUMNS):
+        schema_editor.execute(statement)
+
+
+def drop_fts(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for statement in fts.drop_index_sql(FTS_TABLE):
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0026_user_email_ci_unique'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts, drop_fts),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:06
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_timelines(apps, schema_editor):
+    Friendship = apps.get_model('accounts', 'Friendship')
+    Post = apps.get_model('accounts', 'Post')
+    TimelineEntry = apps.get_model('accounts', 'TimelineEntry')
+    followers = {}
+    for reader_id, author_id in Friendship.objects.values_list('user_id', 'friend_id'):
+        followers.setdefault(author_id, []).append(reader_id)
+    entries = []
+    for post_id, author_id, created_at in Post.objects.filter(is_active=True).values_list('id', 'user_id', 'created_at'):
+        for reader_id in [author_id, *followers.get(author_id, [])]:
+            entries.append(TimelineEntry(user_id=reader_id, post_id=post_id, author_id=author_id, created_at=created_at))
+    TimelineEntry.objects.bulk_create(entries, batch_size=1000, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0027_user_search_fts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TimelineEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField()),
+                ('author', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline_entries', to='accounts.post')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline_entries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', '-created_at', '-post'], name='timeline_recent_idx'), models.Index(fields=['user', 'author'], name='timeline_author_idx')],
+                'unique_together': {('user', 'post')},
+            },
+        ),
+        migrations.RunPython(backfill_timelines, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:10
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_post_counters(apps, schema_editor):
+    Post = apps.get_model('accounts', 'Post')
+    Like = apps.get_model('accounts', 'Like')
+    Comment = apps.get_model('accounts', 'Comment')
+    likes = dict(Like.objects.values_list('post_id').annotate(n=Count('id')).order_by())
+    comments = dict(Comment.objects.values_list('post_id').annotate(n=Count('id')).order_by())
+    posts = [
+        Post(id=post_id, like_count=likes.get(post_id, 0), comment_count=comments.get(post_id, 0))
+        for post_id in set(likes) | set(comments)
+    ]
+    Post.objects.bulk_update(posts, ['like_count', 'comment_count'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0029_post_list_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='like_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_post_counters, migrations.RunPython.noop),
+    ]
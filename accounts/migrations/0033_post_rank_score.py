@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:22
+
+from django.db import migrations, models
+
+from accounts.ranking import event_term, log_sum, weights
+
+
+def backfill_rank_scores(apps, schema_editor):
+    Post = apps.get_model('accounts', 'Post')
+    current = weights()
+    terms = {
+        post_id: [event_term('post', created_at, _weights=current)]
+        for post_id, created_at in Post.objects.values_list('id', 'created_at').iterator()
+    }
+    for kind, model_name in (('like', 'Like'), ('comment', 'Comment'), ('bookmark', 'Bookmark')):
+        model = apps.get_model('accounts', model_name)
+        for post_id, at in model.objects.values_list('post_id', 'created_at').iterator():
+            terms[post_id].append(event_term(kind, at, _weights=current))
+    Post.objects.bulk_update(
+        [Post(id=post_id, rank_score=log_sum(post_terms)) for post_id, post_terms in terms.items()],
+        ['rank_score'], batch_size=500
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0032_like_post_recent_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='rank_score',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['-rank_score', '-id'], name='post_rank_idx'),
+        ),
+        migrations.RunPython(backfill_rank_scores, migrations.RunPython.noop),
+    ]
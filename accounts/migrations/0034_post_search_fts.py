@@ -0,0 +1,35 @@
+from django.db import migrations
+
+from socio import fts
+
+INDEXES = [
+    ('accounts_post_fts', 'accounts_post', ['text_content', 'caption']),
+    ('accounts_comment_fts', 'accounts_comment', ['content']),
+]
+
+
+def create_fts(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for fts_table, table, columns in INDEXES:
+        for statement in fts.create_index_sql(fts_table, table, columns):
+            schema_editor.execute(statement)
+
+
+def drop_fts(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for fts_table, _, _ in INDEXES:
+        for statement in fts.drop_index_sql(fts_table):
+            schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0033_post_rank_score'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts, drop_fts),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:26
+
+from django.db import migrations, models
+
+from socio import fts
+
+# Adding these columns makes SQLite rebuild both tables, which drops their
+# FTS sync triggers; put the indexes back afterwards.
+INDEXES = [
+    ('accounts_userdetails_fts', 'accounts_userdetails', ['username', 'first_name', 'last_name', 'email']),
+    ('accounts_post_fts', 'accounts_post', ['text_content', 'caption']),
+]
+
+
+def recreate_fts(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for fts_table, table, columns in INDEXES:
+        for statement in fts.drop_index_sql(fts_table) + fts.create_index_sql(fts_table, table, columns):
+            schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0034_post_search_fts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='image_meta',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='userdetails',
+            name='profile_photo_meta',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.RunPython(recreate_fts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:40
+
+import django.core.validators
+import mediastore.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0035_image_variants_meta'),
+    ]
+
+    # Only the storage backend changes, which has no database effect. A real
+    # AlterField would make SQLite rebuild the table and drop its FTS triggers.
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AlterField(
+                    model_name='post',
+                    name='image',
+                    field=models.ImageField(blank=True, null=True, storage=mediastore.storage.media_storage, upload_to='post_images/', validators=[django.core.validators.FileExtensionValidator(['jpg', 'jpeg', 'png', 'gif'])]),
+                ),
+                migrations.AlterField(
+                    model_name='post',
+                    name='video',
+                    field=models.FileField(blank=True, null=True, storage=mediastore.storage.media_storage, upload_to='post_videos/', validators=[django.core.validators.FileExtensionValidator(['mp4', 'avi', 'mov', 'wmv', 'flv'])]),
+                ),
+                migrations.AlterField(
+                    model_name='userdetails',
+                    name='profile_photo',
+                    field=models.ImageField(blank=True, null=True, storage=mediastore.storage.media_storage, upload_to='profile_photos/', validators=[django.core.validators.FileExtensionValidator(['jpg', 'jpeg', 'png'])]),
+                ),
+            ],
+        ),
+    ]
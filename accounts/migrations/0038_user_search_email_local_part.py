@@ -0,0 +1,36 @@
+from django.db import migrations
+
+from socio import fts
+
+FTS_TABLE = 'accounts_userdetails_fts'
+TABLE = 'accounts_userdetails'
+COLUMNS = ['username', 'first_name', 'last_name', 'email']
+# Index only the part of the email before the '@': domain words would
+# otherwise match everyone on the same provider.
+EXPRESSIONS = {'email': "substr({row}.email, 1, instr({row}.email || '@', '@') - 1)"}
+
+
+def index_local_part(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    statements = fts.drop_index_sql(FTS_TABLE) + fts.create_index_sql(FTS_TABLE, TABLE, COLUMNS, expressions=EXPRESSIONS)
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def index_whole_email(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for statement in fts.drop_index_sql(FTS_TABLE) + fts.create_index_sql(FTS_TABLE, TABLE, COLUMNS):
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0037_fanout_jobs'),
+    ]
+
+    operations = [
+        migrations.RunPython(index_local_part, index_whole_email),
+    ]
@@ -1,20 +1,27 @@
-from django.db import models
+from django.db import models, transaction
 from django.conf import settings
 from django.utils import timezone
 from django.contrib.auth.models import AbstractUser
 from django.core.validators import FileExtensionValidator
-from django.db.models import Q
+from django.db.models import F, Q
+from django.db.models.functions import Greatest, Lower
 import uuid
 from django.urls import reverse # Import reverse for get_absolute_url
+from accounts import friend_cache, ranking
+from mediastore.storage import media_storage
+from socio.tasks import defer
 
 # Your existing UserDetails model
 class UserDetails(AbstractUser):
     profile_photo = models.ImageField(
         upload_to='profile_photos/',
+        storage=media_storage,
         null=True,
         blank=True,
         validators=[FileExtensionValidator(['jpg', 'jpeg', 'png'])]
     )
+    # Resized variants and placeholder, filled in by mediastore.images.
+    profile_photo_meta = models.JSONField(default=dict, blank=True)
     bio = models.TextField(max_length=500, blank=True, null=True)
     website = models.URLField(max_length=200, blank=True, null=True)
     location = models.CharField(max_length=100, blank=True, null=True)
@@ -28,15 +35,46 @@ class UserDetails(AbstractUser):
         return self.posts.filter(is_active=True)
 
     def get_friends(self):
-        accepted = FriendRequest.objects.filter(
-            Q(from_user=self) | Q(to_user=self),
-            is_accepted=True
+        return UserDetails.objects.filter(friend_of__user=self)
+
+    def get_friend_ids(self):
+        return Friendship.objects.filter(user=self).values_list('friend_id', flat=True)
+
+    def get_stats(self):
+        return UserStats.objects.filter(user=self).first() or UserStats(user=self)
+
+    def get_friends_count(self):
+        return self.get_stats().friends_count
+
+    def get_posts_count(self):
+        return self.get_stats().posts_count
+
+    def is_friend_with(self, other):
+        return friend_cache.are_friends(self.pk, other.pk)
+
+    @classmethod
+    def by_email(cls, email):
+        """
+        Case-insensitive email lookup that uses the lower(email) unique index.
+        The index is partial (blank emails are left out), and SQLite only uses
+        it when the query repeats that condition, hence the exclude.
+        """
+        return (
+            cls.objects.exclude(email='')
+            .annotate(email_lower=Lower('email'))
+            .filter(email_lower=(email or '').strip().lower())
         )
-        return [fr.to_user if fr.from_user == self else fr.from_user for fr in accepted]
 
     class Meta:
         verbose_name = 'User Details'
         verbose_name_plural = 'Users Details'
+        constraints = [
+            models.UniqueConstraint(
+                Lower('email'),
+                condition=~Q(email=''),
+                name='accounts_user_email_ci_uniq',
+            ),
+        ]
 
 # Your existing PendingUser model
 class PendingUser(models.Model):
@@ -45,6 +83,40 @@ class PendingUser(models.Model):
     token = models.UUIDField(default=uuid.uuid4, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
+class OutboundEmail(models.Model):
+    """
+    Mail waiting to be sent by the send_outbox worker. Requests only insert
+    rows here, so they never wait on SMTP. ``next_attempt_at`` is both the
+    retry schedule and the claim lease: a worker pushes it forward when it
+    picks a row up, so a crashed worker's rows become due again on their own.
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_SENT = 'sent'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_SENT, 'Sent'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=254)
+    to = models.JSONField(default=list)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='outbox_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} -> {', '.join(self.to)} ({self.status})"
+
 # Your existing FriendRequest model
 class FriendRequest(models.Model):
     from_user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='sent_requests', on_delete=models.CASCADE)
@@ -54,9 +126,174 @@ class FriendRequest(models.Model):
 
     class Meta:
         unique_together = ('from_user', 'to_user')
+        indexes = [
+            models.Index(fields=['to_user', 'is_accepted', '-created_at'], name='friendrequest_inbox_idx'),
+            models.Index(fields=['from_user', 'is_accepted', '-created_at'], name='friendrequest_outbox_idx'),
+        ]
         def __str__(self):
             return f"{self.from_user} -> {self.to_user}"
 
+# Materialized friendship edges, one row per direction, kept in sync with
+# accepted FriendRequests so friend lookups are a range scan on (user, friend).
+class Friendship(models.Model):
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='friendships', on_delete=models.CASCADE)
+    friend = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='friend_of', on_delete=models.CASCADE)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('user', 'friend')
+        indexes = [
+            models.Index(fields=['user', '-created_at'], name='friendship_recent_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user} <-> {self.friend}"
+
+    @classmethod
+    def link(cls, user_id, friend_id):
+        cls.link_many(user_id, [friend_id])
+
+    @classmethod
+    def unlink(cls, user_id, friend_id):
+        cls.unlink_many(user_id, [friend_id])
+
+    @classmethod
+    def link_many(cls, user_id, friend_ids):
+        existing = set(cls.objects.filter(user_id=user_id, friend_id__in=friend_ids).values_list('friend_id', flat=True))
+        new_ids = [friend_id for friend_id in set(friend_ids) if friend_id not in existing]
+        edges = []
+        for friend_id in new_ids:
+            edges.append(cls(user_id=user_id, friend_id=friend_id))
+            edges.append(cls(user_id=friend_id, friend_id=user_id))
+        cls.objects.bulk_create(edges, ignore_conflicts=True)
+        if new_ids:
+            UserStats.bump(user_id, friends_count=len(new_ids))
+            UserStats.bump_many(new_ids, friends_count=1)
+            from accounts import timeline
+            defer(timeline.backfill_friends, user_id, new_ids)
+        cls._invalidate(user_id, *friend_ids)
+
+    @classmethod
+    def unlink_many(cls, user_id, friend_ids):
+        removed_ids = list(cls.objects.filter(user_id=user_id, friend_id__in=friend_ids).values_list('friend_id', flat=True))
+        cls.objects.filter(
+            Q(user_id=user_id, friend_id__in=friend_ids) | Q(user_id__in=friend_ids, friend_id=user_id)
+        ).delete()
+        if removed_ids:
+            UserStats.bump(user_id, friends_count=-len(removed_ids))
+            UserStats.bump_many(removed_ids, friends_count=-1)
+            # Trimmed in-transaction: an ex-friend's posts must not stay visible.
+            from accounts import timeline
+            timeline.trim_friends(user_id, removed_ids)
+        cls._invalidate(user_id, *friend_ids)
+
+    @staticmethod
+    def _invalidate(*user_ids):
+        # Defer until commit so a concurrent reader can't re-cache the old set.
+        transaction.on_commit(lambda: friend_cache.invalidate(*user_ids))
+
+    @classmethod
+    def sync_pair(cls, user_id, friend_id):
+        """Make the edge match the accepted FriendRequests between two users."""
+        accepted = FriendRequest.objects.filter(
+            Q(from_user_id=user_id, to_user_id=friend_id) | Q(from_user_id=friend_id, to_user_id=user_id),
+            is_accepted=True
+        ).exists()
+        if accepted:
+            cls.link(user_id, friend_id)
+        else:
+            cls.unlink(user_id, friend_id)
+        return accepted
+
+def counter_updates(deltas):
+    """
+    update() kwargs adding each delta to its counter column. Decrements are
+    clamped at zero so a drifted counter can't violate the unsigned column;
+    the reconcile commands fix the drift itself.
+    """
+    return {
+        field: F(field) + delta if delta > 0 else Greatest(F(field) + delta, 0)
+        for field, delta in deltas.items() if delta
+    }
+
+# Denormalized per-user counters for profile pages, kept current with F()
+# updates as posts, friendships and likes change. The reconcile_user_stats
+# command recomputes them from the source tables.
+class UserStats(models.Model):
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, primary_key=True, related_name='stats', on_delete=models.CASCADE)
+    posts_count = models.PositiveIntegerField(default=0)
+    friends_count = models.PositiveIntegerField(default=0)
+    likes_received_count = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'User Stats'
+        verbose_name_plural = 'User Stats'
+
+    def __str__(self):
+        return f"Stats for {self.user_id}"
+
+    @classmethod
+    def bump(cls, user_id, **deltas):
+        cls.bump_many([user_id], **deltas)
+
+    @classmethod
+    def bump_many(cls, user_ids, **deltas):
+        """Atomically add each delta (e.g. posts_count=1) to every listed user's row."""
+        updates = counter_updates(deltas)
+        if not updates or not user_ids:
+            return
+        user_ids = set(user_ids)
+        updated = cls.objects.filter(user_id__in=user_ids).update(**updates, updated_at=timezone.now())
+        if updated < len(user_ids):
+            # First counter change for some users: create their rows, then apply.
+            have = set(cls.objects.filter(user_id__in=user_ids).values_list('user_id', flat=True))
+            missing = user_ids - have
+            cls.objects.bulk_create([cls(user_id=user_id) for user_id in missing], ignore_conflicts=True)
+            cls.objects.filter(user_id__in=missing).update(**updates, updated_at=timezone.now())
+
+# Precomputed "people you may know", ranked by mutual-friend count.
+# Rebuilt in bulk by the rebuild_friend_suggestions command.
+class FriendSuggestion(models.Model):
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='friend_suggestions', on_delete=models.CASCADE)
+    candidate = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='+', on_delete=models.CASCADE)
+    mutual_count = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('user', 'candidate')
+        indexes = [
+            models.Index(fields=['user', '-mutual_count', 'candidate'], name='friend_suggestion_rank_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.candidate} for {self.user} ({self.mutual_count} mutual)"
+
+class FeedQuerySet(models.QuerySet):
+    """
+    Read model for post lists. Like and comment counts are columns on Post;
+    ``with_engagement(viewer)`` adds the author and the viewer's like/bookmark
+    state as EXISTS subqueries, so a whole page of posts is one query.
+    """
+
+    def visible(self):
+        return self.filter(is_active=True)
+
+    def with_viewer_state(self, viewer):
+        if viewer is None or not viewer.is_authenticated:
+            return self.annotate(
+                viewer_has_liked=models.Value(False, output_field=models.BooleanField()),
+                viewer_has_bookmarked=models.Value(False, output_field=models.BooleanField()),
+            )
+        return self.annotate(
+            viewer_has_liked=models.Exists(Like.objects.filter(post=models.OuterRef('pk'), user=viewer)),
+            viewer_has_bookmarked=models.Exists(Bookmark.objects.filter(post=models.OuterRef('pk'), user=viewer)),
+        )
+
+    def with_engagement(self, viewer):
+        return self.select_related('user').with_viewer_state(viewer)
+
+
 # Your existing Post model
 class Post(models.Model):
     POST_TYPES = [
@@ -71,12 +308,16 @@ class Post(models.Model):
     caption = models.TextField(max_length=500, blank=True, null=True)
     image = models.ImageField(
         upload_to='post_images/',
+        storage=media_storage,
         null=True,
         blank=True,
         validators=[FileExtensionValidator(['jpg', 'jpeg', 'png', 'gif'])]
     )
+    # Resized variants and placeholder, filled in by mediastore.images.
+    image_meta = models.JSONField(default=dict, blank=True)
     video = models.FileField(
         upload_to='post_videos/',
+        storage=media_storage,
         null=True,
         blank=True,
         validators=[FileExtensionValidator(['mp4', 'avi', 'mov', 'wmv', 'flv'])]
@@ -84,11 +325,24 @@ class Post(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     is_active = models.BooleanField(default=True)
+    # Denormalized; changed with F() in the same transaction as the Like or
+    # Comment row. reconcile_post_counters recomputes drifted values.
+    like_count = models.PositiveIntegerField(default=0)
+    comment_count = models.PositiveIntegerField(default=0)
+    # Log-space engagement score for the ranked feed; see accounts/ranking.py.
+    rank_score = models.FloatField(default=0)
+
+    objects = FeedQuerySet.as_manager()
 
     class Meta:
         ordering = ['-created_at']
         verbose_name = 'Post'
         verbose_name_plural = 'Posts'
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='post_recent_idx'),
+            models.Index(fields=['user', '-created_at', '-id'], name='post_author_recent_idx'),
+            models.Index(fields=['-rank_score', '-id'], name='post_rank_idx'),
+        ]
     def __str__(self):
         return f"{self.user.username} - {self.post_type} - {self.created_at.strftime('%Y-%m-%d %H:%M')}"
     def get_content_preview(self):
@@ -104,9 +358,70 @@ class Post(models.Model):
             return self.likes.filter(user=user).exists()
         return False
     def get_like_count(self):
-        return self.likes.count()
+        return self.like_count
     def get_comment_count(self):
-        return self.comments.count()
+        return self.comment_count
+
+    def save(self, *args, **kwargs):
+        if self._state.adding and not self.rank_score:
+            self.rank_score = ranking.initial_score(self.created_at or timezone.now())
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def bump(cls, post_id, **deltas):
+        """Atomically add each delta (e.g. like_count=1) and return the new counters."""
+        updates = counter_updates(deltas)
+        if updates:
+            cls.objects.filter(id=post_id).update(**updates)
+        return cls.objects.filter(id=post_id).values('like_count', 'comment_count').first()
+
+# Materialized home timelines: one row per (reader, post), written when a post
+# is fanned out to the author's friends. created_at is copied from the post so
+# a feed page is a range read on timeline_recent_idx. See posts/timeline.py.
+class TimelineEntry(models.Model):
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='timeline_entries', on_delete=models.CASCADE)
+    post = models.ForeignKey(Post, related_name='timeline_entries', on_delete=models.CASCADE)
+    author = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='+', on_delete=models.CASCADE)
+    created_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('user', 'post')
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-post'], name='timeline_recent_idx'),
+            models.Index(fields=['user', 'author'], name='timeline_author_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} <- post {self.post_id}"
+
+# Delivery of a new post to its author's friends' timelines, run by the
+# run_fanouts worker and retried with backoff if it fails. As in
+# OutboundEmail, ``next_attempt_at`` is both the retry schedule and the claim
+# lease. The author's own entry is written with the post, not here.
+class FanoutJob(models.Model):
+    STATUS_PENDING = 'pending'
+    STATUS_DELIVERED = 'delivered'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_DELIVERED, 'Delivered'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+    post = models.ForeignKey(Post, related_name='fanout_jobs', on_delete=models.CASCADE)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='fanout_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"Fan-out of post {self.post_id} ({self.status})"
 
 # Your existing Like model
 class Like(models.Model):
@@ -117,19 +432,67 @@ class Like(models.Model):
     class Meta:
         unique_together = ('user', 'post')
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['post', '-created_at', '-id'], name='like_post_recent_idx'),
+        ]
     def __str__(self):
         return f"{self.user.username} likes {self.post.id}"
 
 # Your existing Comment model
+# Threaded comments. ``path`` is the materialized path of the comment: each
+# ancestor's id (and finally its own) zero-padded to PATH_STEP digits and
+# terminated by '/', so sorting by path yields depth-first thread order and a
+# subtree is the range [path, path + '~') on comment_thread_idx.
 class Comment(models.Model):
+    PATH_STEP = 10
+
     user = models.ForeignKey(UserDetails, on_delete=models.CASCADE, related_name='comments')
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='comments')
+    parent = models.ForeignKey('self', null=True, blank=True, on_delete=models.CASCADE, related_name='replies')
+    depth = models.PositiveSmallIntegerField(default=0)
+    path = models.CharField(max_length=255, blank=True, default='')
+    reply_count = models.PositiveIntegerField(default=0)
     content = models.TextField(max_length=1000)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['post', 'parent', 'created_at', 'id'], name='comment_children_idx'),
+            models.Index(fields=['post', 'path'], name='comment_thread_idx'),
+        ]
+
+    @classmethod
+    def path_segment(cls, comment_id):
+        return str(comment_id).zfill(cls.PATH_STEP) + '/'
+
+    @classmethod
+    def max_depth(cls):
+        return min(getattr(settings, 'COMMENT_MAX_DEPTH', 8), 255 // (cls.PATH_STEP + 1) - 1)
+
+    @classmethod
+    def add(cls, user, post, content, parent=None):
+        """
+        Create a comment (or a reply under ``parent``) with its path filled in.
+        Call inside a transaction; the parent's reply_count is bumped too.
+        """
+        comment = cls.objects.create(
+            user=user, post=post, content=content,
+            parent=parent, depth=parent.depth + 1 if parent else 0,
+        )
+        comment.path = (parent.path if parent else '') + cls.path_segment(comment.id)
+        cls.objects.filter(id=comment.id).update(path=comment.path)
+        if parent is not None:
+            cls.objects.filter(id=parent.id).update(**counter_updates({'reply_count': 1}))
+        return comment
+
+    def subtree(self):
+        """This comment and all of its replies, in depth-first order."""
+        return Comment.objects.filter(
+            post_id=self.post_id, path__gte=self.path, path__lt=self.path + '~'
+        ).order_by('path')
+
     def __str__(self):
         return f"{self.user.username}: {self.content[:20]}..."
 
@@ -141,6 +504,9 @@ class Bookmark(models.Model):
     class Meta:
         unique_together = ('user', 'post')
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-id'], name='bookmark_recent_idx'),
+        ]
 
 # Your existing Message model
 # class Message(models.Model):
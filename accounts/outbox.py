@@ -0,0 +1,112 @@
+"""
+Email outbox.
+
+``enqueue`` stores a message in OutboundEmail and returns immediately.
+``drain`` is run by the send_outbox worker: it claims due rows in batches and
+sends each batch over one reused connection from the configured
+EMAIL_BACKEND. Failed messages are retried with exponential backoff until
+EMAIL_OUTBOX_MAX_ATTEMPTS, after which they are marked failed.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from accounts.models import OutboundEmail
+from socio.backoff import next_attempt_at
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def enqueue(subject, body, recipient_list, from_email=None):
+    return OutboundEmail.objects.create(
+        subject=subject,
+        body=body,
+        from_email=from_email or settings.DEFAULT_FROM_EMAIL,
+        to=list(recipient_list),
+    )
+
+
+def claim_batch(batch_size=None, now=None):
+    """Lease up to ``batch_size`` due messages to this worker."""
+    batch_size = batch_size or _setting('EMAIL_OUTBOX_BATCH_SIZE', 50)
+    now = now or timezone.now()
+    lease = timedelta(seconds=_setting('EMAIL_OUTBOX_LEASE', 300))
+    with transaction.atomic():
+        rows = list(
+            OutboundEmail.objects
+            .select_for_update(skip_locked=True)
+            .filter(status=OutboundEmail.STATUS_PENDING, next_attempt_at__lte=now)
+            .order_by('next_attempt_at', 'id')[:batch_size]
+        )
+        OutboundEmail.objects.filter(id__in=[row.id for row in rows]).update(next_attempt_at=now + lease)
+    return rows
+
+
+def _record_failure(row, error, now):
+    row.attempts += 1
+    row.last_error = str(error)[:2000]
+    if row.attempts >= _setting('EMAIL_OUTBOX_MAX_ATTEMPTS', 5):
+        row.status = OutboundEmail.STATUS_FAILED
+    else:
+        row.next_attempt_at = next_attempt_at(
+            now,
+            row.attempts,
+            base=_setting('EMAIL_OUTBOX_BACKOFF_BASE', 30),
+            cap=_setting('EMAIL_OUTBOX_BACKOFF_CAP', 3600),
+        )
+
+
+def send_batch(rows, connection=None):
+    """Send ``rows`` over one connection. Returns (sent, failed) counts."""
+    now = timezone.now()
+    connection = connection or get_connection(fail_silently=False)
+    sent = failed = 0
+    try:
+        connection.open()
+    except Exception as exc:
+        # Could not reach the mail server at all: every message in the batch
+        # counts as one failed attempt.
+        for row in rows:
+            _record_failure(row, exc, now)
+        failed = len(rows)
+    else:
+        try:
+            for row in rows:
+                message = EmailMessage(row.subject, row.body, row.from_email, row.to, connection=connection)
+                try:
+                    connection.send_messages([message])
+                except Exception as exc:
+                    _record_failure(row, exc, now)
+                    failed += 1
+                else:
+                    row.attempts += 1
+                    row.status = OutboundEmail.STATUS_SENT
+                    row.sent_at = timezone.now()
+                    row.last_error = ''
+                    sent += 1
+        finally:
+            connection.close()
+    OutboundEmail.objects.bulk_update(
+        rows, ['status', 'attempts', 'last_error', 'next_attempt_at', 'sent_at']
+    )
+    return sent, failed
+
+
+def drain(batch_size=None, max_batches=None, connection=None):
+    """Send due messages until none are left. Returns (sent, failed) totals."""
+    connection = connection or get_connection(fail_silently=False)
+    sent = failed = batches = 0
+    while max_batches is None or batches < max_batches:
+        rows = claim_batch(batch_size)
+        if not rows:
+            break
+        batch_sent, batch_failed = send_batch(rows, connection)
+        sent += batch_sent
+        failed += batch_failed
+        batches += 1
+    return sent, failed
@@ -0,0 +1,103 @@
+"""
+Engagement scores for the ranked home feed.
+
+A post's score is the log of its time-weighted engagement:
+
+    rank_score = ln( sum of weight(e) * 2 ** ((t(e) - EPOCH) / half_life) )
+
+The sum runs over the post itself (at its creation time) and over every
+like, comment and bookmark (at the time it happened). Each term is worth
+twice as much as one half-life older, so engagement velocity beats an old
+total. Terms are anchored to a fixed EPOCH rather than to "now". Decaying
+every score by the same factor does not change their order, so stored
+scores never have to be decayed to stay comparable. An engagement event
+therefore updates one column in place (``record``), and a ranked page is a
+range read on post_rank_idx.
+
+Scores stay in log space so they stay small: adding an event with term b
+is new = b + ln(1 + exp(old - b)).
+
+Unlikes and removed comments or bookmarks are not subtracted as they happen.
+``rescore`` (see the rescore_posts command) recomputes scores from the
+source rows and picks those up, along with weight or half-life changes.
+"""
+import math
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db.models import F, Value
+from django.db.models.functions import Exp, Ln
+from django.utils import timezone
+
+EPOCH = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+
+DEFAULT_WEIGHTS = {
+    'post': 1.0,
+    'like': 1.0,
+    'comment': 3.0,
+    'bookmark': 2.0,
+}
+
+
+def half_life():
+    return getattr(settings, 'FEED_RANK_HALF_LIFE_HOURS', 24) * 3600
+
+
+def weights():
+    return {**DEFAULT_WEIGHTS, **getattr(settings, 'FEED_RANK_WEIGHTS', {})}
+
+
+def window():
+    """Only posts this recent are candidates for a ranked home page."""
+    return timedelta(days=getattr(settings, 'FEED_RANK_WINDOW_DAYS', 7))
+
+
+def event_term(kind, at, count=1, _weights=None):
+    weight = (_weights or weights())[kind] * count
+    if weight <= 0:
+        return None
+    return math.log(weight) + math.log(2) * (at - EPOCH).total_seconds() / half_life()
+
+
+def initial_score(created_at):
+    return event_term('post', created_at)
+
+
+def log_sum(terms):
+    terms = [term for term in terms if term is not None]
+    if not terms:
+        return 0.0
+    top = max(terms)
+    return top + math.log(sum(math.exp(term - top) for term in terms))
+
+
+def record(post_id, kind, count=1):
+    """Fold ``count`` new ``kind`` events into the post's score."""
+    from accounts.models import Post
+
+    term = event_term(kind, timezone.now(), count) if count > 0 else None
+    if term is None:
+        return
+    Post.objects.filter(id=post_id).update(
+        rank_score=Value(term) + Ln(Value(1.0) + Exp(F('rank_score') - Value(term)))
+    )
+
+
+def rescore(post_ids):
+    """Recompute scores for ``post_ids`` from posts, likes, comments and bookmarks."""
+    from accounts.models import Bookmark, Comment, Like, Post
+
+    current = weights()
+    terms = {
+        post_id: [event_term('post', created_at, _weights=current)]
+        for post_id, created_at in Post.objects.filter(id__in=post_ids).values_list('id', 'created_at')
+    }
+    for kind, model in (('like', Like), ('comment', Comment), ('bookmark', Bookmark)):
+        events = model.objects.filter(post_id__in=list(terms)).values_list('post_id', 'created_at')
+        for post_id, at in events.iterator():
+            terms[post_id].append(event_term(kind, at, _weights=current))
+    Post.objects.bulk_update(
+        [Post(id=post_id, rank_score=log_sum(post_terms)) for post_id, post_terms in terms.items()],
+        ['rank_score'], batch_size=500
+    )
+    return len(terms)
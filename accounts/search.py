@@ -0,0 +1,84 @@
+"""
+People search for the typeahead box.
+
+On SQLite the query runs against the accounts_userdetails_fts FTS5 index
+(migration 0027), ranked by bm25 with username matches weighted highest.
+Other backends fall back to indexed-prefix ORM lookups. Pages are addressed
+by an opaque cursor like the friends tabs; search stops at MAX_RESULTS since
+nobody scrolls a typeahead that far.
+
+Only the local part of an email is indexed (migration 0038), so searching
+for a domain word such as "gmail" does not list everyone on that provider.
+A query that is a whole email address matches that address exactly.
+"""
+from django.db.models import Q
+
+from accounts.models import UserDetails
+from socio import fts
+from socio.pagination import InvalidCursor, decode_cursor, encode_cursor
+
+FTS_TABLE = 'accounts_userdetails_fts'
+FTS_CONTENT_TABLE = 'accounts_userdetails'
+FTS_COLUMNS = ['username', 'first_name', 'last_name', 'email']
+FTS_EXPRESSIONS = {'email': "substr({row}.email, 1, instr({row}.email || '@', '@') - 1)"}
+# bm25 weights for username, first_name, last_name, email.
+WEIGHTS = (10.0, 5.0, 5.0, 2.0)
+MAX_RESULTS = 200
+MIN_QUERY_LENGTH = 1
+
+
+def _offset(cursor):
+    if not cursor:
+        return 0
+    values = decode_cursor(cursor)
+    offset = values[0] if len(values) == 1 else None
+    # bool is a subclass of int, but true/false are not offsets.
+    if not isinstance(offset, int) or isinstance(offset, bool) or offset < 0:
+        raise InvalidCursor('Cursor does not match search')
+    return offset
+
+
+def _searchable(user, users=UserDetails.objects):
+    return users.filter(is_active=True, is_superuser=False).exclude(id=user.id)
+
+
+def _fallback_ids(user, query, limit, offset):
+    words = query.split()
+    condition = Q()
+    for word in words:
+        # istartswith on the whole address only ever matches the local part.
+        condition &= (
+            Q(username__istartswith=word) | Q(first_name__istartswith=word)
+            | Q(last_name__istartswith=word) | Q(email__istartswith=word)
+        )
+    rows = _searchable(user).filter(condition).order_by('username', 'id').values_list('id', flat=True)
+    return list(rows[offset:offset + limit])
+
+
+def search_users(user, query, cursor=None, per_page=10):
+    """Return (users, next_cursor) for ``query``, best matches first."""
+    query = (query or '').strip()
+    offset = _offset(cursor)
+    if len(query) < MIN_QUERY_LENGTH or offset >= MAX_RESULTS:
+        return [], None
+    limit = min(per_page, MAX_RESULTS - offset) + 1
+    if '@' in query:
+        ids = list(_searchable(user, UserDetails.by_email(query)).values_list('id', flat=True)[offset:offset + limit])
+    elif fts.available():
+        ids = fts.search_ids(
+            FTS_TABLE, FTS_CONTENT_TABLE, query,
+            weights=WEIGHTS,
+            where='t.is_active = 1 AND t.is_superuser = 0 AND t.id != %s',
+            params=[user.id],
+            limit=limit,
+            offset=offset,
+        )
+    else:
+        ids = _fallback_ids(user, query, limit, offset)
+
+    next_cursor = None
+    if len(ids) > per_page:
+        ids = ids[:per_page]
+        next_cursor = encode_cursor([offset + per_page])
+    found = UserDetails.objects.in_bulk(ids)
+    return [found[i] for i in ids if i in found], next_cursor
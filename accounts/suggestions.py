@@ -0,0 +1,146 @@
+"""
+"People you may know" suggestions.
+
+Mutual-friend counts are the square of the friendship adjacency matrix: for a
+user u and candidate c, (A.A)[u, c] is the number of friends they share. The
+product is computed in bulk with a self-join on Friendship grouped by
+(user, candidate), and only the top K candidates per user are stored in
+FriendSuggestion, so the discover tab reads a short indexed range. Once those
+run out the tab carries on with everyone else, newest first.
+"""
+import heapq
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Count, F, Q
+
+from accounts.models import Friendship, FriendRequest, FriendSuggestion, UserDetails
+from socio.pagination import CursorPaginator, InvalidCursor, decode_cursor, encode_cursor
+
+DEFAULT_TOP_K = 50
+
+
+def mutual_friend_counts(user_ids):
+    """Return {user_id: {candidate_id: mutual friend count}} for ``user_ids``."""
+    rows = (
+        Friendship.objects
+        .filter(user_id__in=user_ids)
+        .annotate(candidate_id=F('friend__friendships__friend_id'))
+        .values('user_id', 'candidate_id')
+        .annotate(mutual_count=Count('id'))
+        .order_by()
+    )
+    counts = defaultdict(dict)
+    for row in rows:
+        if row['candidate_id'] != row['user_id']:
+            counts[row['user_id']][row['candidate_id']] = row['mutual_count']
+    return counts
+
+
+def _blocked_ids(user_ids):
+    """Friends and users with a pending request either way, per user."""
+    blocked = defaultdict(set)
+    for user_id, friend_id in Friendship.objects.filter(user_id__in=user_ids).values_list('user_id', 'friend_id'):
+        blocked[user_id].add(friend_id)
+    pending = FriendRequest.objects.filter(
+        Q(from_user_id__in=user_ids) | Q(to_user_id__in=user_ids),
+        is_accepted=False
+    ).values_list('from_user_id', 'to_user_id')
+    for from_id, to_id in pending:
+        blocked[from_id].add(to_id)
+        blocked[to_id].add(from_id)
+    return blocked
+
+
+def rebuild_suggestions(top_k=DEFAULT_TOP_K, batch_size=500):
+    """Recompute the top-K suggestion table for every active user."""
+    user_ids = list(UserDetails.objects.filter(is_active=True).order_by('id').values_list('id', flat=True))
+    superuser_ids = set(UserDetails.objects.filter(is_superuser=True).values_list('id', flat=True))
+    total = 0
+    for start in range(0, len(user_ids), batch_size):
+        batch = user_ids[start:start + batch_size]
+        counts = mutual_friend_counts(batch)
+        blocked = _blocked_ids(batch)
+
+        rows = []
+        for user_id in batch:
+            skip = blocked[user_id] | superuser_ids | {user_id}
+            candidates = ((c, n) for c, n in counts.get(user_id, {}).items() if c not in skip)
+            for candidate_id, mutual_count in heapq.nsmallest(top_k, candidates, key=lambda cn: (-cn[1], cn[0])):
+                rows.append(FriendSuggestion(user_id=user_id, candidate_id=candidate_id, mutual_count=mutual_count))
+
+        with transaction.atomic():
+            FriendSuggestion.objects.filter(user_id__in=batch).delete()
+            FriendSuggestion.objects.bulk_create(rows, batch_size=1000)
+        total += len(rows)
+    return total
+
+
+def _excluded_for(user):
+    """Subqueries for users that must not be suggested to ``user`` right now."""
+    return (
+        Friendship.objects.filter(user=user).values('friend_id'),
+        FriendRequest.objects.filter(from_user=user, is_accepted=False).values('to_user_id'),
+        FriendRequest.objects.filter(to_user=user, is_accepted=False).values('from_user_id'),
+    )
+
+
+DISCOVER_SOURCES = ('suggested', 'recent')
+
+
+def _discover_cursor(source, cursor):
+    return encode_cursor([source, cursor or ''])
+
+
+def _split_discover_cursor(token):
+    """(source, cursor within that source) from a discover tab cursor."""
+    values = decode_cursor(token)
+    if len(values) != 2 or values[0] not in DISCOVER_SOURCES or not isinstance(values[1], str):
+        raise InvalidCursor('Malformed discover cursor')
+    return values[0], values[1] or None
+
+
+def discover_page(user, cursor=None, per_page=20):
+    """
+    Return (users, next_cursor, source) for the discover tab.
+
+    Ranked suggestions come first. When they run out (or a new account has
+    none yet) the page is topped up with the most recently joined people who
+    were not suggested. The cursor records which of the two it continues
+    from, and ``source`` is that one.
+    """
+    source, cursor = _split_discover_cursor(cursor) if cursor else ('suggested', None)
+    friends, sent, received = _excluded_for(user)
+    users = []
+    if source == 'suggested':
+        suggestions = (
+            FriendSuggestion.objects
+            .filter(user=user)
+            .exclude(candidate_id__in=friends)
+            .exclude(candidate_id__in=sent)
+            .exclude(candidate_id__in=received)
+            .select_related('candidate')
+        )
+        page = CursorPaginator(suggestions, ('-mutual_count', 'candidate_id'), per_page).get_page(cursor)
+        for suggestion in page:
+            suggestion.candidate.mutual_count = suggestion.mutual_count
+            users.append(suggestion.candidate)
+        if page.has_next:
+            return users, _discover_cursor('suggested', page.next_cursor), 'suggested'
+        source, cursor = 'recent', None
+        if len(users) == per_page:
+            return users, _discover_cursor('recent', None), 'recent'
+
+    recent = (
+        UserDetails.objects
+        .filter(is_superuser=False, is_active=True)
+        .exclude(id=user.id)
+        .exclude(id__in=friends)
+        .exclude(id__in=sent)
+        .exclude(id__in=received)
+        .exclude(id__in=FriendSuggestion.objects.filter(user=user).values('candidate_id'))
+    )
+    page = CursorPaginator(recent, ('-id',), per_page - len(users)).get_page(cursor)
+    users += page
+    next_cursor = _discover_cursor('recent', page.next_cursor) if page.has_next else None
+    return users, next_cursor, 'recent'
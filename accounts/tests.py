@@ -1,3 +1,649 @@
-from django.test import TestCase
+import tempfile
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail.backends.base import BaseEmailBackend
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts import friend_cache, outbox, suggestions, timeline
+from socio.pagination import InvalidCursor, encode_cursor
+from accounts.models import FanoutJob, FriendRequest, FriendSuggestion, Friendship, OutboundEmail, PendingUser, Post, TimelineEntry, UserDetails, UserStats
+from notifications.models import Notification
+
+
+class FailingBackend(BaseEmailBackend):
+    def send_messages(self, email_messages):
+        raise ConnectionError('SMTP server unavailable')
+
+
+class UnreachableBackend(BaseEmailBackend):
+    def open(self):
+        raise ConnectionError('Connection refused')
+
+    def send_messages(self, email_messages):
+        raise AssertionError('should not send without a connection')
+
+
+class CountingBackend(BaseEmailBackend):
+    opened = 0
+
+    def open(self):
+        CountingBackend.opened += 1
+        return True
+
+    def send_messages(self, email_messages):
+        mail.outbox.extend(email_messages)
+        return len(email_messages)
+
+
+class EmailOutboxTests(TestCase):
+    def test_signup_enqueues_instead_of_sending(self):
+        response = self.client.post(reverse('signup'), {'email': 'new@example.com', 'password': 'pw12345!'})
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(len(mail.outbox), 0)
+        queued = OutboundEmail.objects.get()
+        self.assertEqual(queued.to, ['new@example.com'])
+        self.assertEqual(queued.status, OutboundEmail.STATUS_PENDING)
+        token = str(PendingUser.objects.get(email='new@example.com').token)
+        self.assertIn(token, queued.body)
+
+    def test_drain_sends_queued_mail(self):
+        outbox.enqueue('Hello', 'Body', ['a@example.com'])
+        outbox.enqueue('Hello', 'Body', ['b@example.com'])
+
+        self.assertEqual(outbox.drain(), (2, 0))
+        self.assertEqual(sorted(m.to[0] for m in mail.outbox), ['a@example.com', 'b@example.com'])
+        self.assertFalse(OutboundEmail.objects.exclude(status=OutboundEmail.STATUS_SENT).exists())
+        self.assertEqual(outbox.drain(), (0, 0))
+
+    @override_settings(EMAIL_BACKEND='accounts.tests.CountingBackend')
+    def test_batches_reuse_one_connection(self):
+        CountingBackend.opened = 0
+        for i in range(5):
+            outbox.enqueue('Hello', 'Body', [f'user{i}@example.com'])
+
+        self.assertEqual(outbox.drain(batch_size=2), (5, 0))
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertEqual(CountingBackend.opened, 3)
+
+    @override_settings(EMAIL_BACKEND='accounts.tests.FailingBackend', EMAIL_OUTBOX_BACKOFF_BASE=60)
+    def test_failure_is_retried_with_backoff(self):
+        queued = outbox.enqueue('Hello', 'Body', ['a@example.com'])
+
+        self.assertEqual(outbox.drain(), (0, 1))
+        queued.refresh_from_db()
+        self.assertEqual(queued.status, OutboundEmail.STATUS_PENDING)
+        self.assertEqual(queued.attempts, 1)
+        self.assertIn('unavailable', queued.last_error)
+        self.assertGreater(queued.next_attempt_at, timezone.now() + timedelta(seconds=50))
+        # Not due yet, so a second pass leaves it alone.
+        self.assertEqual(outbox.drain(), (0, 0))
+
+    @override_settings(EMAIL_BACKEND='accounts.tests.UnreachableBackend', EMAIL_OUTBOX_MAX_ATTEMPTS=2)
+    def test_gives_up_after_max_attempts(self):
+        queued = outbox.enqueue('Hello', 'Body', ['a@example.com'])
+
+        for _ in range(2):
+            OutboundEmail.objects.filter(id=queued.id).update(next_attempt_at=timezone.now())
+            outbox.drain()
+        queued.refresh_from_db()
+        self.assertEqual(queued.status, OutboundEmail.STATUS_FAILED)
+        self.assertEqual(queued.attempts, 2)
+
+    def test_expired_lease_is_reclaimed(self):
+        queued = outbox.enqueue('Hello', 'Body', ['a@example.com'])
+        self.assertEqual(len(outbox.claim_batch()), 1)
+        self.assertEqual(outbox.claim_batch(), [])
+
+        later = timezone.now() + timedelta(hours=1)
+        self.assertEqual([row.id for row in outbox.claim_batch(now=later)], [queued.id])
+
+    @override_settings(EMAIL_BACKEND='django.core.mail.backends.filebased.EmailBackend')
+    def test_filebased_backend(self):
+        with tempfile.TemporaryDirectory() as path, self.settings(EMAIL_FILE_PATH=path):
+            outbox.enqueue('Hello', 'Body', ['a@example.com'])
+            self.assertEqual(outbox.drain(), (1, 0))
+
+
+class FriendsTabCursorTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = UserDetails.objects.create_user(username='paged', email='paged@example.com', password='pw')
+        for i in range(3):
+            friend = UserDetails.objects.create_user(username=f'pal{i}', email=f'pal{i}@example.com', password='pw')
+            Friendship.link(cls.user.id, friend.id)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def test_cursor_with_wrong_value_types_is_rejected(self):
+        url = reverse('friends_tab_api', args=['friends'])
+        now = timezone.now()
+        for values in ([now, 'abc'], ['yesterday', 1], [{'x': 1}, 1], [now, None], [now, True], [1.5, 1]):
+            with self.subTest(values=values):
+                self.assertEqual(self.client.get(url, {'cursor': encode_cursor(values)}).status_code, 400)
+
+        # A well-typed cursor still pages.
+        response = self.client.get(url, {'cursor': encode_cursor([now, 10 ** 9])})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['users']), 3)
+
+
+class EmailLookupTests(TestCase):
+    def test_lookup_is_case_insensitive_and_uses_the_index(self):
+        user = UserDetails.objects.create_user(username='mixed', email='Mixed.Case@Example.com', password='pw')
+        self.assertEqual(UserDetails.by_email(' mixed.case@example.COM ').get(), user)
+        plan = UserDetails.by_email('mixed.case@example.com').explain()
+        self.assertIn('accounts_user_email_ci_uniq', plan)
+        self.assertNotIn('SCAN accounts_userdetails', plan)
+
+
+class BulkFriendRequestTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = UserDetails.objects.create_user(username='bulk', email='bulk@example.com', password='pw')
+
+    def test_malformed_bodies_are_rejected(self):
+        self.client.force_login(self.user)
+        url = reverse('bulk_friend_requests')
+        for body in ('[]', '"accept"', '{"action": "accept", "user_ids": [true]}', '{"action": "accept", "user_ids": ["1"]}'):
+            with self.subTest(body=body):
+                response = self.client.post(url, body, content_type='application/json')
+                self.assertEqual(response.status_code, 400)
+                self.assertFalse(response.json()['success'])
+
+    def post(self, action, users):
+        self.client.force_login(self.user)
+        body = {'action': action, 'user_ids': [user.id for user in users]}
+        return self.client.post(reverse('bulk_friend_requests'), body, content_type='application/json')
+
+    def make_senders(self, count):
+        senders = [
+            UserDetails.objects.create_user(username=f'sender{i}', email=f'sender{i}@example.com', password='pw')
+            for i in range(count)
+        ]
+        for sender in senders:
+            FriendRequest.objects.create(from_user=sender, to_user=self.user)
+        return senders
+
+    def friend_ids(self, user):
+        return set(Friendship.objects.filter(user=user).values_list('friend_id', flat=True))
+
+    def friends_count(self, user):
+        return UserStats.objects.get(user=user).friends_count
+
+    def test_bulk_accept(self):
+        first, second, ignored, old_friend = self.make_senders(4)
+        FriendRequest.objects.filter(from_user=old_friend).update(is_accepted=True)
+        Friendship.link(self.user.id, old_friend.id)
+
+        response = self.post('accept', [first, second, old_friend])
+        self.assertEqual(response.json(), {'success': True, 'action': 'accept', 'processed': [first.id, second.id]})
+        self.assertEqual(self.friend_ids(self.user), {first.id, second.id, old_friend.id})
+        for sender in (first, second):
+            self.assertEqual(self.friend_ids(sender), {self.user.id})
+            self.assertEqual(self.friends_count(sender), 1)
+        self.assertEqual(self.friends_count(self.user), 3)
+        self.assertFalse(FriendRequest.objects.get(from_user=ignored).is_accepted)
+
+        notified = Notification.objects.filter(sender=self.user, notification_type='friend_accepted')
+        self.assertEqual(set(notified.values_list('user_id', flat=True)), {first.id, second.id})
+
+        # Accepting again changes nothing.
+        self.assertEqual(self.post('accept', [first]).json()['processed'], [])
+        self.assertEqual(self.friends_count(self.user), 3)
+        self.assertEqual(notified.count(), 2)
+
+    def test_bulk_reject(self):
+        pending, friend, mutual = self.make_senders(3)
+        FriendRequest.objects.filter(from_user__in=[friend, mutual]).update(is_accepted=True)
+        # I had also sent ``mutual`` a request that they accepted.
+        FriendRequest.objects.create(from_user=self.user, to_user=mutual, is_accepted=True)
+        Friendship.link_many(self.user.id, [friend.id, mutual.id])
+
+        response = self.post('reject', [pending, friend, mutual])
+        self.assertTrue(response.json()['success'])
+        self.assertEqual(sorted(response.json()['processed']), sorted([pending.id, friend.id, mutual.id]))
+        self.assertFalse(FriendRequest.objects.filter(to_user=self.user).exists())
+        self.assertEqual(self.friend_ids(self.user), {mutual.id})
+        self.assertEqual(self.friend_ids(friend), set())
+        self.assertEqual(self.friend_ids(mutual), {self.user.id})
+        self.assertEqual(self.friends_count(self.user), 1)
+        self.assertEqual(self.friends_count(friend), 0)
+        self.assertEqual(self.friends_count(mutual), 1)
+
+    def test_bulk_accept_is_one_transaction(self):
+        senders = self.make_senders(2)
+        with mock.patch.object(Friendship, 'link_many', side_effect=RuntimeError('boom')):
+            with self.assertRaises(RuntimeError):
+                self.post('accept', senders)
+        self.assertFalse(FriendRequest.objects.filter(to_user=self.user, is_accepted=True).exists())
+        self.assertFalse(Notification.objects.filter(sender=self.user).exists())
+        self.assertEqual(self.friend_ids(self.user), set())
+
+
+class TimelineFanoutTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = UserDetails.objects.create_user(username='writer', email='writer@example.com', password='pw')
+        cls.friends = [
+            UserDetails.objects.create_user(username=f'reader{i}', email=f'reader{i}@example.com', password='pw')
+            for i in range(2)
+        ]
+        cls.stranger = UserDetails.objects.create_user(username='stranger', email='stranger@example.com', password='pw')
+        for friend in cls.friends:
+            Friendship.link(cls.author.id, friend.id)
+
+    def timeline_of(self, user):
+        return set(TimelineEntry.objects.filter(user=user).values_list('post_id', flat=True))
+
+    def publish(self, text='hello'):
+        self.client.force_login(self.author)
+        self.client.post(reverse('posts:create_post'), {'post_type': 'text', 'text_content': text})
+        return Post.objects.filter(user=self.author).latest('id')
+
+    def test_author_entry_is_written_with_the_post(self):
+        post = self.publish()
+        self.assertEqual(self.timeline_of(self.author), {post.id})
+        self.assertEqual(self.timeline_of(self.friends[0]), set())
+        job = FanoutJob.objects.get(post=post)
+        self.assertEqual(job.status, FanoutJob.STATUS_PENDING)
+
+        self.assertEqual(timeline.drain(), (1, 0, 0))
+        for friend in self.friends:
+            self.assertEqual(self.timeline_of(friend), {post.id})
+        self.assertEqual(self.timeline_of(self.stranger), set())
+        self.assertEqual(
+            Notification.objects.filter(notification_type='new_post', related_object_id=post.id).count(), 2
+        )
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (FanoutJob.STATUS_DELIVERED, 1))
+
+    def test_publish_delivers_in_the_background_after_commit(self):
+        with self.settings(TASKS_EAGER=True), self.captureOnCommitCallbacks(execute=True):
+            post = self.publish()
+        self.assertEqual(self.timeline_of(self.friends[1]), {post.id})
+        self.assertEqual(FanoutJob.objects.get(post=post).status, FanoutJob.STATUS_DELIVERED)
+
+    def test_failed_fanout_is_retried_without_duplicates(self):
+        post = self.publish()
+        real_fanout = timeline.fanout_post
+
+        def fanout_then_fail(post_id):
+            real_fanout(post_id)
+            raise RuntimeError('database went away')
+
+        with mock.patch.object(timeline, 'fanout_post', side_effect=fanout_then_fail), self.assertLogs('accounts.timeline', 'ERROR'):
+            self.assertEqual(timeline.drain(), (0, 0, 1))
+        job = FanoutJob.objects.get(post=post)
+        self.assertEqual((job.status, job.attempts), (FanoutJob.STATUS_PENDING, 1))
+        self.assertIn('database went away', job.last_error)
+        self.assertGreater(job.next_attempt_at, timezone.now())
+        # The failed attempt's rows were rolled back with it.
+        self.assertEqual(self.timeline_of(self.friends[0]), set())
+        self.assertFalse(Notification.objects.filter(related_object_id=post.id).exists())
+        self.assertEqual(timeline.drain(), (0, 0, 0))
+
+        FanoutJob.objects.filter(id=job.id).update(next_attempt_at=timezone.now())
+        self.assertEqual(timeline.drain(), (1, 0, 0))
+        self.assertEqual(timeline.drain(), (0, 0, 0))
+        self.assertEqual(self.timeline_of(self.friends[0]), {post.id})
+        self.assertEqual(Notification.objects.filter(related_object_id=post.id).count(), 2)
+
+    @override_settings(FEED_FANOUT_MAX_ATTEMPTS=1)
+    def test_fanout_gives_up_after_max_attempts(self):
+        post = self.publish()
+        with mock.patch.object(timeline, 'fanout_post', side_effect=RuntimeError('boom')), self.assertLogs('accounts.timeline', 'ERROR'):
+            self.assertEqual(timeline.drain(), (0, 1, 0))
+        job = FanoutJob.objects.get(post=post)
+        self.assertEqual(job.status, FanoutJob.STATUS_FAILED)
+        self.assertIsNotNone(job.finished_at)
+
+    def test_expired_lease_is_claimed_again(self):
+        post = self.publish()
+        job = timeline.claim()
+        self.assertEqual(job.post_id, post.id)
+        self.assertIsNone(timeline.claim())
+        later = timezone.now() + timedelta(hours=1)
+        self.assertEqual(timeline.claim(now=later).id, job.id)
+
+    def test_high_fanout_author_is_not_fanned_out(self):
+        post = Post.objects.create(user=self.author, text_content='to everyone')
+        with self.settings(FEED_FANOUT_MAX_FRIENDS=1):
+            self.assertEqual(timeline.fanout_post(post.id), 1)
+        self.assertEqual(self.timeline_of(self.author), {post.id})
+        self.assertEqual(self.timeline_of(self.friends[0]), set())
+        # Friends are still told about the post.
+        self.assertEqual(Notification.objects.filter(related_object_id=post.id).count(), 2)
+
+    def test_inactive_post_is_not_fanned_out(self):
+        post = Post.objects.create(user=self.author, text_content='gone', is_active=False)
+        self.assertEqual(timeline.fanout_post(post.id), 0)
+        self.assertFalse(TimelineEntry.objects.filter(post=post).exists())
+
+    def test_unfriending_trims_both_timelines(self):
+        friend, other = self.friends
+        mine = Post.objects.create(user=self.author, text_content='mine')
+        theirs = Post.objects.create(user=friend, text_content='theirs')
+        unrelated = Post.objects.create(user=other, text_content='unrelated')
+        timeline.rebuild()
+        self.assertEqual(self.timeline_of(friend), {mine.id, theirs.id})
+        self.assertEqual(self.timeline_of(self.author), {mine.id, theirs.id, unrelated.id})
+
+        Friendship.unlink(self.author.id, friend.id)
+        self.assertEqual(self.timeline_of(friend), {theirs.id})
+        self.assertEqual(self.timeline_of(self.author), {mine.id, unrelated.id})
+        self.assertEqual(self.timeline_of(other), {mine.id, unrelated.id})
+
+    @override_settings(FEED_TIMELINE_BACKFILL=2)
+    def test_new_friendship_backfills_recent_posts_both_ways(self):
+        mine = [Post.objects.create(user=self.author, text_content=f'mine {i}') for i in range(3)]
+        theirs = Post.objects.create(user=self.stranger, text_content='theirs')
+        Post.objects.create(user=self.author, text_content='deleted', is_active=False)
+        timeline.rebuild()
+
+        with self.settings(TASKS_EAGER=True), self.captureOnCommitCallbacks(execute=True):
+            Friendship.link(self.author.id, self.stranger.id)
+        self.assertEqual(self.timeline_of(self.stranger), {theirs.id, mine[2].id, mine[1].id})
+        self.assertIn(theirs.id, self.timeline_of(self.author))
+
+        # Running it again adds nothing.
+        timeline.backfill_friends(self.author.id, [self.stranger.id])
+        self.assertEqual(TimelineEntry.objects.filter(user=self.stranger).count(), 3)
+        self.assertEqual(UserStats.objects.get(user=self.stranger).friends_count, 1)
+
+
+class FriendSuggestionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        names = ['me', 'amy', 'ben', 'xia', 'yan', 'zoe', 'pat']
+        cls.users = {
+            name: UserDetails.objects.create_user(username=name, email=f'{name}@example.com', password='pw')
+            for name in names
+        }
+        cls.admin = UserDetails.objects.create_superuser(username='root', email='root@example.com', password='pw')
+        u = cls.users
+        for a, b in [('me', 'amy'), ('me', 'ben'), ('amy', 'xia'), ('ben', 'xia'), ('amy', 'yan'), ('amy', 'root')]:
+            Friendship.link(u.get(a, cls.admin).id, u.get(b, cls.admin).id)
+        FriendRequest.objects.create(from_user=u['pat'], to_user=u['me'])
+
+    def test_mutual_friend_counts(self):
+        u = self.users
+        counts = suggestions.mutual_friend_counts([u['me'].id, u['xia'].id])
+        self.assertEqual(counts[u['me'].id], {u['xia'].id: 2, u['yan'].id: 1, self.admin.id: 1})
+        self.assertEqual(counts[u['xia'].id], {u['me'].id: 2, u['yan'].id: 1, self.admin.id: 1})
+
+    def test_rebuild_skips_friends_pending_requests_and_superusers(self):
+        u = self.users
+        UserDetails.objects.filter(pk=u['yan'].pk).update(is_active=False)
+        suggestions.rebuild_suggestions()
+        ranked = list(
+            FriendSuggestion.objects.filter(user=u['me'])
+            .order_by('-mutual_count', 'candidate_id').values_list('candidate_id', 'mutual_count')
+        )
+        # Inactive users get no suggestions of their own but can still be suggested.
+        self.assertEqual(ranked, [(u['xia'].id, 2), (u['yan'].id, 1)])
+        self.assertFalse(FriendSuggestion.objects.filter(user=u['yan']).exists())
+
+        self.assertEqual(suggestions.rebuild_suggestions(top_k=1), FriendSuggestion.objects.count())
+        self.assertEqual(
+            list(FriendSuggestion.objects.filter(user=u['me']).values_list('candidate_id', flat=True)), [u['xia'].id]
+        )
+
+    def test_discover_continues_into_recent_users(self):
+        u = self.users
+        suggestions.rebuild_suggestions()
+        seen, sources, cursor = [], [], None
+        while True:
+            users, cursor, source = suggestions.discover_page(u['me'], cursor, per_page=1)
+            seen += [user.id for user in users]
+            sources.append(source)
+            if cursor is None:
+                break
+        self.assertEqual(seen, [u['xia'].id, u['yan'].id, u['zoe'].id])
+        self.assertEqual(sources, ['suggested', 'recent', 'recent'])
+
+        # A page that ends the suggestions is topped up from the recent users.
+        users, cursor, source = suggestions.discover_page(u['me'], per_page=5)
+        self.assertEqual([user.id for user in users], seen)
+        self.assertEqual((cursor, source), (None, 'recent'))
+        self.assertEqual(users[0].mutual_count, 2)
+
+    def test_discover_api_pages_across_sources(self):
+        suggestions.rebuild_suggestions()
+        self.client.force_login(self.users['me'])
+        url = reverse('friends_tab_api', args=['discover'])
+        response = self.client.get(url).json()
+        names = [user['username'] for user in response['users']]
+        self.assertEqual(names, ['xia', 'yan', 'zoe'])
+        self.assertIsNone(response['next_cursor'])
+
+    def test_discover_cursor_must_name_a_source(self):
+        for values in (['ranked', ''], ['recent'], ['recent', 5]):
+            with self.subTest(values=values), self.assertRaises(InvalidCursor):
+                suggestions.discover_page(self.users['me'], encode_cursor(values))
+        self.client.force_login(self.users['me'])
+        response = self.client.get(reverse('friends_tab_api', args=['discover']), {'cursor': encode_cursor(['x', ''])})
+        self.assertEqual(response.status_code, 400)
+
+
+class UserSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.me = UserDetails.objects.create_user(username='searcher', email='searcher@gmail.com', password='pw')
+        cls.alice = UserDetails.objects.create_user(
+            username='alice', first_name='Alice', last_name='Smith', email='alice.w@gmail.com', password='pw'
+        )
+        cls.bob = UserDetails.objects.create_user(username='bob', email='bob@acme.com', password='pw')
+        for i in range(3):
+            UserDetails.objects.create_user(username=f'smith{i}', email=f'smith{i}@acme.com', password='pw')
+        UserDetails.objects.create_user(username='smithy', email='gone@acme.com', password='pw', is_active=False)
+        UserDetails.objects.create_superuser(username='smithadmin', email='admin@acme.com', password='pw')
+
+    def setUp(self):
+        self.client.force_login(self.me)
+
+    def search(self, q, **params):
+        response = self.client.get(reverse('user_search_api'), {'q': q, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def names(self, q):
+        return [user['username'] for user in self.search(q)['users']]
+
+    def test_ranked_matches(self):
+        self.assertEqual(self.names('ali'), ['alice'])
+        self.assertEqual(self.names('alice smi'), ['alice'])
+        # Username matches rank above last-name matches; inactive users and
+        # superusers are never returned.
+        self.assertEqual(self.names('smith'), ['smith0', 'smith1', 'smith2', 'alice'])
+        self.assertEqual(self.names(''), [])
+
+    def test_email_domains_are_not_searchable(self):
+        self.assertEqual(self.names('gmail'), [])
+        self.assertEqual(self.names('acme'), [])
+        self.assertEqual(self.names('alice.w'), ['alice'])
+        self.assertEqual(self.names('BOB@acme.com'), ['bob'])
+        self.assertEqual(self.names('bob@acme'), [])
+        self.assertEqual(self.names('searcher@gmail.com'), [])
+
+    def test_domain_stays_hidden_after_email_change_and_rebuild(self):
+        UserDetails.objects.filter(pk=self.bob.pk).update(email='robert@example.org')
+        self.assertEqual(self.names('robert'), ['bob'])
+        self.assertEqual(self.names('example'), [])
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(self.names('example'), [])
+        self.assertEqual(self.names('robert'), ['bob'])
+
+    def test_cursor_paging(self):
+        first = self.search('smith', limit=2)
+        self.assertEqual([user['username'] for user in first['users']], ['smith0', 'smith1'])
+        second = self.search('smith', limit=2, cursor=first['next_cursor'])
+        self.assertEqual([user['username'] for user in second['users']], ['smith2', 'alice'])
+        self.assertIsNone(second['next_cursor'])
+
+    def test_bad_cursors_are_rejected(self):
+        for values in ([True], [-1], ['2'], [1, 2]):
+            with self.subTest(values=values):
+                response = self.client.get(reverse('user_search_api'), {'q': 'smith', 'cursor': encode_cursor(values)})
+                self.assertEqual(response.status_code, 400)
+
+
+@override_settings(TASKS_EAGER=True)
+class FriendCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.me, cls.amy, cls.ben, cls.cat = [
+            UserDetails.objects.create_user(username=name, email=f'{name}@example.com', password='pw')
+            for name in ('me', 'amy', 'ben', 'cat')
+        ]
+
+    def setUp(self):
+        cache.clear()
+        friend_cache.clear()
+        friend_cache.reset_stats()
+        self.addCleanup(friend_cache.clear)
+
+    def warm(self, *users):
+        for user in users:
+            friend_cache.get_friend_ids(user.id)
+
+    def test_accepting_a_request_invalidates_both_sides(self):
+        FriendRequest.objects.create(from_user=self.amy, to_user=self.me)
+        self.warm(self.me, self.amy)
+        self.client.force_login(self.me)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('accept_request', args=[self.amy.id]))
+        self.assertTrue(friend_cache.are_friends(self.me.id, self.amy.id))
+        self.assertTrue(friend_cache.are_friends(self.amy.id, self.me.id))
+
+    def test_rejecting_a_request_invalidates_both_sides(self):
+        FriendRequest.objects.create(from_user=self.amy, to_user=self.me, is_accepted=True)
+        Friendship.link(self.me.id, self.amy.id)
+        self.warm(self.me, self.amy)
+        self.assertTrue(friend_cache.are_friends(self.me.id, self.amy.id))
+
+        self.client.force_login(self.me)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('reject_request', args=[self.amy.id]))
+        self.assertFalse(friend_cache.are_friends(self.me.id, self.amy.id))
+        self.assertFalse(friend_cache.are_friends(self.amy.id, self.me.id))
+
+    def test_unlink_many_invalidates_every_side(self):
+        Friendship.link_many(self.me.id, [self.amy.id, self.ben.id, self.cat.id])
+        self.warm(self.me, self.amy, self.ben, self.cat)
+        with self.captureOnCommitCallbacks(execute=True):
+            Friendship.unlink_many(self.me.id, [self.amy.id, self.ben.id])
+        self.assertEqual(friend_cache.get_friend_ids(self.me.id), {self.cat.id})
+        self.assertEqual(friend_cache.get_friend_ids(self.amy.id), frozenset())
+        self.assertEqual(friend_cache.get_friend_ids(self.ben.id), frozenset())
+        self.assertEqual(friend_cache.get_friend_ids(self.cat.id), {self.me.id})
+
+    def test_invalidation_waits_for_commit(self):
+        self.warm(self.me)
+        with self.captureOnCommitCallbacks() as callbacks:
+            Friendship.link(self.me.id, self.amy.id)
+            # A reader inside the transaction must not cache the new set early.
+            self.assertEqual(friend_cache.get_friend_ids(self.me.id), frozenset())
+        for callback in callbacks:
+            callback()
+        self.assertEqual(friend_cache.get_friend_ids(self.me.id), {self.amy.id})
+
+    def test_stats_count_hits_and_misses(self):
+        Friendship.link(self.me.id, self.amy.id)
+        friend_cache.get_friend_ids(self.me.id)      # miss
+        friend_cache.get_friend_ids(self.me.id)      # local hit
+        friend_cache.clear()
+        friend_cache.get_friend_ids(self.me.id)      # shared hit
+        friend_cache.invalidate(self.me.id, self.amy.id)
+        friend_cache.get_friend_ids(self.me.id)      # miss
+        self.assertEqual(friend_cache.get_stats(), {
+            'local_hits': 1, 'shared_hits': 1, 'misses': 2, 'invalidations': 2,
+            'local_entries': 1, 'hit_ratio': 0.5,
+        })
+
+        with self.settings(FRIEND_CACHE_LOCAL_TTL=0):
+            friend_cache.get_friend_ids(self.ben.id)
+            friend_cache.get_friend_ids(self.ben.id)
+        self.assertEqual(friend_cache.get_stats()['shared_hits'], 2)
+
+    def test_stats_endpoint_is_staff_only(self):
+        url = reverse('friend_cache_stats')
+        self.client.force_login(self.me)
+        self.assertEqual(self.client.get(url).status_code, 403)
+        UserDetails.objects.filter(pk=self.me.pk).update(is_staff=True)
+        friend_cache.get_friend_ids(self.me.id)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['misses'], 1)
+
+
+@override_settings(TASKS_EAGER=True)
+class FriendshipEdgeTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.ann, cls.bea, cls.cal, cls.dan = [
+            UserDetails.objects.create_user(username=name, email=f'{name}@example.com', password='pw')
+            for name in ('ann', 'bea', 'cal', 'dan')
+        ]
+
+    def edges(self):
+        return set(Friendship.objects.values_list('user_id', 'friend_id'))
+
+    def test_link_and_unlink_write_both_directions(self):
+        Friendship.link(self.ann.id, self.bea.id)
+        Friendship.link(self.bea.id, self.ann.id)
+        self.assertEqual(self.edges(), {(self.ann.id, self.bea.id), (self.bea.id, self.ann.id)})
+        self.assertEqual(UserStats.objects.get(user=self.ann).friends_count, 1)
+        self.assertEqual(UserStats.objects.get(user=self.bea).friends_count, 1)
+
+        Friendship.unlink(self.bea.id, self.ann.id)
+        Friendship.unlink(self.ann.id, self.bea.id)
+        self.assertEqual(self.edges(), set())
+        self.assertEqual(UserStats.objects.get(user=self.ann).friends_count, 0)
+
+    def test_sync_pair_follows_accepted_requests(self):
+        request = FriendRequest.objects.create(from_user=self.bea, to_user=self.ann)
+        self.assertFalse(Friendship.sync_pair(self.ann.id, self.bea.id))
+        self.assertEqual(self.edges(), set())
+
+        request.is_accepted = True
+        request.save()
+        self.assertTrue(Friendship.sync_pair(self.ann.id, self.bea.id))
+        self.assertEqual(self.edges(), {(self.ann.id, self.bea.id), (self.bea.id, self.ann.id)})
+
+        request.delete()
+        self.assertFalse(Friendship.sync_pair(self.bea.id, self.ann.id))
+        self.assertEqual(self.edges(), set())
+
+    def test_backfill_is_idempotent(self):
+        FriendRequest.objects.create(from_user=self.ann, to_user=self.bea, is_accepted=True)
+        FriendRequest.objects.create(from_user=self.cal, to_user=self.ann, is_accepted=True)
+        FriendRequest.objects.create(from_user=self.dan, to_user=self.ann)
+        # An edge for an already-linked pair and a stale one with no accepted request.
+        Friendship.objects.bulk_create([
+            Friendship(user=self.ann, friend=self.bea),
+            Friendship(user=self.bea, friend=self.cal),
+            Friendship(user=self.cal, friend=self.bea),
+        ])
+        expected = {
+            (self.ann.id, self.bea.id), (self.bea.id, self.ann.id),
+            (self.ann.id, self.cal.id), (self.cal.id, self.ann.id),
+        }
+
+        out = StringIO()
+        call_command('backfill_friendships', stdout=out)
+        self.assertEqual(self.edges(), expected)
+        self.assertIn('3 created, 2 removed, 4 total', out.getvalue())
+
+        out = StringIO()
+        call_command('backfill_friendships', batch_size=1, stdout=out)
+        self.assertEqual(self.edges(), expected)
+        self.assertIn('0 created, 0 removed, 4 total', out.getvalue())
@@ -0,0 +1,301 @@
+"""
+Fan-out-on-write home timelines.
+
+When a post is created, ``enqueue_fanout`` writes the author's own
+TimelineEntry in the same transaction, so the author sees the post at once,
+and queues a FanoutJob. ``fanout_post`` then writes one TimelineEntry per
+friend, so the home feed becomes an indexed range read of a single user's
+rows instead of an IN query over every friend's posts.
+
+The job is kicked off in the background as soon as the post commits. If that
+run fails, or the process dies first, the row stays due and the run_fanouts
+worker retries it with exponential backoff until FEED_FANOUT_MAX_ATTEMPTS.
+A job's timeline rows, notifications and status are committed together, so
+a retry never notifies anyone twice.
+
+Authors with more than FEED_FANOUT_MAX_FRIENDS friends are not fanned out:
+writing that many rows per post costs more than it saves. Their posts are
+pulled at read time instead and merged into the page (fan-out-on-read), so a
+reader's feed is their timeline rows plus the recent posts of the few
+high-fanout friends they have.
+
+Hard-deleted posts drop out through the cascade. Unfriending trims both
+timelines inside the same transaction, and a new friendship backfills each
+side with the other's recent posts. ``rebuild`` recomputes everything from
+scratch (see the rebuild_timelines command).
+
+The ranked mode (``HomeTimeline.get_ranked_page``) reuses the same rows: the
+candidates are the reader's timeline entries inside the ranking window plus
+the pulled authors' posts, ordered by the posts' engagement score.
+"""
+import heapq
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from accounts import ranking
+from accounts.models import FanoutJob, Friendship, Post, TimelineEntry, UserStats
+from socio.backoff import next_attempt_at
+from socio.pagination import CursorPage, CursorPaginator, encode_cursor
+from socio.tasks import defer
+
+logger = logging.getLogger(__name__)
+
+
+def fanout_limit():
+    return getattr(settings, 'FEED_FANOUT_MAX_FRIENDS', 5000)
+
+
+def backfill_limit():
+    return getattr(settings, 'FEED_TIMELINE_BACKFILL', 50)
+
+
+def _high_fanout_ids(user_ids):
+    return set(
+        UserStats.objects.filter(user_id__in=user_ids, friends_count__gt=fanout_limit())
+        .values_list('user_id', flat=True)
+    )
+
+
+def _entries(post, reader_ids):
+    return [
+        TimelineEntry(user_id=reader_id, post_id=post.id, author_id=post.user_id, created_at=post.created_at)
+        for reader_id in reader_ids
+    ]
+
+
+def fanout_post(post_id):
+    """Deliver a new post to its author's and friends' timelines."""
+    from notifications.models import Notification
+
+    post = Post.objects.filter(id=post_id, is_active=True).select_related('user').first()
+    if post is None:
+        return 0
+    friend_ids = list(Friendship.objects.filter(user_id=post.user_id).values_list('friend_id', flat=True))
+    reader_ids = [post.user_id]
+    if post.user_id not in _high_fanout_ids([post.user_id]):
+        reader_ids += friend_ids
+    TimelineEntry.objects.bulk_create(_entries(post, reader_ids), batch_size=1000, ignore_conflicts=True)
+
+    Notification.objects.bulk_create([
+        Notification(
+            user_id=friend_id,
+            sender_id=post.user_id,
+            notification_type='new_post',
+            content=f"{post.user.username} posted a new {post.post_type}.",
+            related_object_id=post.id
+        )
+        for friend_id in friend_ids
+    ], batch_size=1000)
+    return len(reader_ids)
+
+
+def enqueue_fanout(post):
+    """Add ``post`` to its author's timeline and queue delivery to friends. Call inside the post's transaction."""
+    TimelineEntry.objects.bulk_create(_entries(post, [post.user_id]), ignore_conflicts=True)
+    job = FanoutJob.objects.create(post=post)
+    defer(deliver, job.id)
+    return job
+
+
+def claim(job_id=None, now=None):
+    """Lease a due job (``job_id`` only, if given) to this worker, or return None."""
+    now = now or timezone.now()
+    lease = timedelta(seconds=getattr(settings, 'FEED_FANOUT_LEASE', 300))
+    due = FanoutJob.objects.filter(status=FanoutJob.STATUS_PENDING, next_attempt_at__lte=now)
+    if job_id is not None:
+        due = due.filter(id=job_id)
+    for job in due.order_by('next_attempt_at', 'id')[:10]:
+        # Only one worker can move a job off the lease it saw.
+        claimed = FanoutJob.objects.filter(
+            id=job.id, status=job.status, next_attempt_at=job.next_attempt_at
+        ).update(next_attempt_at=now + lease)
+        if claimed:
+            job.next_attempt_at = now + lease
+            return job
+    return None
+
+
+def _record_failure(job, error, now):
+    job.attempts += 1
+    job.last_error = str(error)[:2000]
+    if job.attempts >= getattr(settings, 'FEED_FANOUT_MAX_ATTEMPTS', 5):
+        job.status = FanoutJob.STATUS_FAILED
+        job.finished_at = now
+    else:
+        job.next_attempt_at = next_attempt_at(
+            now,
+            job.attempts,
+            base=getattr(settings, 'FEED_FANOUT_BACKOFF_BASE', 30),
+            cap=getattr(settings, 'FEED_FANOUT_BACKOFF_CAP', 3600),
+        )
+
+
+def run(job):
+    """Make one attempt at a claimed ``job`` and save the outcome."""
+    now = timezone.now()
+    try:
+        # The status commits with the rows, so a delivered job never reruns
+        # and nobody is notified twice.
+        with transaction.atomic():
+            fanout_post(job.post_id)
+            FanoutJob.objects.filter(id=job.id).update(
+                status=FanoutJob.STATUS_DELIVERED, attempts=job.attempts + 1, last_error='', finished_at=now
+            )
+    except Exception as exc:
+        logger.exception("Fan-out of post %s failed", job.post_id)
+        _record_failure(job, exc, timezone.now())
+        job.save(update_fields=['status', 'attempts', 'last_error', 'next_attempt_at', 'finished_at'])
+    else:
+        job.attempts += 1
+        job.status = FanoutJob.STATUS_DELIVERED
+        job.last_error = ''
+        job.finished_at = now
+    return job
+
+
+def deliver(job_id):
+    """Run ``job_id`` now if it is still due; the run_fanouts worker picks it up otherwise."""
+    job = claim(job_id)
+    if job is not None:
+        run(job)
+
+
+def drain(max_jobs=None):
+    """Run due jobs until none are left. Returns (delivered, failed, rescheduled) counts."""
+    delivered = failed = rescheduled = 0
+    while max_jobs is None or delivered + failed + rescheduled < max_jobs:
+        job = claim()
+        if job is None:
+            break
+        run(job)
+        if job.status == FanoutJob.STATUS_DELIVERED:
+            delivered += 1
+        elif job.status == FanoutJob.STATUS_FAILED:
+            failed += 1
+        else:
+            rescheduled += 1
+    return delivered, failed, rescheduled
+
+
+def backfill_friends(user_id, friend_ids):
+    """Copy recent posts across newly linked friendships, in both directions."""
+    limit = backfill_limit()
+    pulled = _high_fanout_ids([user_id, *friend_ids])
+    entries = []
+    for friend_id in friend_ids:
+        for reader_id, author_id in ((user_id, friend_id), (friend_id, user_id)):
+            if author_id in pulled:
+                continue
+            recent = Post.objects.filter(user_id=author_id, is_active=True).order_by('-created_at')[:limit]
+            for post in recent:
+                entries += _entries(post, [reader_id])
+    TimelineEntry.objects.bulk_create(entries, batch_size=1000, ignore_conflicts=True)
+
+
+def trim_friends(user_id, friend_ids):
+    """Remove each side's posts from the other's timeline after unfriending."""
+    TimelineEntry.objects.filter(
+        Q(user_id=user_id, author_id__in=friend_ids) | Q(user_id__in=friend_ids, author_id=user_id)
+    ).delete()
+
+
+def remove_post(post_id):
+    TimelineEntry.objects.filter(post_id=post_id).delete()
+
+
+def rebuild(user_ids=None, batch_size=1000):
+    """Recompute timelines from posts and friendships. Returns rows written."""
+    readers = Friendship.objects.all()
+    posts = Post.objects.filter(is_active=True).order_by('id')
+    if user_ids is not None:
+        readers = readers.filter(user_id__in=user_ids)
+        TimelineEntry.objects.filter(user_id__in=user_ids).delete()
+    else:
+        TimelineEntry.objects.all().delete()
+    followers = {}
+    for reader_id, author_id in readers.values_list('user_id', 'friend_id'):
+        followers.setdefault(author_id, []).append(reader_id)
+    pulled = _high_fanout_ids(list(followers))
+
+    total = 0
+    batch = []
+    for post in posts.only('id', 'user_id', 'created_at').iterator():
+        reader_ids = [] if post.user_id in pulled else list(followers.get(post.user_id, []))
+        if user_ids is None or post.user_id in user_ids:
+            reader_ids.append(post.user_id)
+        batch += _entries(post, reader_ids)
+        if len(batch) >= batch_size:
+            TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
+            total += len(batch)
+            batch = []
+    TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
+    return total + len(batch)
+
+
+class HomeTimeline:
+    """
+    A user's home feed, newest first, paged by (created_at, post id) cursors.
+    Each page merges a range of the user's timeline rows with the posts of
+    high-fanout friends, which were never fanned out.
+    """
+
+    def __init__(self, user):
+        self.user = user
+        self.pulled_ids = list(
+            Friendship.objects.filter(user=user, friend__stats__friends_count__gt=fanout_limit())
+            .values_list('friend_id', flat=True)
+        )
+
+    def _timeline_keys(self):
+        return (
+            TimelineEntry.objects
+            .filter(user=self.user, post__is_active=True)
+            .values('created_at', 'post_id')
+        )
+
+    def _pulled_keys(self):
+        # Skip posts already delivered before the author crossed the threshold.
+        return (
+            Post.objects
+            .filter(user_id__in=self.pulled_ids, is_active=True)
+            .exclude(timeline_entries__user=self.user)
+            .values('created_at', 'id')
+        )
+
+    def get_page(self, cursor=None, per_page=10):
+        page = CursorPaginator(self._timeline_keys(), ('-created_at', '-post_id'), per_page).get_page(cursor)
+        keys = [(row['created_at'], row['post_id']) for row in page]
+        has_more = page.has_next
+        if self.pulled_ids:
+            pulled = CursorPaginator(self._pulled_keys(), ('-created_at', '-id'), per_page).get_page(cursor)
+            keys = list(heapq.merge(keys, [(row['created_at'], row['id']) for row in pulled], reverse=True))
+            has_more = has_more or pulled.has_next
+        has_more = has_more or len(keys) > per_page
+        keys = keys[:per_page]
+
+        ids = [post_id for _, post_id in keys]
+        posts = Post.objects.filter(id__in=ids).with_engagement(self.user).in_bulk()
+        next_cursor = encode_cursor(list(keys[-1])) if has_more and keys else None
+        return CursorPage([posts[post_id] for post_id in ids if post_id in posts], next_cursor)
+
+    # Ranked mode: the same candidates, limited to the ranking window and
+    # ordered by Post.rank_score. Scores move as engagement comes in, so a
+    # post can occasionally repeat or be skipped across pages.
+    RANKED_ORDERING = ('-rank_score', '-id')
+
+    def _ranked_posts(self):
+        since = timezone.now() - ranking.window()
+        delivered = TimelineEntry.objects.filter(user=self.user, created_at__gte=since).values('post_id')
+        candidates = Q(id__in=delivered)
+        if self.pulled_ids:
+            candidates |= Q(user_id__in=self.pulled_ids)
+        return Post.objects.filter(candidates, is_active=True, created_at__gte=since)
+
+    def get_ranked_page(self, cursor=None, per_page=10):
+        posts = self._ranked_posts().with_engagement(self.user)
+        return CursorPaginator(posts, self.RANKED_ORDERING, per_page).get_page(cursor)
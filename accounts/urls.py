@@ -18,11 +18,15 @@ urlpatterns = [
     # path('reject-request/<int:user_id>/', views.reject_request, name='reject_request'),
 
      path('friends/', views.friends_page, name='friends'),
+    path('friends/api/<str:tab>/', views.friends_tab_api, name='friends_tab_api'),
     path('send-request/<int:user_id>/', views.send_friend_request, name='send_request'),
     path('accept-request/<int:user_id>/', views.accept_request, name='accept_request'),
     path('reject-request/<int:user_id>/', views.reject_request, name='reject_request'),
+    path('search/', views.user_search_api, name='user_search_api'),
+    path('friend-requests/bulk/', views.bulk_friend_requests, name='bulk_friend_requests'),
     path('user-profile/<int:user_id>/', views.user_profile_view, name='user_profile'),
 
     path('profile/', views.profile_view, name='profile'),
+    path('friend-cache/stats/', views.friend_cache_stats, name='friend_cache_stats'),
 
 ]
\ No newline at end of file
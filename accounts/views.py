@@ -1,18 +1,23 @@
 from django.urls import reverse
-from django.core.mail import send_mail
 from django.conf import settings
 import uuid
 from django.contrib.auth import authenticate, login,logout,get_user_model
-from django.db import IntegrityError
+from django.db import IntegrityError, transaction
 from django.contrib import messages
 from django.contrib.auth import get_user_model
 from django.db.models import Q
 from django.shortcuts import render, redirect, get_object_or_404
-from .models import UserDetails, FriendRequest, PendingUser # Import Notification
+from .models import UserDetails, FriendRequest, Friendship, PendingUser # Import Notification
 from .forms import UserDetailsForm
+from . import friend_cache, outbox
+from .suggestions import discover_page
+from .search import search_users
+from socio.pagination import CursorPaginator, InvalidCursor
+from mediastore import images
 from django.contrib.auth.decorators import login_required
 from django.views.decorators.http import require_POST # For API views
 from django.http import JsonResponse
+import json
 
 from notifications.models import Notification  # Import Notification model
 def auth_page(request):
@@ -22,22 +27,22 @@ def signup(request):
     if request.method == 'POST':
         email = request.POST['email']
         password = request.POST['password']
-        if UserDetails.objects.filter(email=email).exists():
+        if UserDetails.by_email(email).exists():
             messages.error(request, 'Email already exists!')
         elif PendingUser.objects.filter(email=email).exists():
             messages.warning(request, 'Confirmation link already sent to your email.')
         else:
-            pending_user = PendingUser.objects.create(email=email, password=password)
-            confirmation_url = request.build_absolute_uri(
-                reverse('confirm_email', kwargs={'token': str(pending_user.token)})
-            )
-            send_mail(
-                subject='Confirm your Socio account',
-                message=f'Click the link to confirm your email and activate your account: {confirmation_url}',
-                from_email=settings.DEFAULT_FROM_EMAIL,
-                recipient_list=[email],
-                fail_silently=False
-            )
+            with transaction.atomic():
+                pending_user = PendingUser.objects.create(email=email, password=password)
+                confirmation_url = request.build_absolute_uri(
+                    reverse('confirm_email', kwargs={'token': str(pending_user.token)})
+                )
+                # Queued for the send_outbox worker; the request never waits on SMTP.
+                outbox.enqueue(
+                    subject='Confirm your Socio account',
+                    body=f'Click the link to confirm your email and activate your account: {confirmation_url}',
+                    recipient_list=[email],
+                )
             messages.success(request, 'Confirmation email sent! Please check your inbox.')
     return redirect('auth_page')
 
@@ -46,7 +51,7 @@ def signin(request):
         email = request.POST['email']
         password = request.POST['password']
         try:
-            user = UserDetails.objects.get(email=email)
+            user = UserDetails.by_email(email).get()
         except UserDetails.DoesNotExist:
             messages.error(request, 'Invalid email or password!')
             return redirect('auth_page')
@@ -62,7 +67,7 @@ def signin(request):
 def confirm_email(request, token):
     try:
         pending_user = PendingUser.objects.get(token=token)
-        if UserDetails.objects.filter(email=pending_user.email).exists():
+        if UserDetails.by_email(pending_user.email).exists():
             messages.info(request, "Account already activated.")
         else:
             UserDetails.objects.create_user(
@@ -160,46 +165,93 @@ def confirm_email(request, token):
 # def user_logout(request):
 #     logout(request)
 #     return redirect('auth_page')
+FRIEND_TABS = ('friends', 'requests', 'sent', 'discover')
+FRIENDS_PAGE_SIZE = 20
+
+def _friends_tab_page(user, tab, cursor=None):
+    """One keyset-paginated slice of a friends page tab: (users, next_cursor, source)."""
+    if tab == 'discover':
+        return discover_page(user, cursor=cursor, per_page=FRIENDS_PAGE_SIZE)
+    if tab == 'friends':
+        rows = Friendship.objects.filter(user=user).select_related('friend')
+        page = CursorPaginator(rows, ('-created_at', '-id'), FRIENDS_PAGE_SIZE).get_page(cursor)
+        return [fr.friend for fr in page], page.next_cursor, None
+    if tab == 'requests':
+        rows = FriendRequest.objects.filter(to_user=user, is_accepted=False).select_related('from_user')
+        page = CursorPaginator(rows, ('-created_at', '-id'), FRIENDS_PAGE_SIZE).get_page(cursor)
+        return [fr.from_user for fr in page], page.next_cursor, None
+    rows = FriendRequest.objects.filter(from_user=user, is_accepted=False).select_related('to_user')
+    page = CursorPaginator(rows, ('-created_at', '-id'), FRIENDS_PAGE_SIZE).get_page(cursor)
+    return [fr.to_user for fr in page], page.next_cursor, None
+
 @login_required
 def friends_page(request):
     current_user = request.user
-    sent_requests = FriendRequest.objects.filter(
-        from_user=current_user,
-        is_accepted=False
-    ).select_related('to_user')
-    received_requests = FriendRequest.objects.filter(
-        to_user=current_user,
-        is_accepted=False
-    ).select_related('from_user')
-    friends = FriendRequest.objects.filter(
-        (Q(from_user=current_user) | Q(to_user=current_user)) &
-        Q(is_accepted=True)
-    ).select_related('from_user', 'to_user')
-    friend_list = []
-    for fr in friends:
-        if fr.from_user == current_user:
-            friend_list.append(fr.to_user)
-        else:
-            friend_list.append(fr.from_user)
-    excluded_ids = (
-        [fr.to_user.id for fr in sent_requests] +
-        [fr.from_user.id for fr in received_requests] +
-        [user.id for user in friend_list] +
-        [current_user.id]
-    )
-    discover_users = UserDetails.objects.filter(is_superuser=False).exclude(id__in=excluded_ids)
-
- 
     active_tab = request.GET.get('tab', 'friends')
+    if active_tab not in FRIEND_TABS:
+        active_tab = 'friends'
+    try:
+        tab_users, tab_cursor, _ = _friends_tab_page(current_user, active_tab, request.GET.get('cursor'))
+    except InvalidCursor:
+        tab_users, tab_cursor, _ = _friends_tab_page(current_user, active_tab)
+
     context = {
-        'discover_users': discover_users,
-        'sent_requests': [fr.to_user for fr in sent_requests],
-        'received_requests': [fr.from_user for fr in received_requests],
-        'friends': friend_list,
         'active_tab': active_tab,
+        'tab_users': tab_users,
+        'tab_cursor': tab_cursor,
+        'friends_count': current_user.get_friends_count(),
+        'received_count': FriendRequest.objects.filter(to_user=current_user, is_accepted=False).count(),
+        'sent_count': FriendRequest.objects.filter(from_user=current_user, is_accepted=False).count(),
     }
     return render(request, 'accounts/friends.html', context)
 
+@login_required
+def friends_tab_api(request, tab):
+    """JSON slice of one friends page tab, for infinite scroll."""
+    if tab not in FRIEND_TABS:
+        return JsonResponse({'success': False, 'error': 'Unknown tab'}, status=404)
+    try:
+        users, next_cursor, source = _friends_tab_page(request.user, tab, request.GET.get('cursor'))
+    except InvalidCursor:
+        return JsonResponse({'success': False, 'error': 'Invalid cursor'}, status=400)
+    return JsonResponse({
+        'success': True,
+        'users': [{
+            'id': user.id,
+            'username': user.username,
+            'first_name': user.first_name,
+            'profile_photo': images.avatar_url(user),
+            'mutual_count': getattr(user, 'mutual_count', None),
+        } for user in users],
+        'next_cursor': next_cursor,
+        'source': source,
+    })
+
+@login_required
+def user_search_api(request):
+    """Ranked people search for typeahead: ?q=<text>&cursor=<token>."""
+    try:
+        per_page = min(int(request.GET.get('limit', 10)), 50)
+    except ValueError:
+        per_page = 10
+    try:
+        users, next_cursor = search_users(request.user, request.GET.get('q', ''), request.GET.get('cursor'), max(per_page, 1))
+    except InvalidCursor:
+        return JsonResponse({'success': False, 'error': 'Invalid cursor'}, status=400)
+    friend_ids = friend_cache.get_friend_ids(request.user.id)
+    return JsonResponse({
+        'success': True,
+        'users': [{
+            'id': user.id,
+            'username': user.username,
+            'first_name': user.first_name,
+            'last_name': user.last_name,
+            'profile_photo': images.avatar_url(user),
+            'is_friend': user.id in friend_ids,
+        } for user in users],
+        'next_cursor': next_cursor,
+    })
+
 @login_required
 def send_friend_request(request, user_id):
     to_user = UserDetails.objects.get(id=user_id)
@@ -226,6 +278,7 @@ def accept_request(request, user_id):
     if not req.is_accepted:
         req.is_accepted = True
         req.save()
+        Friendship.link(req.from_user_id, req.to_user_id)
         # Create notification using your existing Notification model
         from notifications.models import Notification
         Notification.objects.create(
@@ -242,9 +295,61 @@ def accept_request(request, user_id):
 @login_required
 def reject_request(request, user_id):
     FriendRequest.objects.filter(from_user_id=user_id, to_user=request.user).delete()
+    Friendship.sync_pair(user_id, request.user.id)
     next_tab = request.POST.get('next_tab', 'requests')
     return redirect(f"{reverse('friends')}?tab={next_tab}")
 
+BULK_REQUEST_LIMIT = 500
+
+@login_required
+@require_POST
+def bulk_friend_requests(request):
+    """Accept or reject many incoming friend requests in a single transaction."""
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({'success': False, 'error': 'Invalid JSON in request body'}, status=400)
+    if not isinstance(data, dict):
+        return JsonResponse({'success': False, 'error': 'Request body must be a JSON object'}, status=400)
+
+    action = data.get('action')
+    user_ids = data.get('user_ids')
+    if action not in ('accept', 'reject'):
+        return JsonResponse({'success': False, 'error': "action must be 'accept' or 'reject'"}, status=400)
+    # bool is a subclass of int, but true/false are not user ids.
+    if not isinstance(user_ids, list) or not all(isinstance(i, int) and not isinstance(i, bool) for i in user_ids):
+        return JsonResponse({'success': False, 'error': 'user_ids must be a list of integers'}, status=400)
+    if len(user_ids) > BULK_REQUEST_LIMIT:
+        return JsonResponse({'success': False, 'error': f'At most {BULK_REQUEST_LIMIT} requests at once'}, status=400)
+
+    me = request.user
+    with transaction.atomic():
+        incoming = FriendRequest.objects.filter(to_user=me, from_user_id__in=user_ids)
+        if action == 'accept':
+            pending = list(incoming.filter(is_accepted=False).values_list('id', 'from_user_id'))
+            FriendRequest.objects.filter(id__in=[req_id for req_id, _ in pending]).update(is_accepted=True)
+            Notification.objects.bulk_create([
+                Notification(
+                    user_id=from_id,
+                    sender=me,
+                    notification_type='friend_accepted',
+                    content=f"{me.username} accepted your friend request.",
+                    related_object_id=req_id
+                ) for req_id, from_id in pending
+            ])
+            processed = [from_id for _, from_id in pending]
+            Friendship.link_many(me.id, processed)
+        else:
+            processed = list(incoming.values_list('from_user_id', flat=True))
+            incoming.delete()
+            # Pairs where I had also sent an accepted request stay friends.
+            still_friends = set(FriendRequest.objects.filter(
+                from_user=me, to_user_id__in=processed, is_accepted=True
+            ).values_list('to_user_id', flat=True))
+            Friendship.unlink_many(me.id, [i for i in processed if i not in still_friends])
+
+    return JsonResponse({'success': True, 'action': action, 'processed': processed})
+
 # @login_required
 # def user_profile_view(request, user_id):
 #     user = get_object_or_404(UserDetails, id=user_id)
@@ -280,6 +385,7 @@ def user_profile_view(request, user_id):
     ).exists()
     
     posts = user.get_posts() if is_friend else None
+    stats = user.get_stats()
     
     context = {
         'profile_user': user,
@@ -287,8 +393,9 @@ def user_profile_view(request, user_id):
         'has_sent_request': has_sent_request,
         'has_received_request': has_received_request,
         'posts': posts,
-        'posts_count': user.get_posts_count(),
-        'friends_count': user.get_friends_count(),
+        'posts_count': stats.posts_count,
+        'friends_count': stats.friends_count,
+        'likes_received_count': stats.likes_received_count,
     }
     return render(request, 'accounts/user_profile.html', context)
 
@@ -296,23 +403,32 @@ def user_logout(request):
     logout(request)
     return redirect('auth_page')
 
+@login_required
+def friend_cache_stats(request):
+    if not request.user.is_staff:
+        return JsonResponse({'error': 'Permission denied'}, status=403)
+    return JsonResponse(friend_cache.get_stats())
+
 @login_required
 def profile_view(request):
     user = request.user
-    friends = user.get_friends()
-    post = user.get_posts().filter(is_active=True)
-    posts_count = post.count()
-    friends_count = len(friends)
+    stats = user.get_stats()
+    posts_count = stats.posts_count
+    friends_count = stats.friends_count
     if request.method == 'POST':
         if 'remove_profile_photo' in request.POST:
             if user.profile_photo:
-                user.profile_photo.delete(save=False)
+                # Only clear the field: saving releases the blob reference
+                # (mediastore.signals). Deleting through the file as well
+                # would release it twice and free a blob others still use.
                 user.profile_photo = None
                 user.save()
             return redirect('profile')
         form = UserDetailsForm(request.POST, request.FILES, instance=user)
         if form.is_valid():
             form.save()
+            if 'profile_photo' in form.changed_data:
+                images.schedule(user, 'profile_photo')
             return redirect('profile')
     else:
         form = UserDetailsForm(instance=user)
@@ -322,5 +438,6 @@ def profile_view(request):
         'member_since': user.date_joined.strftime("%b %Y"),
         'user': user,
         'post_count': posts_count,
+        'likes_received_count': stats.likes_received_count,
     }
     return render(request, 'profile.html', context)
@@ -2,6 +2,7 @@ import json
 from channels.generic.websocket import AsyncWebsocketConsumer
 from django.contrib.auth import get_user_model
 from asgiref.sync import sync_to_async
+from . import presence
 
 User = get_user_model()
 
@@ -19,6 +20,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
           self.channel_name
       )
       await self.accept()
+      await sync_to_async(presence.connect)(self.user.id)
 
   async def disconnect(self, close_code):
       if self.user.is_authenticated:
@@ -26,6 +28,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
               self.user_channel_name,
               self.channel_name
           )
+          await sync_to_async(presence.disconnect)(self.user.id)
 
   async def receive(self, text_data):
       """
@@ -0,0 +1,19 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from accounts.models import UserDetails
+
+
+class Command(BaseCommand):
+    help = "Clear is_online for users whose last heartbeat has expired."
+
+    def handle(self, *args, **options):
+        # Web processes write last_seen up to one flush interval late, so a
+        # user only counts as gone once both the TTL and that lag have passed.
+        grace = getattr(settings, 'PRESENCE_TTL', 90) + getattr(settings, 'PRESENCE_FLUSH_INTERVAL', 60)
+        cutoff = timezone.now() - timedelta(seconds=grace)
+        expired = UserDetails.objects.filter(is_online=True).exclude(last_seen__gte=cutoff).update(is_online=False)
+        self.stdout.write(self.style.SUCCESS(f"Marked {expired} users offline."))
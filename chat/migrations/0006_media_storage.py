@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:40
+
+import chat.models
+import mediastore.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0005_message_deleted_at_message_deleted_for_everyone_and_more'),
+    ]
+
+    # Only the storage backend changes, which has no database effect; a real
+    # AlterField would make SQLite rebuild the whole message table.
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AlterField(
+                    model_name='message',
+                    name='file_attachment',
+                    field=models.FileField(blank=True, null=True, storage=mediastore.storage.media_storage, upload_to=chat.models.user_directory_path),
+                ),
+            ],
+        ),
+    ]
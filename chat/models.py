@@ -2,6 +2,7 @@ from django.db import models
 from django.contrib.auth import get_user_model
 from django.utils import timezone
 from accounts.models import UserDetails
+from mediastore.storage import media_storage
 from django.conf import settings
 import os
 
@@ -42,7 +43,7 @@ class Message(models.Model):
     receiver = models.ForeignKey(UserDetails, on_delete=models.CASCADE, related_name='received_messages')
     content = models.TextField(blank=True, null=True)
     message_type = models.CharField(max_length=10, choices=MESSAGE_TYPE_CHOICES, default=MESSAGE_TYPE_TEXT)
-    file_attachment = models.FileField(upload_to=user_directory_path, blank=True, null=True)
+    file_attachment = models.FileField(upload_to=user_directory_path, storage=media_storage, blank=True, null=True)
     file_name = models.CharField(max_length=255, blank=True, null=True)
     file_size = models.PositiveIntegerField(blank=True, null=True)
     timestamp = models.DateTimeField(default=timezone.now)
@@ -57,6 +58,10 @@ class Message(models.Model):
 
     class Meta:
         ordering = ['timestamp']
+        indexes = [
+            # serve_media looks attachments up by file name to check access.
+            models.Index(fields=['file_attachment'], name='message_attachment_idx'),
+        ]
 
     def __str__(self):
         if self.message_type == self.MESSAGE_TYPE_TEXT:
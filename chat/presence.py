@@ -0,0 +1,185 @@
+"""
+Online presence.
+
+Heartbeats live in the Django cache, not in UserDetails rows. The cache
+must be shared by every server process for them to agree on who is online;
+the default CACHES in settings is process-local (see the note there). Until
+it is, ``get_presence`` falls back to the flushed UserDetails row for users
+this cache has not seen, which lags by up to one flush interval.
+
+* ``presence:online:<id>`` is set on every heartbeat with a PRESENCE_TTL
+  timeout, so a user who stops sending heartbeats drops offline on their own.
+* ``presence:seen:<id>`` holds the last heartbeat time for "last seen" labels.
+* ``presence:conns:<id>`` counts open chat websockets. Closing the last one
+  marks the user offline right away.
+
+``last_seen`` and ``is_online`` are still written to the database for other
+readers, but only in batches. Changes are buffered in the web process. A
+timer started by the first buffered change flushes them with a single
+bulk_update PRESENCE_FLUSH_INTERVAL seconds later, or at once when
+PRESENCE_FLUSH_BATCH are waiting. The buffer is also flushed when the
+process exits. Each process holds its own buffer, so only that process can
+flush it; the expire_presence command works from the database alone.
+"""
+import atexit
+import logging
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+_pending = {}  # user_id -> (last_seen datetime, is_online)
+_lock = threading.Lock()
+_timer = None
+
+
+def _ttl():
+    return getattr(settings, 'PRESENCE_TTL', 90)
+
+
+def _flush_interval():
+    return getattr(settings, 'PRESENCE_FLUSH_INTERVAL', 60)
+
+
+def _flush_batch_size():
+    return getattr(settings, 'PRESENCE_FLUSH_BATCH', 500)
+
+
+def _online_key(user_id):
+    return f"presence:online:{user_id}"
+
+
+def _seen_key(user_id):
+    return f"presence:seen:{user_id}"
+
+
+def _conns_key(user_id):
+    return f"presence:conns:{user_id}"
+
+
+def _buffer(user_id, now, is_online):
+    with _lock:
+        _pending[user_id] = (datetime.fromtimestamp(now, tz=dt_timezone.utc), is_online)
+        full = len(_pending) >= _flush_batch_size()
+    _schedule(now=full)
+
+
+def _schedule(now=False):
+    global _timer
+    if getattr(settings, 'TASKS_EAGER', False):
+        flush()
+        return
+    with _lock:
+        if _timer is not None:
+            if not now:
+                return
+            _timer.cancel()
+        _timer = threading.Timer(0 if now else _flush_interval(), _run_flush)
+        _timer.daemon = True
+        _timer.start()
+
+
+def _run_flush():
+    global _timer
+    with _lock:
+        _timer = None
+    close_old_connections()
+    try:
+        flush()
+    except Exception:
+        logger.exception("Presence flush failed")
+    finally:
+        close_old_connections()
+
+
+def heartbeat(user_id):
+    """Record that ``user_id`` is active right now."""
+    now = time.time()
+    cache.set(_online_key(user_id), now, _ttl())
+    cache.set(_seen_key(user_id), now, None)
+    _buffer(user_id, now, True)
+    return datetime.fromtimestamp(now, tz=dt_timezone.utc)
+
+
+def connect(user_id):
+    cache.add(_conns_key(user_id), 0, None)
+    cache.incr(_conns_key(user_id))
+    return heartbeat(user_id)
+
+
+def disconnect(user_id):
+    try:
+        remaining = cache.decr(_conns_key(user_id))
+    except ValueError:
+        remaining = 0
+    if remaining > 0:
+        return
+    now = time.time()
+    cache.delete_many([_online_key(user_id), _conns_key(user_id)])
+    cache.set(_seen_key(user_id), now, None)
+    _buffer(user_id, now, False)
+
+
+def get_presence(users):
+    """
+    Return {user_id: {'is_online': bool, 'last_seen': datetime or None}} for
+    the given user objects, falling back to the stored last_seen column.
+    """
+    keys = []
+    for user in users:
+        keys += [_online_key(user.id), _seen_key(user.id)]
+    found = cache.get_many(keys)
+    stale_before = datetime.now(tz=dt_timezone.utc) - timedelta(seconds=_ttl() + _flush_interval())
+    presence = {}
+    for user in users:
+        seen = found.get(_seen_key(user.id))
+        if seen:
+            presence[user.id] = {
+                'is_online': _online_key(user.id) in found,
+                'last_seen': datetime.fromtimestamp(seen, tz=dt_timezone.utc),
+            }
+        else:
+            # Not seen through this cache, e.g. connected to another process
+            # when the cache is not shared: trust the flushed row while fresh.
+            presence[user.id] = {
+                'is_online': bool(user.is_online and user.last_seen and user.last_seen >= stale_before),
+                'last_seen': user.last_seen,
+            }
+    return presence
+
+
+def apply_presence(users):
+    """Overwrite is_online/last_seen on user instances (not saved) for display."""
+    presence = get_presence(users)
+    for user in users:
+        user.is_online = presence[user.id]['is_online']
+        user.last_seen = presence[user.id]['last_seen']
+    return users
+
+
+def flush():
+    """Write this process's buffered last_seen/is_online changes with one bulk_update."""
+    from accounts.models import UserDetails
+
+    with _lock:
+        pending = dict(_pending)
+        _pending.clear()
+    if not pending:
+        return 0
+    rows = [
+        UserDetails(id=user_id, last_seen=last_seen, is_online=is_online)
+        for user_id, (last_seen, is_online) in pending.items()
+    ]
+    UserDetails.objects.bulk_update(rows, ['last_seen', 'is_online'], batch_size=_flush_batch_size())
+    return len(rows)
+
+
+@atexit.register
+def _flush_at_exit():
+    if _pending:
+        _run_flush()
@@ -1,3 +1,68 @@
-from django.test import TestCase
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from accounts.models import UserDetails
+from chat import presence
+
+
+@override_settings(TASKS_EAGER=False)
+class PresenceFlushTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = UserDetails.objects.create_user(username='alice', email='alice@example.com', password='pw')
+
+    def setUp(self):
+        cache.clear()
+        presence._pending.clear()
+        self.addCleanup(presence._pending.clear)
+
+    def test_heartbeat_is_written_by_the_timer_without_another_heartbeat(self):
+        with mock.patch.object(presence.threading, 'Timer') as timer:
+            presence.heartbeat(self.user.id)
+        timer.assert_called_once_with(presence._flush_interval(), presence._run_flush)
+        presence._timer = None
+
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.is_online)
+        timer.call_args.args[1]()
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.is_online)
+        self.assertEqual(presence._pending, {})
+
+    def test_pending_presence_is_flushed_at_exit(self):
+        with mock.patch.object(presence, '_schedule'):
+            presence.disconnect(self.user.id)
+        UserDetails.objects.filter(pk=self.user.pk).update(is_online=True)
+        presence._flush_at_exit()
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.is_online)
+
+    def test_expire_presence_marks_stale_users_offline(self):
+        stale = timezone.now() - timedelta(hours=1)
+        UserDetails.objects.filter(pk=self.user.pk).update(is_online=True, last_seen=stale)
+        out = StringIO()
+        call_command('expire_presence', stdout=out)
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.is_online)
+        self.assertIn("Marked 1 users offline", out.getvalue())
+
+    def test_presence_falls_back_to_a_fresh_database_row(self):
+        now = timezone.now()
+        UserDetails.objects.filter(pk=self.user.pk).update(is_online=True, last_seen=now)
+        self.user.refresh_from_db()
+        self.assertTrue(presence.get_presence([self.user])[self.user.id]['is_online'])
+
+        UserDetails.objects.filter(pk=self.user.pk).update(last_seen=now - timedelta(hours=1))
+        self.user.refresh_from_db()
+        self.assertFalse(presence.get_presence([self.user])[self.user.id]['is_online'])
+
+        # A heartbeat seen through the cache wins over the row.
+        with mock.patch.object(presence, '_schedule'):
+            presence.heartbeat(self.user.id)
+        self.assertTrue(presence.get_presence([self.user])[self.user.id]['is_online'])
@@ -9,6 +9,7 @@ urlpatterns = [
     path('api/messages/<int:friend_id>/', views.get_messages_api, name='get_messages_api'),
     path('api/messages/send/', views.send_message_api, name='send_message_api'),
     path('api/messages/send-file/', views.send_file_api, name='send_file_api'),
+    path('api/messages/send-upload/', views.send_upload_api, name='send_upload_api'),
     path('api/messages/send-voice/', views.send_voice_api, name='send_voice_api'),  # New voice endpoint
     path('api/messages/delete/<int:message_id>/', views.delete_message_api, name='delete_message_api'),  # New delete endpoint
     path('api/status/update/', views.update_user_status_api, name='update_user_status_api'),
@@ -9,6 +9,8 @@ from django.views.decorators.http import require_POST
 from django.views.decorators.csrf import csrf_protect
 from django.utils import timezone
 from notifications.models import Notification
+from accounts.friend_cache import are_friends
+from . import presence
 import datetime
 import os
 from django.core.files.storage import default_storage
@@ -16,8 +18,12 @@ from django.conf import settings
 import mimetypes
 from django.core.files.base import ContentFile
 import base64
+from django.db import transaction
+from mediastore import uploads
 
 User = get_user_model()
+# Allowance for multipart boundaries and form fields around the file itself.
+MULTIPART_OVERHEAD = 64 * 1024
 
 @login_required
 def chat_view(request, friend_id=None):
@@ -25,12 +31,10 @@ def chat_view(request, friend_id=None):
     Renders the main chat page, displaying friends and the chat history with a selected friend.
     """
     user = request.user
-    user.is_online = True
-    user.last_seen = timezone.now()
-    user.save()
+    presence.heartbeat(user.id)
 
     friends_data = []
-    friends = user.get_friends()
+    friends = presence.apply_presence(list(user.get_friends()))
     for friend in friends:
         # Get unread count (excluding deleted messages)
         unread_count = Message.objects.filter(
@@ -65,7 +69,7 @@ def chat_view(request, friend_id=None):
     if friend_id:
         try:
             selected_friend = User.objects.get(id=friend_id)
-            if selected_friend not in user.get_friends():
+            if not are_friends(user.id, selected_friend.id):
                 selected_friend = None
             else:
                 # Get messages excluding deleted ones
@@ -111,7 +115,7 @@ def get_messages_api(request, friend_id):
     user = request.user
     try:
         friend = User.objects.get(id=friend_id)
-        if friend not in user.get_friends():
+        if not are_friends(user.id, friend.id):
             return JsonResponse({'error': 'Not your friend'}, status=403)
 
         # Mark messages from this friend as read
@@ -229,13 +233,83 @@ def send_message_api(request):
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
+def _message_type_for(file_name):
+    """Determine message type based on file extension"""
+    file_extension = os.path.splitext(file_name)[1].lower()
+    if file_extension in ['.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp']:
+        return Message.MESSAGE_TYPE_IMAGE
+    elif file_extension in ['.mp4', '.avi', '.mov', '.wmv', '.flv', '.webm', '.mkv']:
+        return Message.MESSAGE_TYPE_VIDEO
+    elif file_extension in ['.mp3', '.wav', '.ogg', '.m4a', '.aac', '.flac']:
+        return Message.MESSAGE_TYPE_AUDIO
+    return Message.MESSAGE_TYPE_DOCUMENT
+
+def _send_file_message(sender, receiver, file_obj, caption):
+    """Create the file message and its notification; returns the JSON payload."""
+    message_type = _message_type_for(file_obj.name)
+    message = Message.objects.create(
+        sender=sender,
+        receiver=receiver,
+        content=caption,
+        message_type=message_type,
+        file_attachment=file_obj,
+        file_name=file_obj.name,
+        file_size=file_obj.size,
+        status=Message.STATUS_SENT
+    )
+
+    # Create a notification for the receiver
+    file_type_display = message_type.capitalize()
+    notification_content = f"{sender.username} sent you a {file_type_display.lower()}"
+    if caption:
+        notification_content += f": \"{caption[:30]}{'...' if len(caption) > 30 else ''}\""
+
+    Notification.objects.create(
+        user=receiver,
+        sender=sender,
+        notification_type='message',
+        content=notification_content,
+        related_object_id=message.id
+    )
+
+    return {
+        'success': True,
+        'message': 'File sent successfully',
+        'id': message.id,
+        'sender_id': message.sender.id,
+        'receiver_id': message.receiver.id,
+        'content': message.content,
+        'message_type': message.message_type,
+        'file_name': message.file_name,
+        'file_size': message.file_size,
+        'file_size_display': message.get_file_size_display(),
+        'file_url': message.file_attachment.url,
+        'is_image': message.is_image(),
+        'is_video': message.is_video(),
+        'is_audio': message.is_audio(),
+        'is_voice': message.is_voice(),
+        'timestamp': message.timestamp.isoformat(),
+        'is_read': message.is_read,
+        'status': message.status,
+    }
+
 @require_POST
 @login_required
 @csrf_protect
 def send_file_api(request):
     """
-    API endpoint to send a file message.
+    API endpoint to send a file message. Files larger than one upload chunk
+    go through the resumable upload endpoints and send_upload_api instead.
     """
+    max_file_size = uploads.max_size('chat_attachment')
+    try:
+        # Reject oversized bodies from the header, before the upload is read.
+        content_length = int(request.META.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        content_length = 0
+    if content_length > max_file_size + MULTIPART_OVERHEAD:
+        return JsonResponse({'error': f'File size exceeds {max_file_size // (1024 * 1024)}MB limit'}, status=413)
+
     try:
         receiver_id = request.POST.get('receiver_id')
         file_obj = request.FILES.get('file')
@@ -248,72 +322,48 @@ def send_file_api(request):
         sender = request.user
 
         # Validate file size (max 50MB)
-        max_file_size = 50 * 1024 * 1024  # 50MB
         if file_obj.size > max_file_size:
-            return JsonResponse({'error': 'File size exceeds 50MB limit'}, status=400)
-
-        # Determine message type based on file extension
-        file_extension = os.path.splitext(file_obj.name)[1].lower()
-        if file_extension in ['.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp']:
-            message_type = Message.MESSAGE_TYPE_IMAGE
-        elif file_extension in ['.mp4', '.avi', '.mov', '.wmv', '.flv', '.webm', '.mkv']:
-            message_type = Message.MESSAGE_TYPE_VIDEO
-        elif file_extension in ['.mp3', '.wav', '.ogg', '.m4a', '.aac', '.flac']:
-            message_type = Message.MESSAGE_TYPE_AUDIO
-        else:
-            message_type = Message.MESSAGE_TYPE_DOCUMENT
-
-        message = Message.objects.create(
-            sender=sender,
-            receiver=receiver,
-            content=caption,
-            message_type=message_type,
-            file_attachment=file_obj,
-            file_name=file_obj.name,
-            file_size=file_obj.size,
-            status=Message.STATUS_SENT
-        )
-
-        # Create a notification for the receiver
-        file_type_display = message_type.capitalize()
-        notification_content = f"{sender.username} sent you a {file_type_display.lower()}"
-        if caption:
-            notification_content += f": \"{caption[:30]}{'...' if len(caption) > 30 else ''}\""
+            return JsonResponse({'error': f'File size exceeds {max_file_size // (1024 * 1024)}MB limit'}, status=400)
 
-        Notification.objects.create(
-            user=receiver,
-            sender=sender,
-            notification_type='message',
-            content=notification_content,
-            related_object_id=message.id
-        )
-
-        return JsonResponse({
-            'success': True,
-            'message': 'File sent successfully',
-            'id': message.id,
-            'sender_id': message.sender.id,
-            'receiver_id': message.receiver.id,
-            'content': message.content,
-            'message_type': message.message_type,
-            'file_name': message.file_name,
-            'file_size': message.file_size,
-            'file_size_display': message.get_file_size_display(),
-            'file_url': message.file_attachment.url,
-            'is_image': message.is_image(),
-            'is_video': message.is_video(),
-            'is_audio': message.is_audio(),
-            'is_voice': message.is_voice(),
-            'timestamp': message.timestamp.isoformat(),
-            'is_read': message.is_read,
-            'status': message.status,
-        }, status=201)
+        return JsonResponse(_send_file_message(sender, receiver, file_obj, caption), status=201)
 
     except User.DoesNotExist:
         return JsonResponse({'error': 'Receiver not found'}, status=404)
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
+@require_POST
+@login_required
+@csrf_protect
+def send_upload_api(request):
+    """
+    API endpoint to send a file message from a finished chunked upload
+    (see mediastore.uploads). Retrying after a lost response returns the
+    same message instead of sending it twice.
+    """
+    try:
+        data = json.loads(request.body)
+        if not isinstance(data, dict):
+            return JsonResponse({'error': 'Request body must be a JSON object'}, status=400)
+        receiver = User.objects.get(id=data.get('receiver_id'))
+        session = uploads.get_session(request.user, data.get('upload_id'))
+        if session.purpose != session.PURPOSE_CHAT_ATTACHMENT:
+            raise uploads.UploadError('Upload is not a chat attachment')
+        if session.status == session.STATUS_COMPLETE:
+            return JsonResponse(session.result['message'], status=201)
+        with uploads.finishing(session, data.get('sha256')) as upload:
+            with transaction.atomic():
+                payload = _send_file_message(request.user, receiver, upload, data.get('caption', ''))
+                uploads.complete(session, {'message_id': payload['id'], 'message': payload})
+        return JsonResponse(payload, status=201)
+
+    except uploads.UploadError as exc:
+        return JsonResponse({'error': exc.message}, status=exc.status)
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON in request body'}, status=400)
+    except (User.DoesNotExist, ValueError):
+        return JsonResponse({'error': 'Receiver not found'}, status=404)
+
 @require_POST
 @login_required
 @csrf_protect
@@ -486,11 +536,8 @@ def update_user_status_api(request):
     """
     API endpoint to update the current user's online status and last seen timestamp.
     """
-    user = request.user
-    user.is_online = True
-    user.last_seen = timezone.now()
-    user.save()
-    return JsonResponse({'status': 'online', 'last_seen': user.last_seen.isoformat()})
+    last_seen = presence.heartbeat(request.user.id)
+    return JsonResponse({'status': 'online', 'last_seen': last_seen.isoformat()})
 
 @login_required
 def get_friend_statuses_api(request):
@@ -499,7 +546,7 @@ def get_friend_statuses_api(request):
     """
     user = request.user
     friend_statuses = []
-    for friend in user.get_friends():
+    for friend in presence.apply_presence(list(user.get_friends())):
         unread_count = Message.objects.filter(
             sender=friend,
             receiver=user,
@@ -523,7 +570,7 @@ def media_view(request, friend_id):
     user = request.user
     try:
         friend = User.objects.get(id=friend_id)
-        if friend not in user.get_friends():
+        if not are_friends(user.id, friend.id):
             return render(request, 'chat/error.html', {'error': 'Not your friend'})
 
         # Get images and videos (excluding deleted messages)
@@ -551,7 +598,7 @@ def documents_view(request, friend_id):
     user = request.user
     try:
         friend = User.objects.get(id=friend_id)
-        if friend not in user.get_friends():
+        if not are_friends(user.id, friend.id):
             return render(request, 'chat/error.html', {'error': 'Not your friend'})
 
         # Get documents (excluding deleted messages)
@@ -579,7 +626,7 @@ def links_view(request, friend_id):
     user = request.user
     try:
         friend = User.objects.get(id=friend_id)
-        if friend not in user.get_friends():
+        if not are_friends(user.id, friend.id):
             return render(request, 'chat/error.html', {'error': 'Not your friend'})
 
         # Get messages containing links (simple regex pattern, excluding deleted messages)
@@ -0,0 +1,214 @@
+"""
+Responsive image variants for post images and profile photos.
+
+After an upload, ``schedule(instance, field)`` queues ``process`` on the
+background pool (socio.tasks), so the request never waits on Pillow. The
+job reads the original once and writes resized copies at fixed widths in
+WebP and JPEG, stored under ``<upload dir>/variants/``. EXIF orientation is
+applied before resizing, and the metadata is not copied into the variants.
+Originals are left untouched, but templates only link the variants once
+they exist.
+
+The job also records the oriented size of the original and a ~16px blurred
+WebP as a data URI, for use as a placeholder while the real image loads.
+The result goes into the model's ``<field>_meta`` JSON column:
+
+    {"source": "post_images/a.jpg", "width": 3000, "height": 2000,
+     "placeholder": "data:image/webp;base64,...",
+     "variants": [{"width": 320, "height": 213,
+                   "webp": "post_images/variants/a_320.webp",
+                   "jpeg": "post_images/variants/a_320.jpg"}, ...]}
+
+``source`` ties the metadata to one file: after the image is replaced, the
+old metadata no longer matches and is ignored until the new file has been
+processed. Animated GIFs get dimensions and a placeholder but no variants,
+since resizing them here would drop the animation. The process_images
+command backfills existing media.
+"""
+import base64
+import io
+import logging
+import os
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageFilter, ImageOps
+
+from socio.tasks import defer
+
+logger = logging.getLogger(__name__)
+
+# (app label.model, image field) pairs that get variants, and their widths.
+FIELDS = {
+    ('accounts.Post', 'image'): 'MEDIA_POST_IMAGE_WIDTHS',
+    ('accounts.UserDetails', 'profile_photo'): 'MEDIA_AVATAR_WIDTHS',
+}
+DEFAULT_WIDTHS = {
+    'MEDIA_POST_IMAGE_WIDTHS': (320, 640, 1080),
+    'MEDIA_AVATAR_WIDTHS': (48, 96, 192),
+}
+PLACEHOLDER_WIDTH = 16
+
+
+def widths_for(model_label, field):
+    setting = FIELDS[(model_label, field)]
+    return tuple(getattr(settings, setting, DEFAULT_WIDTHS[setting]))
+
+
+def _quality():
+    return getattr(settings, 'MEDIA_IMAGE_QUALITY', 80)
+
+
+def current_meta(field_file, meta):
+    """The stored metadata if it describes the file currently in the field."""
+    if field_file and meta and meta.get('source') == field_file.name:
+        return meta
+    return None
+
+
+def variant_url(field_file, meta, width):
+    """URL of the smallest JPEG variant at least ``width`` wide, else the original."""
+    if not field_file:
+        return None
+    meta = current_meta(field_file, meta)
+    variants = (meta or {}).get('variants') or []
+    for variant in variants:
+        if variant['width'] >= width:
+            return default_storage.url(variant['jpeg'])
+    if variants:
+        return default_storage.url(variants[-1]['jpeg'])
+    return field_file.url
+
+
+def avatar_url(user, width=96):
+    return variant_url(user.profile_photo, user.profile_photo_meta, width)
+
+
+def schedule(instance, field):
+    """Queue variant generation for ``instance.<field>`` once the transaction commits."""
+    if getattr(instance, field):
+        defer(process, instance._meta.label, instance.pk, field)
+
+
+def _variant_name(source, width, ext):
+    directory, filename = os.path.split(source)
+    stem = os.path.splitext(filename)[0]
+    return os.path.join(directory, 'variants', f'{stem}_{width}.{ext}')
+
+
+def delete_variants(source):
+    """Remove every variant generated from ``source``."""
+    directory, filename = os.path.split(source)
+    variants_dir = os.path.join(directory, 'variants')
+    prefix = os.path.splitext(filename)[0] + '_'
+    try:
+        _, files = default_storage.listdir(variants_dir)
+    except FileNotFoundError:
+        return
+    for name in files:
+        if name.startswith(prefix):
+            default_storage.delete(os.path.join(variants_dir, name))
+
+
+def _encode(image, fmt, **options):
+    buffer = io.BytesIO()
+    image.save(buffer, fmt, **options)
+    return buffer.getvalue()
+
+
+def _normalize(image):
+    """Convert palette, CMYK, 16-bit and similar modes to RGB or RGBA."""
+    has_alpha = image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info
+    return image.convert('RGBA' if has_alpha else 'RGB')
+
+
+def _flatten(image):
+    """JPEG has no alpha channel: composite transparent images onto white."""
+    if image.mode != 'RGBA':
+        return image
+    background = Image.new('RGB', image.size, (255, 255, 255))
+    background.paste(image, mask=image.getchannel('A'))
+    return background
+
+
+def _placeholder(image):
+    height = max(1, round(image.height * PLACEHOLDER_WIDTH / image.width))
+    tiny = _flatten(image).resize((PLACEHOLDER_WIDTH, height), Image.Resampling.BILINEAR)
+    tiny = tiny.filter(ImageFilter.GaussianBlur(1))
+    data = _encode(tiny, 'WEBP', quality=30)
+    return 'data:image/webp;base64,' + base64.b64encode(data).decode()
+
+
+def render_variants(source_name, widths):
+    """
+    Read ``source_name`` from storage, write its variants and return the
+    metadata dict (without saving it anywhere).
+    """
+    with default_storage.open(source_name, 'rb') as handle:
+        image = Image.open(handle)
+        width, height = image.size
+        if image.getexif().get(0x0112) in (5, 6, 7, 8):
+            # Rotated a quarter turn by its EXIF orientation.
+            width, height = height, width
+        animated = getattr(image, 'n_frames', 1) > 1
+        if image.format == 'JPEG':
+            # Let the decoder downscale by a power of two while reading, which
+            # is far cheaper than decoding a 12MP photo at full size.
+            image.draft('RGB', (max(widths), max(widths)))
+        image = _normalize(ImageOps.exif_transpose(image))
+
+    meta = {
+        'source': source_name,
+        'width': width,
+        'height': height,
+        'placeholder': _placeholder(image),
+        'variants': [],
+    }
+    if animated:
+        return meta
+
+    targets = sorted({w for w in widths if w < width} or {width})
+    quality = _quality()
+    for target in targets:
+        target_height = max(1, round(height * target / width))
+        resized = image.resize((target, target_height), Image.Resampling.LANCZOS)
+        variant = {'width': target, 'height': target_height}
+        for ext, fmt, frame in (('webp', 'WEBP', resized), ('jpg', 'JPEG', _flatten(resized))):
+            name = _variant_name(source_name, target, ext)
+            if default_storage.exists(name):
+                default_storage.delete(name)
+            options = {'quality': quality}
+            if fmt == 'JPEG':
+                options.update(optimize=True, progressive=True)
+            else:
+                options.update(method=4)
+            variant['webp' if ext == 'webp' else 'jpeg'] = default_storage.save(
+                name, ContentFile(_encode(frame, fmt, **options))
+            )
+        meta['variants'].append(variant)
+    return meta
+
+
+def process(model_label, pk, field, force=False):
+    """Generate variants for one row's image field. Returns the new metadata, if any."""
+    model = apps.get_model(model_label)
+    meta_field = f'{field}_meta'
+    row = model.objects.filter(pk=pk).values(field, meta_field).first()
+    if row is None or not row[field]:
+        return None
+    source = row[field]
+    if not force and (row[meta_field] or {}).get('source') == source:
+        return row[meta_field]
+    try:
+        meta = render_variants(source, widths_for(model_label, field))
+    except (OSError, Image.DecompressionBombError, ValueError) as exc:
+        logger.warning("Could not process %s %s.%s (%s): %s", model_label, pk, field, source, exc)
+        return None
+    # Only attach the result if the image was not replaced in the meantime.
+    updated = model.objects.filter(pk=pk, **{field: source}).update(**{meta_field: meta})
+    if updated and model_label == 'accounts.Post':
+        from posts import card_cache
+        card_cache.invalidate(model.objects.get(pk=pk))
+    return meta
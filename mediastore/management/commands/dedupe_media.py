@@ -0,0 +1,181 @@
+import os
+import shutil
+from collections import Counter
+from datetime import timedelta
+
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from mediastore import images, storage
+from mediastore.models import Blob
+
+# Where files were written before DedupStorage; only used with --delete-unreferenced.
+LEGACY_DIRS = ('post_images', 'post_videos', 'profile_photos', 'chat_files')
+# Blobs younger than this may belong to a save still in flight, so they are never freed.
+GRACE = timedelta(hours=1)
+
+
+class Command(BaseCommand):
+    help = (
+        "Move media saved before content-addressed storage into blobs/, pointing every "
+        "row at one copy per unique file, then recount blob references and delete blobs "
+        "nothing points at. Safe to re-run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Report what would change without touching files or rows.")
+        parser.add_argument(
+            '--delete-unreferenced', action='store_true',
+            help="Also delete files in the old upload directories that no row points at.",
+        )
+
+    def handle(self, *args, **options):
+        self.store = storage.media_storage()
+        self.dry_run = options['dry_run']
+        references = self.collect_references()
+
+        converted, missing = self.convert_legacy(references)
+        self.stdout.write(
+            f"Legacy files: {len(converted)} moved into {len(set(converted.values()))} blobs, "
+            f"{len(missing)} missing on disk."
+        )
+        if self.dry_run:
+            saved = self.duplicate_bytes(converted)
+            self.stdout.write(self.style.SUCCESS(f"Dry run: would free about {saved / (1024 * 1024):.1f}MB."))
+            return
+
+        self.rewrite_rows(converted)
+        removed_legacy = self.remove_files(converted)
+        fixed, created, freed = self.recount(self.collect_references())
+        self.stdout.write(
+            f"Removed {removed_legacy} legacy copies. Refcounts fixed on {fixed} blobs, "
+            f"{created} blob rows created, {freed} unreferenced blobs deleted."
+        )
+        if options['delete_unreferenced']:
+            self.stdout.write(f"Deleted {self.delete_unreferenced()} unreferenced legacy files.")
+        self.stdout.write(self.style.SUCCESS("Media dedupe finished."))
+
+    def collect_references(self):
+        """Counter of stored name -> number of (row, field) references."""
+        references = Counter()
+        for model_label, field in storage.FIELDS:
+            model = apps.get_model(model_label)
+            names = model.objects.exclude(**{field: ''}).exclude(**{f'{field}__isnull': True})
+            references.update(names.values_list(field, flat=True).iterator())
+        return references
+
+    def convert_legacy(self, references):
+        """Copy each referenced legacy file into its blob. Returns ({old: blob}, [missing])."""
+        converted, missing = {}, []
+        for name in references:
+            if storage.is_blob_name(name):
+                continue
+            path = self.store.path(name)
+            if not os.path.isfile(path):
+                missing.append(name)
+                continue
+            blob = storage.blob_name(storage.hash_file(path), name)
+            converted[name] = blob
+            blob_path = self.store.path(blob)
+            if self.dry_run or os.path.exists(blob_path):
+                continue
+            # Copy (or hard-link) first and delete the original only after the
+            # rows moved, so an interrupted run never loses a file.
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            try:
+                os.link(path, blob_path)
+            except OSError:
+                shutil.copy2(path, blob_path)
+        return converted, missing
+
+    def duplicate_bytes(self, converted):
+        seen, saved = set(), 0
+        for old, blob in converted.items():
+            if blob in seen or os.path.exists(self.store.path(blob)):
+                saved += os.path.getsize(self.store.path(old))
+            seen.add(blob)
+        return saved
+
+    def rewrite_rows(self, converted):
+        from posts import card_cache
+
+        meta_fields = dict(images.FIELDS)
+        for model_label, field in storage.FIELDS:
+            model = apps.get_model(model_label)
+            meta_field = f'{field}_meta' if (model_label, field) in meta_fields else None
+            for old, blob in converted.items():
+                with transaction.atomic():
+                    rows = model.objects.filter(**{field: old})
+                    if meta_field:
+                        # Keep existing variants: they are stored under their own names.
+                        for pk, meta in rows.values_list('pk', meta_field):
+                            if (meta or {}).get('source') == old:
+                                model.objects.filter(pk=pk).update(**{meta_field: {**meta, 'source': blob}})
+                    if model_label == 'accounts.Post':
+                        for post in rows.only('id', 'updated_at'):
+                            card_cache.invalidate(post)
+                    rows.update(**{field: blob})
+
+    def remove_files(self, converted):
+        removed = 0
+        for old in converted:
+            try:
+                os.remove(self.store.path(old))
+                removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
+
+    def recount(self, references):
+        """Set every Blob.refcount from the rows; add missing rows, drop unreferenced blobs."""
+        blob_refs = {name: count for name, count in references.items() if storage.is_blob_name(name)}
+        fixed = created = 0
+        existing = dict(Blob.objects.values_list('name', 'refcount'))
+        for name, count in blob_refs.items():
+            if name not in existing:
+                path = self.store.path(name)
+                if os.path.isfile(path):
+                    digest = os.path.splitext(os.path.basename(name))[0]
+                    Blob.objects.create(name=name, sha256=digest, size=os.path.getsize(path), refcount=count)
+                    created += 1
+            elif existing[name] != count:
+                Blob.objects.filter(name=name).update(refcount=count)
+                fixed += 1
+
+        freed = 0
+        cutoff = timezone.now() - GRACE
+        for name in set(existing) - set(blob_refs):
+            if Blob.objects.filter(name=name, created_at__lt=cutoff).delete()[0]:
+                self.store.remove_blob(name)
+                freed += 1
+        # Blob files with no row and no reference, e.g. from an interrupted upload.
+        for name in self.blob_files():
+            if name not in blob_refs and name not in existing:
+                if os.path.getmtime(self.store.path(name)) < cutoff.timestamp():
+                    self.store.remove_blob(name)
+                    freed += 1
+        return fixed, created, freed
+
+    def blob_files(self):
+        root = self.store.path(storage.BLOB_DIR)
+        for directory, subdirs, files in os.walk(root):
+            subdirs[:] = [d for d in subdirs if d not in ('variants', '.incoming')]
+            for filename in files:
+                yield os.path.relpath(os.path.join(directory, filename), self.store.location).replace(os.sep, '/')
+
+    def delete_unreferenced(self):
+        referenced = set(self.collect_references())
+        deleted = 0
+        for top in LEGACY_DIRS:
+            root = self.store.path(top)
+            for directory, subdirs, files in os.walk(root):
+                subdirs[:] = [d for d in subdirs if d != 'variants']
+                for filename in files:
+                    path = os.path.join(directory, filename)
+                    name = os.path.relpath(path, self.store.location).replace(os.sep, '/')
+                    if name not in referenced:
+                        os.remove(path)
+                        deleted += 1
+        return deleted
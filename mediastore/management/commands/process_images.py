@@ -0,0 +1,35 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand
+
+from mediastore import images
+
+
+class Command(BaseCommand):
+    help = "Generate responsive variants and placeholders for existing post images and profile photos."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help="Reprocess images that already have variants.")
+        parser.add_argument('--chunk-size', type=int, default=200)
+
+    def handle(self, *args, **options):
+        for model_label, field in images.FIELDS:
+            model = apps.get_model(model_label)
+            done = skipped = failed = 0
+            last_pk = 0
+            while True:
+                rows = list(
+                    model.objects.filter(pk__gt=last_pk).exclude(**{field: ''}).exclude(**{f'{field}__isnull': True})
+                    .order_by('pk').values_list('pk', field, f'{field}_meta')[:options['chunk_size']]
+                )
+                if not rows:
+                    break
+                last_pk = rows[-1][0]
+                for pk, name, meta in rows:
+                    if not options['force'] and (meta or {}).get('source') == name:
+                        skipped += 1
+                    elif images.process(model_label, pk, field, force=options['force']):
+                        done += 1
+                    else:
+                        failed += 1
+            self.stdout.write(f"{model_label}.{field}: processed {done}, already done {skipped}, failed {failed}.")
+        self.stdout.write(self.style.SUCCESS("Image backfill finished."))
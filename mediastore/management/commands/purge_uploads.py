@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from mediastore import uploads
+
+
+class Command(BaseCommand):
+    help = "Delete expired resumable upload sessions and their partial files."
+
+    def handle(self, *args, **options):
+        sessions, strays = uploads.purge_expired()
+        self.stdout.write(self.style.SUCCESS(f"Deleted {sessions} expired upload sessions and {strays} stray partial files."))
@@ -0,0 +1,81 @@
+import uuid
+
+from django.conf import settings
+from django.db import models
+
+
+class Blob(models.Model):
+    """
+    One stored file in mediastore.storage.DedupStorage. ``refcount`` is the
+    number of file fields pointing at it; dedupe_media recomputes it.
+    """
+    name = models.CharField(max_length=100, unique=True)
+    sha256 = models.CharField(max_length=64, db_index=True)
+    size = models.PositiveBigIntegerField()
+    refcount = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.name} (x{self.refcount})"
+
+
+class UploadSession(models.Model):
+    """
+    A resumable upload in progress (see mediastore.uploads). The bytes live
+    in a partial file outside MEDIA_ROOT until the session is finished and
+    the file is attached to a post or message. ``received`` is the number
+    of bytes written so far, and the next chunk must start there.
+    """
+    STATUS_UPLOADING = 'uploading'
+    STATUS_COMPLETE = 'complete'
+    STATUS_ABORTED = 'aborted'
+    STATUS_CHOICES = [
+        (STATUS_UPLOADING, 'Uploading'),
+        (STATUS_COMPLETE, 'Complete'),
+        (STATUS_ABORTED, 'Aborted'),
+    ]
+    PURPOSE_POST_VIDEO = 'post_video'
+    PURPOSE_CHAT_ATTACHMENT = 'chat_attachment'
+    PURPOSE_CHOICES = [
+        (PURPOSE_POST_VIDEO, 'Post video'),
+        (PURPOSE_CHAT_ATTACHMENT, 'Chat attachment'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='upload_sessions', on_delete=models.CASCADE)
+    purpose = models.CharField(max_length=20, choices=PURPOSE_CHOICES)
+    file_name = models.CharField(max_length=255)
+    content_type = models.CharField(max_length=100, blank=True)
+    size = models.PositiveBigIntegerField()
+    chunk_size = models.PositiveIntegerField()
+    received = models.PositiveBigIntegerField(default=0)
+    # Hex SHA-256 the client declared up front (optional) and the one computed.
+    expected_sha256 = models.CharField(max_length=64, blank=True)
+    sha256 = models.CharField(max_length=64, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_UPLOADING)
+    # What the finished upload became, e.g. {"post_id": 12}; replayed if finalize is retried.
+    result = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'expires_at'], name='upload_expiry_idx'),
+            models.Index(fields=['user', 'status'], name='upload_user_status_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.file_name} ({self.received}/{self.size}, {self.status})"
+
+    @property
+    def next_chunk(self):
+        return self.received // self.chunk_size
+
+    @property
+    def chunk_count(self):
+        return max(1, -(-self.size // self.chunk_size))
+
+    def chunk_length(self, index):
+        """Exact byte length of chunk ``index``; only the last one may be short."""
+        return min(self.chunk_size, self.size - index * self.chunk_size)
@@ -0,0 +1,185 @@
+"""
+Content hashes and byte ranges for serving uploaded media.
+
+Every file under MEDIA_ROOT is identified by the SHA-256 of its bytes. The
+hash is computed once per (path, size, mtime) and kept in the cache, so
+serving a file again or rendering a link to it only costs a stat(). The
+hash is used as the file's ETag. ``versioned_url`` appends a prefix of it
+as ``?v=``, and mediastore.views.serve_media marks responses to a URL whose
+version matches the file as immutable for a year. A replaced file gets a
+new hash and therefore a new URL. Unversioned URLs get a short max-age and
+are revalidated against the ETag.
+
+Hashing reads the whole file, so neither ``versioned_url`` (called while
+rendering pages) nor the serving view computes it inline. They use a hash
+that is already cached. Otherwise they fall back to the plain URL and a
+size/mtime ETag, and ``hash_later`` fills the cache in the background.
+``prime`` does the same right after an upload.
+"""
+import hashlib
+import os
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import SuspiciousFileOperation
+from django.utils._os import safe_join
+
+from socio.tasks import defer
+
+VERSION_LENGTH = 16
+READ_CHUNK_SIZE = 1024 * 1024
+# How long a queued hash keeps further requests from queueing another.
+PENDING_TIMEOUT = 600
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def resolve(name):
+    """
+    Absolute path of media file ``name`` and its stat result, or None when
+    the name escapes MEDIA_ROOT or is not a regular file.
+    """
+    try:
+        path = safe_join(settings.MEDIA_ROOT, name)
+    except (SuspiciousFileOperation, ValueError):
+        return None
+    try:
+        stat = os.stat(path)
+    except (OSError, ValueError):
+        return None
+    if not os.path.isfile(path):
+        return None
+    return path, stat
+
+
+def _cache_key(path, stat):
+    digest = hashlib.sha1(path.encode('utf-8', 'surrogateescape')).hexdigest()
+    return f'mediastore:sha256:{digest}:{stat.st_size}:{stat.st_mtime_ns}'
+
+
+def content_hash(path, stat=None, compute=True):
+    """
+    Hex SHA-256 of the file at ``path``. With compute=False only a cached
+    value is returned (or None).
+    """
+    stat = stat or os.stat(path)
+    key = _cache_key(path, stat)
+    value = cache.get(key)
+    if value is None and compute:
+        sha = hashlib.sha256()
+        with open(path, 'rb') as handle:
+            for chunk in iter(lambda: handle.read(READ_CHUNK_SIZE), b''):
+                sha.update(chunk)
+        value = sha.hexdigest()
+        cache.set(key, value, None)
+    return value
+
+
+def version(digest):
+    return digest[:VERSION_LENGTH]
+
+
+def versioned_url(field_file):
+    """``field_file.url`` with ``?v=<content hash>`` once the hash is known."""
+    if not field_file:
+        return None
+    url = field_file.url
+    found = resolve(field_file.name)
+    if found is None:
+        return url
+    digest = content_hash(*found, compute=False)
+    if digest is None:
+        return url
+    return f"{url}{'&' if '?' in url else '?'}v={version(digest)}"
+
+
+def stat_etag(stat):
+    """A strong ETag from size and mtime, for files whose hash isn't known yet."""
+    return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+
+def _hash_file(name):
+    found = resolve(name)
+    if found is not None:
+        content_hash(*found)
+
+
+def prime(field_file):
+    """Hash a freshly uploaded file in the background so links to it are versioned."""
+    if field_file:
+        defer(_hash_file, field_file.name)
+
+
+def hash_later(name, path, stat):
+    """
+    Hash media file ``name`` in the background. However many requests for it
+    arrive meanwhile, this version of the file is only queued once.
+    """
+    if cache.add(_cache_key(path, stat) + ':pending', True, PENDING_TIMEOUT):
+        defer(_hash_file, name)
+
+
+def parse_range(header, size):
+    """
+    Parse a Range header against a file of ``size`` bytes into an inclusive
+    (start, end) pair. Returns None when the header should be ignored and
+    the whole file sent: it is absent, malformed, uses another unit or asks
+    for several ranges. Raises RangeNotSatisfiable when it asks only for
+    bytes past the end.
+    """
+    if not header:
+        return None
+    unit, _, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes' or ',' in spec:
+        return None
+    first, dash, last = spec.strip().partition('-')
+    if not dash:
+        return None
+    first, last = first.strip(), last.strip()
+    if not (first.isdigit() or first == '') or not (last.isdigit() or last == ''):
+        return None
+    if first == '':
+        # Suffix range: the final N bytes.
+        if last == '':
+            return None
+        length = int(last)
+        if length == 0 or size == 0:
+            raise RangeNotSatisfiable
+        return max(0, size - length), size - 1
+    start = int(first)
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable
+    end = int(last) if last else size - 1
+    return start, min(end, size - 1)
+
+
+class FileRange:
+    """
+    Iterates over bytes ``start``..``end`` (inclusive) of a file. The file
+    is opened on first iteration and closed when the response is closed.
+    """
+
+    def __init__(self, path, start, end, chunk_size=64 * 1024):
+        self.path = path
+        self.start = start
+        self.remaining = end - start + 1
+        self.chunk_size = chunk_size
+        self._handle = None
+
+    def __iter__(self):
+        self._handle = open(self.path, 'rb')
+        self._handle.seek(self.start)
+        while self.remaining > 0:
+            chunk = self._handle.read(min(self.chunk_size, self.remaining))
+            if not chunk:
+                break
+            self.remaining -= len(chunk)
+            yield chunk
+
+    def close(self):
+        if self._handle is not None:
+            self._handle.close()
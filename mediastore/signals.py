@@ -0,0 +1,63 @@
+"""
+Release blob references held by rows (see mediastore.storage).
+
+A row drops its reference when it is deleted, or when a save replaces or
+clears its file. The old name is read in pre_save and released in post_save,
+so a failed save keeps it. Releases run after the transaction commits, so a
+rollback never removes a file that a restored row still points to.
+
+To drop a file, clear the field and save the row. Calling the field file's
+``delete`` as well would release the same reference a second time.
+"""
+from django.apps import apps
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+
+from mediastore.storage import FIELDS, media_storage
+
+
+def _fields_by_model():
+    fields = {}
+    for model_label, field in FIELDS:
+        fields.setdefault(apps.get_model(model_label), []).append(field)
+    return fields
+
+
+def _release(names):
+    storage = media_storage()
+    for name in names:
+        transaction.on_commit(lambda name=name: storage.delete(name))
+
+
+def _remember_replaced(sender, instance, raw=False, update_fields=None, **kwargs):
+    fields = [f for f in _FIELDS[sender] if update_fields is None or f in update_fields]
+    if raw or instance._state.adding or not fields:
+        return
+    stored = sender.objects.filter(pk=instance.pk).values(*fields).first()
+    if stored is None:
+        return
+    instance._released_files = [
+        stored[field] for field in fields
+        if stored[field] and stored[field] != getattr(instance, field).name
+    ]
+
+
+def _release_replaced(sender, instance, **kwargs):
+    names = instance.__dict__.pop('_released_files', None)
+    if names:
+        _release(names)
+
+
+def _release_deleted(sender, instance, **kwargs):
+    _release([getattr(instance, field).name for field in _FIELDS[sender] if getattr(instance, field)])
+
+
+_FIELDS = {}
+
+
+def connect():
+    _FIELDS.update(_fields_by_model())
+    for model in _FIELDS:
+        pre_save.connect(_remember_replaced, sender=model, dispatch_uid=f'mediastore-pre-{model._meta.label}')
+        post_save.connect(_release_replaced, sender=model, dispatch_uid=f'mediastore-post-{model._meta.label}')
+        post_delete.connect(_release_deleted, sender=model, dispatch_uid=f'mediastore-delete-{model._meta.label}')
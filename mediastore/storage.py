@@ -0,0 +1,150 @@
+"""
+Content-addressed storage for user uploads.
+
+Post images and videos, profile photos and chat attachments use
+``DedupStorage`` (through the ``media_storage`` callable). Saving a file
+hashes it while it streams into a temporary file. It is then stored once as
+
+    blobs/<sha[:2]>/<sha[2:4]>/<sha256><ext>
+
+whatever name it was uploaded under, so re-uploading the same photo adds a
+reference instead of a copy. The extension is kept, because MIME types and
+the "is this an image" checks go by it.
+
+Each blob has a Blob row with a reference count. ``save`` takes a
+reference, and ``delete`` releases one and removes the file, and any image
+variants of it, when the last one goes. Rows release their files when they
+are deleted or their file is replaced (mediastore.signals). Like the other
+denormalized counters here, refcounts can drift when a save fails halfway.
+The dedupe_media command recounts them from the rows, removes unreferenced
+blobs, and moves files saved before this backend into blobs.
+
+Files not under blobs/ are left alone by ``delete``, as before.
+"""
+import hashlib
+import os
+import tempfile
+
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+BLOB_DIR = 'blobs'
+INCOMING_DIR = os.path.join(BLOB_DIR, '.incoming')
+
+# (app label.model, file field) pairs stored in DedupStorage.
+FIELDS = (
+    ('accounts.Post', 'image'),
+    ('accounts.Post', 'video'),
+    ('accounts.UserDetails', 'profile_photo'),
+    ('chat.Message', 'file_attachment'),
+)
+
+
+def is_blob_name(name):
+    return bool(name) and name.replace('\\', '/').startswith(BLOB_DIR + '/') and not name.startswith(INCOMING_DIR)
+
+
+def blob_name(digest, original_name):
+    ext = os.path.splitext(original_name)[1].lower()
+    if not ext[1:].isalnum() or len(ext) > 10:
+        ext = ''
+    return f'{BLOB_DIR}/{digest[:2]}/{digest[2:4]}/{digest}{ext}'
+
+
+def hash_file(path, chunk_size=1024 * 1024):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as handle:
+        for chunk in iter(lambda: handle.read(chunk_size), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class DedupStorage(FileSystemStorage):
+
+    def get_available_name(self, name, max_length=None):
+        # The final name comes from the content hash in _save.
+        return name
+
+    def _save(self, name, content):
+        incoming = None
+        source = getattr(content, 'temporary_file_path', None)
+        if source is not None:
+            # Already on disk (large uploads, finished chunked uploads): hash
+            # it in place, unless the uploader hashed it already, and move it.
+            source = source()
+            digest = getattr(content, 'sha256', None) or hash_file(source)
+        else:
+            os.makedirs(self.path(INCOMING_DIR), exist_ok=True)
+            fd, incoming = tempfile.mkstemp(dir=self.path(INCOMING_DIR))
+            sha = hashlib.sha256()
+            try:
+                with os.fdopen(fd, 'wb') as handle:
+                    for chunk in content.chunks():
+                        sha.update(chunk)
+                        handle.write(chunk)
+            except BaseException:
+                os.remove(incoming)
+                raise
+            source, digest = incoming, sha.hexdigest()
+
+        name = blob_name(digest, name)
+        try:
+            self._claim(name, digest, source)
+        finally:
+            if incoming is not None and os.path.exists(incoming):
+                os.remove(incoming)
+        return name
+
+    def _claim(self, name, digest, source):
+        """Take a reference on blob ``name``, moving ``source`` into place if it is new."""
+        from mediastore.models import Blob
+
+        path = self.path(name)
+        if Blob.objects.filter(name=name).update(refcount=F('refcount') + 1) and os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        file_move_safe(source, path, allow_overwrite=True)
+        # mkstemp files are private; give blobs the usual upload permissions.
+        os.chmod(path, self.file_permissions_mode if self.file_permissions_mode is not None else 0o644)
+        size = os.path.getsize(path)
+        if Blob.objects.filter(name=name).exists():
+            return  # the row was there and the file had gone missing: restored
+        try:
+            with transaction.atomic():
+                Blob.objects.create(name=name, sha256=digest, size=size, refcount=1)
+        except IntegrityError:
+            # Another upload of the same bytes got there first.
+            Blob.objects.filter(name=name).update(refcount=F('refcount') + 1)
+
+    def delete(self, name):
+        """Release one reference to ``name``; the file goes with the last one."""
+        if not is_blob_name(name):
+            return
+        from mediastore.models import Blob
+
+        # Decrement and removal happen under one write lock, so a concurrent
+        # upload of the same bytes either re-references the blob first or
+        # finds it gone and writes it again.
+        with transaction.atomic():
+            Blob.objects.filter(name=name, refcount__gt=0).update(refcount=F('refcount') - 1)
+            if Blob.objects.filter(name=name, refcount=0).delete()[0]:
+                self.remove_blob(name)
+
+    def remove_blob(self, name):
+        from mediastore import images
+
+        super().delete(name)
+        images.delete_variants(name)
+
+
+_storage = None
+
+
+def media_storage():
+    """Storage for user uploads; a callable so migrations don't pin the instance."""
+    global _storage
+    if _storage is None:
+        _storage = DedupStorage()
+    return _storage
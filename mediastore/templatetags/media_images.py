@@ -0,0 +1,61 @@
+from django import template
+from django.core.files.storage import default_storage
+from django.utils.html import format_html, format_html_join
+
+from mediastore import images, serving
+
+register = template.Library()
+
+
+def _srcset(variants, key):
+    return ', '.join(f"{default_storage.url(v[key])} {v['width']}w" for v in variants)
+
+
+@register.simple_tag
+def responsive_image(field_file, meta, alt='', css_class='', sizes='100vw', lazy=True):
+    """
+    {% responsive_image post.image post.image_meta alt="Post image" css_class="post-image" sizes="600px" %}
+
+    Emits a <picture> with WebP and JPEG srcsets, intrinsic width/height and
+    the blur placeholder as a background once variants exist, and a plain
+    <img> of the original until then.
+    """
+    if not field_file:
+        return ''
+    meta = images.current_meta(field_file, meta)
+    attrs = {'alt': alt, 'class': css_class or None}
+    if lazy:
+        attrs.update(loading='lazy', decoding='async')
+    if meta is None:
+        attrs['src'] = field_file.url
+        return format_html('<img {}>', _attrs(attrs))
+
+    attrs.update(width=meta['width'], height=meta['height'])
+    if meta.get('placeholder'):
+        attrs['style'] = f"background: url({meta['placeholder']}) center / cover no-repeat"
+    variants = meta.get('variants') or []
+    if not variants:
+        attrs['src'] = field_file.url
+        return format_html('<img {}>', _attrs(attrs))
+
+    attrs.update(src=default_storage.url(variants[-1]['jpeg']), srcset=_srcset(variants, 'jpeg'), sizes=sizes)
+    return format_html(
+        '<picture><source type="image/webp" srcset="{}" sizes="{}"><img {}></picture>',
+        _srcset(variants, 'webp'), sizes, _attrs(attrs),
+    )
+
+
+def _attrs(attrs):
+    return format_html_join(' ', '{}="{}"', ((k, v) for k, v in attrs.items() if v is not None))
+
+
+@register.simple_tag
+def image_variant_url(field_file, meta, width):
+    """URL of the smallest variant at least ``width`` px wide (the original until processed)."""
+    return images.variant_url(field_file, meta, width) or ''
+
+
+@register.simple_tag
+def versioned_media_url(field_file):
+    """URL of an uploaded file with its content hash appended once known, so it can be cached as immutable."""
+    return serving.versioned_url(field_file) or ''
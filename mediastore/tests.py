@@ -0,0 +1,515 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import http_date
+
+from accounts.models import Post, UserDetails
+from chat.models import Message
+from mediastore import serving, uploads
+from mediastore.models import Blob, UploadSession
+
+
+class ParseRangeTests(SimpleTestCase):
+    def test_ranges(self):
+        self.assertEqual(serving.parse_range('bytes=0-99', 1000), (0, 99))
+        self.assertEqual(serving.parse_range('bytes=900-', 1000), (900, 999))
+        self.assertEqual(serving.parse_range('bytes=-100', 1000), (900, 999))
+        self.assertEqual(serving.parse_range('bytes=-5000', 1000), (0, 999))
+        self.assertEqual(serving.parse_range('bytes=990-5000', 1000), (990, 999))
+
+    def test_ignored_headers(self):
+        for header in (None, '', 'items=0-1', 'bytes=0-1,5-6', 'bytes=5-1', 'bytes=a-b', 'bytes=-', 'bytes=3'):
+            self.assertIsNone(serving.parse_range(header, 1000), header)
+
+    def test_unsatisfiable(self):
+        for header, size in (('bytes=1000-', 1000), ('bytes=-0', 1000), ('bytes=0-', 0)):
+            with self.assertRaises(serving.RangeNotSatisfiable):
+                serving.parse_range(header, size)
+
+
+class ServeMediaTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=self.media_root, TASKS_EAGER=True)
+        override.enable()
+        self.addCleanup(override.disable)
+        cache.clear()
+
+        self.data = bytes(range(256)) * 40  # 10240 bytes
+        os.makedirs(os.path.join(self.media_root, 'post_videos'))
+        self.path = os.path.join(self.media_root, 'post_videos', 'clip.mp4')
+        with open(self.path, 'wb') as handle:
+            handle.write(self.data)
+        self.url = '/media/post_videos/clip.mp4'
+        self.digest = hashlib.sha256(self.data).hexdigest()
+        self.etag = f'"{self.digest}"'
+        serving.content_hash(self.path)
+
+    def body(self, response):
+        return b''.join(response.streaming_content)
+
+    def test_full_response_headers(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.body(response), self.data)
+        self.assertEqual(response['Content-Type'], 'video/mp4')
+        self.assertEqual(response['Content-Length'], str(len(self.data)))
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['ETag'], self.etag)
+        self.assertEqual(response['Last-Modified'], http_date(int(os.stat(self.path).st_mtime)))
+        self.assertEqual(response['Cache-Control'], 'public, max-age=3600')
+
+    def test_byte_ranges(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=100-199')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 100-199/{len(self.data)}')
+        self.assertEqual(response['Content-Length'], '100')
+        self.assertEqual(self.body(response), self.data[100:200])
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=10000-')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(self.body(response), self.data[10000:])
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-16')
+        self.assertEqual(response['Content-Range'], f'bytes {len(self.data) - 16}-{len(self.data) - 1}/{len(self.data)}')
+        self.assertEqual(self.body(response), self.data[-16:])
+
+    def test_unsatisfiable_and_ignored_ranges(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=20000-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.data)}')
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-1,5-6')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.body(response), self.data)
+
+    def test_conditional_requests(self):
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=self.etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], self.etag)
+        self.assertIn('max-age', response['Cache-Control'])
+
+        last_modified = http_date(int(os.stat(self.path).st_mtime))
+        response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH='"stale"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_if_range(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE=self.etag)
+        self.assertEqual(response.status_code, 206)
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.body(response), self.data)
+
+    def test_replaced_file_changes_etag(self):
+        first = self.client.get(self.url)['ETag']
+        with open(self.path, 'wb') as handle:
+            handle.write(b'new content')
+        os.utime(self.path, ns=(os.stat(self.path).st_atime_ns, os.stat(self.path).st_mtime_ns + 10**9))
+        response = self.client.get(self.url)
+        self.assertNotEqual(response['ETag'], first)
+        self.assertEqual(self.body(response), b'new content')
+
+    def test_unhashed_file_is_served_without_hashing_inline(self):
+        cache.clear()
+        stat_etag = serving.stat_etag(os.stat(self.path))
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.get(self.url, HTTP_RANGE='bytes=0-9')
+            self.assertEqual(response.status_code, 206)
+            self.assertEqual(response['ETag'], stat_etag)
+            with override_settings(MEDIA_SENDFILE='x-accel-redirect'):
+                response = self.client.get(self.url)
+            self.assertEqual(response['ETag'], stat_etag)
+            self.assertEqual(response.content, b'')
+            self.assertIsNone(serving.content_hash(self.path, compute=False))
+        # Both requests queued one background hash between them.
+        self.assertEqual(len(callbacks), 1)
+        callbacks[0]()
+        self.assertEqual(self.client.get(self.url)['ETag'], self.etag)
+        # A client holding the interim ETag just gets a fresh 200.
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=stat_etag).status_code, 200)
+
+    def test_versioned_url_is_immutable(self):
+        cache.clear()
+        field_file = Post(video='post_videos/clip.mp4').video
+        self.assertEqual(serving.versioned_url(field_file), self.url)  # not hashed yet
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.get(self.url)
+        url = serving.versioned_url(field_file)
+        self.assertEqual(url, f'{self.url}?v={self.digest[:serving.VERSION_LENGTH]}')
+        response = self.client.get(url)
+        self.assertEqual(response['Cache-Control'], f'public, max-age={365 * 24 * 3600}, immutable')
+
+        response = self.client.get(f'{self.url}?v=0000')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=3600')
+
+    def test_head_and_methods(self):
+        response = self.client.head(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Length'], str(len(self.data)))
+        self.assertEqual(self.client.post(self.url).status_code, 405)
+
+    def test_missing_and_outside_files(self):
+        self.assertEqual(self.client.get('/media/post_videos/missing.mp4').status_code, 404)
+        self.assertEqual(self.client.get('/media/post_videos/').status_code, 404)
+        self.assertEqual(self.client.get('/media/../socio/settings.py').status_code, 404)
+        self.assertEqual(self.client.get('/media/%2E%2E/socio/settings.py').status_code, 404)
+
+    def test_x_accel_redirect_handoff(self):
+        with override_settings(MEDIA_SENDFILE='x-accel-redirect', MEDIA_ACCEL_REDIRECT_LOCATION='/protected/'):
+            response = self.client.get('/media/post_videos/clip.mp4', HTTP_RANGE='bytes=0-9')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['X-Accel-Redirect'], '/protected/post_videos/clip.mp4')
+            self.assertEqual(response['ETag'], self.etag)
+            self.assertEqual(response.content, b'')
+
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=self.etag)
+            self.assertEqual(response.status_code, 304)
+            self.assertNotIn('X-Accel-Redirect', response)
+
+    def test_x_sendfile_handoff(self):
+        with override_settings(MEDIA_SENDFILE='x-sendfile'):
+            response = self.client.get(self.url)
+            self.assertEqual(response['X-Sendfile'], self.path)
+            self.assertEqual(response['Content-Type'], 'video/mp4')
+
+    def test_chat_attachments_are_private(self):
+        sender, receiver, outsider = [
+            UserDetails.objects.create_user(username=name, email=f'{name}@example.com', password='pw')
+            for name in ('sender', 'receiver', 'outsider')
+        ]
+        message = Message.objects.create(
+            sender=sender, receiver=receiver, message_type='document', file_name='notes.txt',
+            file_attachment=ContentFile(b'private notes', name='notes.txt'),
+        )
+        url = message.file_attachment.url
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.client.force_login(outsider)
+        self.assertEqual(self.client.get(url).status_code, 404)
+        for member in (sender, receiver):
+            self.client.force_login(member)
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response['Cache-Control'].startswith('private, '))
+
+        # Files left under the old chat_files/ layout stay private too.
+        legacy = default_storage.save('chat_files/user_1/old.txt', ContentFile(b'old notes'))
+        self.assertEqual(self.client.get(f'/media/{legacy}').status_code, 404)
+
+        # The same bytes posted publicly are public.
+        self.client.force_login(outsider)
+        Post.objects.create(user=sender, post_type='image', image=message.file_attachment.name)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Cache-Control'].startswith('public, '))
+        self.client.logout()
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+
+    def test_prime_hashes_upload(self):
+        name = default_storage.save('post_images/a.jpg', ContentFile(b'jpeg bytes'))
+        field_file = Post(image=name).image
+        with self.captureOnCommitCallbacks(execute=True):
+            serving.prime(field_file)
+        self.assertIn('?v=', serving.versioned_url(field_file))
+
+
+class ChunkedUploadTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = UserDetails.objects.create_user(username='uploader', email='uploader@example.com', password='pw')
+        cls.friend = UserDetails.objects.create_user(username='friend', email='friend@example.com', password='pw')
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.upload_root = tempfile.mkdtemp()
+        for path in (self.media_root, self.upload_root):
+            self.addCleanup(shutil.rmtree, path, ignore_errors=True)
+        override = override_settings(
+            MEDIA_ROOT=self.media_root, UPLOAD_SESSION_ROOT=self.upload_root,
+            UPLOAD_CHUNK_SIZE=1024, TASKS_EAGER=True,
+        )
+        override.enable()
+        self.addCleanup(override.disable)
+        self.client.force_login(self.user)
+        self.video = b'\x00\x00\x00\x18ftypmp42' + bytes(range(256)) * 10  # 2572 bytes, 3 chunks
+
+    def start(self, purpose='post_video', file_name='clip.mp4', size=None, **extra):
+        body = {'purpose': purpose, 'file_name': file_name, 'size': len(self.video) if size is None else size, **extra}
+        return self.client.post(reverse('mediastore:create_upload'), json.dumps(body), content_type='application/json')
+
+    def send(self, upload_id, index, data):
+        url = reverse('mediastore:upload_chunk', args=[upload_id, index])
+        return self.client.post(url, data, content_type='application/octet-stream')
+
+    def upload(self, data=None, purpose='post_video', file_name='clip.mp4'):
+        data = self.video if data is None else data
+        upload_id = self.start(purpose, file_name, size=len(data)).json()['upload_id']
+        for index in range(0, -(-len(data) // 1024)):
+            self.assertEqual(self.send(upload_id, index, data[index * 1024:(index + 1) * 1024]).status_code, 200)
+        return upload_id
+
+    def test_early_rejection(self):
+        self.assertEqual(self.start(size=600 * 1024 * 1024).status_code, 413)
+        self.assertEqual(self.start(file_name='notes.txt').status_code, 415)
+        self.assertEqual(self.start(size=0).status_code, 400)
+        self.assertEqual(UploadSession.objects.count(), 0)
+
+        upload_id = self.start().json()['upload_id']
+        # A chunk whose length does not match is refused before it is stored.
+        self.assertEqual(self.send(upload_id, 0, self.video[:10]).status_code, 400)
+        # Content sniffing on the first chunk aborts a non-video.
+        response = self.send(upload_id, 0, b'<html>' + b'x' * 1018)
+        self.assertEqual(response.status_code, 415)
+        self.assertEqual(UploadSession.objects.get(id=upload_id).status, UploadSession.STATUS_ABORTED)
+        self.assertFalse(os.listdir(self.upload_root))
+
+    def test_chunks_resume_and_finalize_post(self):
+        upload_id = self.start().json()['upload_id']
+        self.assertEqual(self.send(upload_id, 0, self.video[:1024]).json()['received'], 1024)
+        # Out of order is refused; a repeated chunk is accepted as a no-op.
+        self.assertEqual(self.send(upload_id, 2, self.video[2048:]).status_code, 409)
+        self.assertEqual(self.send(upload_id, 0, self.video[:1024]).json()['received'], 1024)
+
+        status = self.client.get(reverse('mediastore:upload_status', args=[upload_id])).json()
+        self.assertEqual((status['received'], status['next_chunk'], status['chunk_count']), (1024, 1, 3))
+
+        # A lost process forgets the running hash; it is rebuilt from disk.
+        uploads._hashers.clear()
+        self.send(upload_id, 1, self.video[1024:2048])
+        state = self.send(upload_id, 2, self.video[2048:]).json()
+        self.assertEqual(state['received'], len(self.video))
+
+        url = reverse('posts:finalize_video_upload', args=[upload_id])
+        response = self.client.post(url, json.dumps({'caption': 'clip'}), content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        post = Post.objects.get(id=response.json()['post_id'])
+        self.assertEqual(post.post_type, 'video')
+        self.assertEqual(post.caption, 'clip')
+        with post.video.open('rb') as handle:
+            self.assertEqual(handle.read(), self.video)
+        session = UploadSession.objects.get(id=upload_id)
+        self.assertEqual(session.sha256, hashlib.sha256(self.video).hexdigest())
+        self.assertFalse(os.listdir(self.upload_root))
+
+        # Retrying finalize returns the same post.
+        again = self.client.post(url, '{}', content_type='application/json')
+        self.assertEqual(again.json()['post_id'], post.id)
+        self.assertEqual(Post.objects.count(), 1)
+
+    def test_finalize_checks_completeness_and_checksum(self):
+        upload_id = self.start(sha256='0' * 64).json()['upload_id']
+        self.send(upload_id, 0, self.video[:1024])
+        url = reverse('posts:finalize_video_upload', args=[upload_id])
+        self.assertEqual(self.client.post(url, '{}', content_type='application/json').status_code, 409)
+
+        self.send(upload_id, 1, self.video[1024:2048])
+        self.send(upload_id, 2, self.video[2048:])
+        self.assertEqual(self.client.post(url, '{}', content_type='application/json').status_code, 422)
+        self.assertEqual(UploadSession.objects.get(id=upload_id).status, UploadSession.STATUS_ABORTED)
+        self.assertFalse(Post.objects.exists())
+
+    def test_chat_attachment(self):
+        data = b'%PDF-1.7 ' + b'x' * 1500
+        upload_id = self.upload(data, purpose='chat_attachment', file_name='report.pdf')
+        body = {'upload_id': upload_id, 'receiver_id': self.friend.id, 'caption': 'here'}
+        response = self.client.post(reverse('chat:send_upload_api'), json.dumps(body), content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        message = Message.objects.get(id=response.json()['id'])
+        self.assertEqual((message.file_name, message.file_size, message.message_type), ('report.pdf', len(data), 'document'))
+        with message.file_attachment.open('rb') as handle:
+            self.assertEqual(handle.read(), data)
+
+        again = self.client.post(reverse('chat:send_upload_api'), json.dumps(body), content_type='application/json')
+        self.assertEqual(again.json()['id'], message.id)
+        self.assertEqual(Message.objects.count(), 1)
+
+    def test_failure_after_the_file_moved_aborts_the_session(self):
+        upload_id = self.upload()
+        url = reverse('posts:finalize_video_upload', args=[upload_id])
+        with mock.patch('posts.views.UserStats.bump', side_effect=RuntimeError('db down')):
+            with self.assertRaises(RuntimeError):
+                self.client.post(url, '{}', content_type='application/json')
+        self.assertFalse(Post.objects.exists())
+        # Not left "uploading" with its partial file gone: the client restarts.
+        self.assertEqual(UploadSession.objects.get(id=upload_id).status, UploadSession.STATUS_ABORTED)
+        self.assertEqual(self.client.post(url, '{}', content_type='application/json').status_code, 409)
+
+        data = b'%PDF-1.7 ' + b'x' * 1500
+        upload_id = self.upload(data, purpose='chat_attachment', file_name='report.pdf')
+        body = json.dumps({'upload_id': upload_id, 'receiver_id': self.friend.id})
+        with mock.patch('chat.views.Notification.objects.create', side_effect=RuntimeError('db down')):
+            with self.assertRaises(RuntimeError):
+                self.client.post(reverse('chat:send_upload_api'), body, content_type='application/json')
+        self.assertEqual(UploadSession.objects.get(id=upload_id).status, UploadSession.STATUS_ABORTED)
+        self.assertFalse(Message.objects.exists())
+
+    def test_non_object_json_bodies_are_rejected(self):
+        upload_id = self.upload()
+        for url in (
+            reverse('mediastore:create_upload'),
+            reverse('posts:finalize_video_upload', args=[upload_id]),
+            reverse('chat:send_upload_api'),
+        ):
+            with self.subTest(url=url):
+                self.assertEqual(self.client.post(url, '[]', content_type='application/json').status_code, 400)
+        self.assertEqual(UploadSession.objects.get(id=upload_id).status, UploadSession.STATUS_UPLOADING)
+
+    def test_sessions_are_private(self):
+        upload_id = self.start().json()['upload_id']
+        self.client.force_login(self.friend)
+        self.assertEqual(self.client.get(reverse('mediastore:upload_status', args=[upload_id])).status_code, 404)
+        self.assertEqual(self.send(upload_id, 0, self.video[:1024]).status_code, 404)
+
+    def test_purge_expired(self):
+        upload_id = self.start().json()['upload_id']
+        UploadSession.objects.filter(id=upload_id).update(expires_at=timezone.now() - timedelta(minutes=1))
+        self.assertEqual(self.send(upload_id, 0, self.video[:1024]).status_code, 410)
+        out = StringIO()
+        call_command('purge_uploads', stdout=out)
+        self.assertIn('Deleted 1 expired', out.getvalue())
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertFalse(os.listdir(self.upload_root))
+
+
+class DedupStorageTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = UserDetails.objects.create_user(username='deduper', email='deduper@example.com', password='pw')
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=self.media_root, TASKS_EAGER=True)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.data = b'\x89PNG same bytes' * 100
+
+    def post_with_image(self, name='photo.png', data=None):
+        post = Post(user=self.user, post_type='image')
+        post.image.save(name, ContentFile(self.data if data is None else data), save=False)
+        post.save()
+        return post
+
+    def blob_files(self):
+        root = os.path.join(self.media_root, 'blobs')
+        return sorted(
+            os.path.relpath(os.path.join(d, f), self.media_root)
+            for d, subdirs, files in os.walk(root) if '.incoming' not in d for f in files
+        )
+
+    def test_identical_uploads_share_one_blob(self):
+        first = self.post_with_image('photo.png')
+        second = self.post_with_image('copy of photo.PNG')
+        digest = hashlib.sha256(self.data).hexdigest()
+        self.assertEqual(first.image.name, f'blobs/{digest[:2]}/{digest[2:4]}/{digest}.png')
+        self.assertEqual(second.image.name, first.image.name)
+        self.assertEqual(self.blob_files(), [first.image.name])
+        self.assertEqual(Blob.objects.get(name=first.image.name).refcount, 2)
+        with first.image.open('rb') as handle:
+            self.assertEqual(handle.read(), self.data)
+
+        response = self.client.get(first.image.url)
+        self.assertEqual(response['Cache-Control'], f'public, max-age={365 * 24 * 3600}, immutable')
+
+    def test_last_reference_removes_the_blob(self):
+        first = self.post_with_image()
+        second = self.post_with_image()
+        name = first.image.name
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertEqual(Blob.objects.get(name=name).refcount, 1)
+        self.assertTrue(os.path.exists(os.path.join(self.media_root, name)))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(Blob.objects.filter(name=name).exists())
+        self.assertEqual(self.blob_files(), [])
+
+    def test_replacing_a_file_releases_the_old_one(self):
+        self.user.profile_photo.save('me.png', ContentFile(b'old photo'), save=False)
+        self.user.save()
+        old = self.user.profile_photo.name
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.profile_photo.save('me.png', ContentFile(b'new photo'), save=False)
+            self.user.save()
+        self.assertFalse(Blob.objects.filter(name=old).exists())
+        self.assertEqual(self.blob_files(), [self.user.profile_photo.name])
+
+        # Saves that don't touch the file leave its reference alone.
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.bio = 'hello'
+            self.user.save()
+        self.assertEqual(Blob.objects.get(name=self.user.profile_photo.name).refcount, 1)
+
+    def test_removing_a_shared_profile_photo_keeps_the_blob(self):
+        other = UserDetails.objects.create_user(username='twin', email='twin@example.com', password='pw')
+        for user in (self.user, other):
+            user.profile_photo.save('me.png', ContentFile(self.data), save=False)
+            user.save()
+        name = self.user.profile_photo.name
+        self.assertEqual(other.profile_photo.name, name)
+        self.assertEqual(Blob.objects.get(name=name).refcount, 2)
+
+        self.client.force_login(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('profile'), {'remove_profile_photo': '1'})
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.profile_photo)
+        self.assertEqual(Blob.objects.get(name=name).refcount, 1)
+        self.assertTrue(os.path.exists(os.path.join(self.media_root, name)))
+
+    def write_legacy(self, name, data):
+        path = os.path.join(self.media_root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as handle:
+            handle.write(data)
+
+    def test_dedupe_media_command(self):
+        names = ['post_images/a.png', 'post_images/a_x1Y2z3.png', 'profile_photos/a.png']
+        for name in names:
+            self.write_legacy(name, self.data)
+        self.write_legacy('post_images/orphan.png', b'nobody points here')
+        posts = [Post.objects.create(user=self.user, post_type='image') for _ in range(2)]
+        Post.objects.filter(id=posts[0].id).update(image=names[0], image_meta={'source': names[0], 'width': 1})
+        Post.objects.filter(id=posts[1].id).update(image=names[1])
+        UserDetails.objects.filter(id=self.user.id).update(profile_photo=names[2])
+
+        out = StringIO()
+        call_command('dedupe_media', '--dry-run', stdout=out)
+        self.assertIn('3 moved into 1 blobs', out.getvalue())
+        self.assertEqual(self.blob_files(), [])
+
+        call_command('dedupe_media', '--delete-unreferenced', stdout=StringIO())
+        digest = hashlib.sha256(self.data).hexdigest()
+        blob = f'blobs/{digest[:2]}/{digest[2:4]}/{digest}.png'
+        self.assertEqual(set(Post.objects.values_list('image', flat=True)), {blob})
+        self.assertEqual(UserDetails.objects.get(id=self.user.id).profile_photo.name, blob)
+        self.assertEqual(Post.objects.get(id=posts[0].id).image_meta['source'], blob)
+        self.assertEqual(Blob.objects.get(name=blob).refcount, 3)
+        self.assertEqual(self.blob_files(), [blob])
+        for name in names + ['post_images/orphan.png']:
+            self.assertFalse(os.path.exists(os.path.join(self.media_root, name)), name)
+
+        # A second run has nothing to do; drifted counts are repaired.
+        Blob.objects.filter(name=blob).update(refcount=7)
+        out = StringIO()
+        call_command('dedupe_media', stdout=out)
+        self.assertIn('0 moved into 0 blobs', out.getvalue())
+        self.assertEqual(Blob.objects.get(name=blob).refcount, 3)
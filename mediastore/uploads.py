@@ -0,0 +1,346 @@
+"""
+Resumable chunked uploads for post videos and chat attachments.
+
+The protocol (views in mediastore.views, finalize views in posts and chat):
+
+1. POST /uploads/ with {purpose, file_name, size, content_type, sha256?}.
+   The size and file type are checked against the purpose before any bytes
+   are sent. The reply carries the session id and the chunk size.
+2. POST /uploads/<id>/chunks/<n>/ with the raw bytes of chunk n. Chunks are
+   chunk_size bytes each (the last one may be shorter) and must be sent in
+   order. The body is streamed straight into a partial file outside
+   MEDIA_ROOT, so neither FILE_UPLOAD_MAX_MEMORY_SIZE nor
+   DATA_UPLOAD_MAX_MEMORY_SIZE applies. A wrong Content-Length is rejected
+   before the body is read. Re-sending a chunk that was already stored is
+   a no-op, so a client that lost a response can simply retry.
+3. GET /uploads/<id>/ reports ``received`` and ``next_chunk``, so the
+   client can resume after a network error or a page reload.
+4. The owning app's finalize view calls ``finish`` (through ``finishing``). It checks that every
+   byte arrived and that the SHA-256 matches what the client declared, then
+   attaches the file to a Post or Message. The partial file is moved into
+   storage rather than copied. ``complete`` records the result, and a
+   retried finalize returns it again instead of creating a second post.
+
+The SHA-256 is computed as chunks arrive. The running hash lives in process
+memory and is rebuilt from the partial file whenever a chunk lands on a
+different worker. Sessions expire after UPLOAD_SESSION_TTL_HOURS, and
+purge_uploads deletes them along with their partial files.
+"""
+import hashlib
+import os
+import threading
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files import File
+from django.db.models import F
+from django.utils import timezone
+
+from mediastore.models import UploadSession
+
+# Per purpose: the setting holding its size limit, and the allowed extensions (None = any).
+PURPOSES = {
+    UploadSession.PURPOSE_POST_VIDEO: ('UPLOAD_POST_VIDEO_MAX_SIZE', ('.mp4', '.avi', '.mov', '.wmv', '.flv')),
+    UploadSession.PURPOSE_CHAT_ATTACHMENT: ('UPLOAD_CHAT_ATTACHMENT_MAX_SIZE', None),
+}
+DEFAULT_MAX_SIZES = {
+    'UPLOAD_POST_VIDEO_MAX_SIZE': 500 * 1024 * 1024,
+    'UPLOAD_CHAT_ATTACHMENT_MAX_SIZE': 50 * 1024 * 1024,
+}
+# Leading bytes of the video containers accepted for post videos.
+VIDEO_SIGNATURES = (
+    (4, (b'ftyp', b'moov', b'mdat', b'wide', b'free', b'skip')),  # MP4 / QuickTime
+    (0, (b'RIFF',)),                                               # AVI
+    (0, (b'\x30\x26\xb2\x75\x8e\x66\xcf\x11',)),                   # ASF / WMV
+    (0, (b'FLV',)),                                                # FLV
+)
+READ_SIZE = 64 * 1024
+
+_lock = threading.Lock()
+_hashers = {}  # session id -> (bytes hashed, running sha256)
+
+
+class UploadError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+def max_size(purpose):
+    setting = PURPOSES[purpose][0]
+    return getattr(settings, setting, DEFAULT_MAX_SIZES[setting])
+
+
+def _chunk_size():
+    return getattr(settings, 'UPLOAD_CHUNK_SIZE', 4 * 1024 * 1024)
+
+
+def _ttl():
+    return timedelta(hours=getattr(settings, 'UPLOAD_SESSION_TTL_HOURS', 24))
+
+
+def upload_root():
+    return getattr(settings, 'UPLOAD_SESSION_ROOT', os.path.join(settings.BASE_DIR, 'upload_sessions'))
+
+
+def partial_path(session):
+    return os.path.join(upload_root(), f'{session.id}.part')
+
+
+def start(user, purpose, file_name, size, content_type='', sha256=''):
+    """Validate an upload against its purpose and open a session for it."""
+    if purpose not in PURPOSES:
+        raise UploadError('Unknown upload purpose')
+    file_name = os.path.basename((file_name or '').replace('\\', '/')).strip()
+    if not file_name:
+        raise UploadError('File name is required')
+    try:
+        size = int(size)
+    except (TypeError, ValueError):
+        raise UploadError('File size is required')
+    if size <= 0:
+        raise UploadError('File is empty')
+    limit = max_size(purpose)
+    if size > limit:
+        raise UploadError(f'File size exceeds {limit // (1024 * 1024)}MB limit', status=413)
+    extensions = PURPOSES[purpose][1]
+    if extensions is not None and os.path.splitext(file_name)[1].lower() not in extensions:
+        raise UploadError(f"Unsupported file type; allowed: {', '.join(extensions)}", status=415)
+    sha256 = (sha256 or '').lower()
+    if sha256 and (len(sha256) != 64 or any(c not in '0123456789abcdef' for c in sha256)):
+        raise UploadError('sha256 must be 64 hex digits')
+
+    session = UploadSession.objects.create(
+        user=user,
+        purpose=purpose,
+        file_name=file_name[:255],
+        content_type=(content_type or '')[:100],
+        size=size,
+        chunk_size=_chunk_size(),
+        expected_sha256=sha256,
+        expires_at=timezone.now() + _ttl(),
+    )
+    os.makedirs(upload_root(), exist_ok=True)
+    open(partial_path(session), 'wb').close()
+    return session
+
+
+def get_session(user, upload_id):
+    """The caller's session ``upload_id``, or UploadError(404)."""
+    try:
+        session = UploadSession.objects.filter(id=upload_id, user=user).first()
+    except ValidationError:
+        session = None
+    if session is None:
+        raise UploadError('Upload not found', status=404)
+    return session
+
+
+def _check_open(session):
+    if session.status != UploadSession.STATUS_UPLOADING:
+        raise UploadError(f'Upload is {session.status}', status=409)
+    if session.expires_at <= timezone.now():
+        raise UploadError('Upload has expired', status=410)
+
+
+def _looks_like_video(head):
+    return any(head[offset:offset + len(sig)] == sig for offset, sigs in VIDEO_SIGNATURES for sig in sigs)
+
+
+def _hasher_at(session, offset):
+    """A sha256 that has consumed exactly the first ``offset`` bytes of the partial file."""
+    with _lock:
+        state = _hashers.get(session.id)
+    if state is not None and state[0] == offset:
+        return state[1].copy()
+    sha = hashlib.sha256()
+    remaining = offset
+    with open(partial_path(session), 'rb') as handle:
+        while remaining > 0:
+            data = handle.read(min(READ_SIZE, remaining))
+            if not data:
+                raise UploadError('Partial upload is missing data; start again', status=410)
+            sha.update(data)
+            remaining -= len(data)
+    return sha
+
+
+def write_chunk(session, index, stream, content_length):
+    """
+    Append chunk ``index`` read from ``stream``. Returns the session as of
+    after the write. The length is checked before anything is read.
+    """
+    _check_open(session)
+    if index < 0 or index >= session.chunk_count:
+        raise UploadError('Chunk index out of range')
+    if index < session.next_chunk:
+        return session  # already stored; the client is retrying
+    if index > session.next_chunk:
+        raise UploadError(f'Expected chunk {session.next_chunk}', status=409)
+    expected = session.chunk_length(index)
+    if content_length != expected:
+        raise UploadError(f'Chunk {index} must be {expected} bytes', status=400)
+
+    offset = session.received
+    sha = _hasher_at(session, offset)
+    written = 0
+    rejected = False
+    with open(partial_path(session), 'r+b') as handle:
+        handle.seek(offset)
+        handle.truncate()
+        while written < expected:
+            data = stream.read(min(READ_SIZE, expected - written))
+            if not data:
+                break
+            if written == 0 and offset == 0 and session.purpose == UploadSession.PURPOSE_POST_VIDEO:
+                if not _looks_like_video(data):
+                    rejected = True
+                    break
+            handle.write(data)
+            sha.update(data)
+            written += len(data)
+    if rejected:
+        # Content sniffing on the first bytes: give up before the rest is sent.
+        abort(session)
+        raise UploadError('File is not a supported video', status=415)
+    if written != expected:
+        raise UploadError('Chunk was cut short; send it again', status=400)
+
+    # Only one writer can move ``received`` past this offset.
+    moved = UploadSession.objects.filter(
+        id=session.id, status=UploadSession.STATUS_UPLOADING, received=offset
+    ).update(received=F('received') + expected, updated_at=timezone.now())
+    if not moved:
+        with _lock:
+            _hashers.pop(session.id, None)
+        session.refresh_from_db()
+        return session
+    with _lock:
+        _hashers[session.id] = (offset + expected, sha)
+    session.received = offset + expected
+    return session
+
+
+class AssembledFile(File):
+    """
+    The finished partial file. ``temporary_file_path`` makes the storage
+    move it into place instead of copying it, and ``sha256`` spares it
+    hashing the file again.
+    """
+
+    def __init__(self, session):
+        self.session = session
+        self.sha256 = session.sha256
+        super().__init__(open(partial_path(session), 'rb'), name=session.file_name)
+
+    def temporary_file_path(self):
+        return partial_path(self.session)
+
+
+def finish(session, sha256=''):
+    """
+    Check that the upload is whole and intact and return it as an
+    AssembledFile to be saved into a FileField. Follow with ``complete``.
+    """
+    _check_open(session)
+    if session.received != session.size:
+        raise UploadError(f'Upload incomplete: {session.received} of {session.size} bytes', status=409)
+    digest = _hasher_at(session, session.size).hexdigest()
+    expected = (sha256 or session.expected_sha256 or '').lower()
+    if expected and expected != digest:
+        # The stored bytes are wrong somewhere; the client has to start over.
+        abort(session)
+        raise UploadError('Checksum mismatch; upload discarded', status=422)
+    session.sha256 = digest
+    return AssembledFile(session)
+
+
+@contextmanager
+def finishing(session, sha256=''):
+    """
+    ``finish`` as a context manager around attaching the file. If the block
+    raises after the storage has already moved the partial file away, the
+    session is aborted. Otherwise every retry would fail with "missing data",
+    and this way the client can start a new upload.
+    """
+    upload = finish(session, sha256)
+    try:
+        with upload:
+            yield upload
+    except Exception:
+        if not os.path.exists(partial_path(session)):
+            abort(session)
+        raise
+
+
+def complete(session, result):
+    """Mark ``session`` finished with ``result`` and drop its leftovers."""
+    session.status = UploadSession.STATUS_COMPLETE
+    session.result = result
+    session.save(update_fields=['status', 'result', 'sha256', 'updated_at'])
+    _discard(session)
+
+
+def abort(session):
+    session.status = UploadSession.STATUS_ABORTED
+    session.save(update_fields=['status', 'updated_at'])
+    _discard(session)
+
+
+def _discard(session):
+    with _lock:
+        _hashers.pop(session.id, None)
+    try:
+        os.remove(partial_path(session))
+    except FileNotFoundError:
+        pass
+
+
+def purge_expired(now=None):
+    """
+    Delete sessions past their expiry and their partial files, plus partial
+    files whose session is gone (e.g. its user was deleted). Returns
+    (sessions deleted, stray files removed).
+    """
+    now = now or timezone.now()
+    expired = UploadSession.objects.filter(expires_at__lte=now)
+    count = 0
+    for session in expired.iterator():
+        _discard(session)
+        count += 1
+    expired.delete()
+
+    strays = 0
+    root = upload_root()
+    if os.path.isdir(root):
+        live = {
+            f'{pk}.part'
+            for pk in UploadSession.objects.filter(status=UploadSession.STATUS_UPLOADING).values_list('id', flat=True)
+        }
+        cutoff = (now - _ttl()).timestamp()
+        for name in os.listdir(root):
+            path = os.path.join(root, name)
+            # The age check keeps a session that is being created right now.
+            if name.endswith('.part') and name not in live and os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                strays += 1
+    return count, strays
+
+
+def state(session):
+    return {
+        'upload_id': str(session.id),
+        'purpose': session.purpose,
+        'file_name': session.file_name,
+        'size': session.size,
+        'chunk_size': session.chunk_size,
+        'received': session.received,
+        'next_chunk': session.next_chunk,
+        'chunk_count': session.chunk_count,
+        'status': session.status,
+        'expires_at': session.expires_at.isoformat(),
+        'result': session.result,
+    }
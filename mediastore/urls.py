@@ -0,0 +1,11 @@
+from django.urls import path
+from . import views
+
+app_name = 'mediastore'
+
+urlpatterns = [
+    path('', views.create_upload, name='create_upload'),
+    path('<uuid:upload_id>/', views.upload_status, name='upload_status'),
+    path('<uuid:upload_id>/chunks/<int:index>/', views.upload_chunk, name='upload_chunk'),
+    path('<uuid:upload_id>/abort/', views.abort_upload, name='abort_upload'),
+]
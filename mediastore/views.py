@@ -0,0 +1,247 @@
+"""
+Media views: serving uploaded files, and the session and chunk endpoints
+of resumable uploads (protocol in mediastore.uploads).
+
+serve_media replaces django.conf.urls.static:
+
+- Single byte ranges get 206 responses, so browsers can seek in a video
+  without downloading the whole MP4. A range past the end gets 416.
+- The ETag is the file's content hash (see mediastore.serving). Blob names
+  carry it. For other files it is cached once computed in the background;
+  until then a size/mtime ETag stands in, so no request reads a whole file
+  just to build a validator. If-None-Match, If-Modified-Since and If-Range
+  are honoured.
+- Content-addressed blobs (mediastore.storage), and URLs whose ?v= matches
+  the content hash, are cacheable for a year as immutable. Other URLs get
+  MEDIA_CACHE_MAX_AGE and revalidate.
+- Chat attachments are private. Only the sender and receiver of a message
+  can read them, and everyone else gets a 404, unless the same bytes are
+  also a post or profile photo. Their responses are ``private`` so shared
+  caches never store them. Everything else (post media, profile photos,
+  image variants) is public, as it was under django.conf.urls.static.
+- MEDIA_SENDFILE = 'x-accel-redirect' (nginx) or 'x-sendfile' (Apache,
+  lighttpd) keeps path checks, conditional requests and cache headers here.
+  The body, including ranges, is left to the front proxy. For nginx the
+  file is addressed as MEDIA_ACCEL_REDIRECT_LOCATION + path, which should be
+  an ``internal`` location aliased to MEDIA_ROOT.
+"""
+import json
+import mimetypes
+import os
+from urllib.parse import quote
+
+from django.conf import settings
+from django.contrib.auth.decorators import login_required
+from django.db.models import Q
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+from django.views.decorators.http import require_GET, require_POST, require_safe
+
+from mediastore import serving, storage, uploads
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+# Where chat attachments were stored before content-addressed blobs.
+CHAT_FILE_PREFIX = 'chat_files/'
+
+
+def _is_public_upload(name):
+    from accounts.models import Post, UserDetails
+
+    return (
+        Post.objects.filter(Q(image=name) | Q(video=name)).exists()
+        or UserDetails.objects.filter(profile_photo=name).exists()
+    )
+
+
+def _is_private(request, name):
+    """
+    Whether media file ``name`` is a chat attachment the requester may read.
+    Raises Http404 if it is one they may not read. Returns False for public
+    media.
+    """
+    from chat.models import Message
+
+    attachments = Message.objects.filter(file_attachment=name)
+    if not name.startswith(CHAT_FILE_PREFIX) and not attachments.exists():
+        return False
+    user = request.user
+    if user.is_authenticated and attachments.filter(Q(sender=user) | Q(receiver=user)).exists():
+        return True
+    if _is_public_upload(name):
+        return False
+    raise Http404('Media file not found')
+
+
+def _content_digest(name, path, stat):
+    """The file's SHA-256 if it is known without reading the file, else None."""
+    if storage.is_blob_name(name):
+        stem = os.path.splitext(os.path.basename(name))[0]
+        if len(stem) == 64 and all(c in '0123456789abcdef' for c in stem):
+            return stem
+    return serving.content_hash(path, stat, compute=False)
+
+
+def _cache_control(request, digest, path, private=False):
+    scope = 'private' if private else 'public'
+    # Blob names are content hashes themselves, so they never change either.
+    if storage.is_blob_name(path) or (digest and request.GET.get('v') == serving.version(digest)):
+        return f'{scope}, max-age={IMMUTABLE_MAX_AGE}, immutable'
+    return f"{scope}, max-age={getattr(settings, 'MEDIA_CACHE_MAX_AGE', 3600)}"
+
+
+def _if_range_matches(request, etag, last_modified):
+    """Whether a Range request may be answered with a partial response."""
+    value = request.headers.get('If-Range')
+    if not value:
+        return True
+    value = value.strip()
+    if value.startswith(('"', 'W/')):
+        # Ranges require a strong match; a weak validator never matches.
+        return value == etag
+    return parse_http_date_safe(value) == last_modified
+
+
+def _handoff(path, name):
+    mode = getattr(settings, 'MEDIA_SENDFILE', None)
+    if mode == 'x-accel-redirect':
+        location = getattr(settings, 'MEDIA_ACCEL_REDIRECT_LOCATION', '/protected-media/')
+        return 'X-Accel-Redirect', location.rstrip('/') + '/' + quote(name)
+    if mode == 'x-sendfile':
+        return 'X-Sendfile', path
+    return None
+
+
+def _set_headers(response, headers):
+    for header, value in headers.items():
+        response[header] = value
+
+
+@require_safe
+def serve_media(request, path):
+    found = serving.resolve(path)
+    if found is None:
+        raise Http404('Media file not found')
+    file_path, stat = found
+    private = _is_private(request, path)
+    digest = _content_digest(path, file_path, stat)
+    if digest is None:
+        # Hashing here would read a whole video before the first byte (or the
+        # sendfile handoff) goes out, so hash in the background instead.
+        serving.hash_later(path, file_path, stat)
+        etag = serving.stat_etag(stat)
+    else:
+        etag = f'"{digest}"'
+    last_modified = int(stat.st_mtime)
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(last_modified),
+        'Cache-Control': _cache_control(request, digest, path, private),
+        'Accept-Ranges': 'bytes',
+    }
+
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if not_modified is not None:
+        _set_headers(not_modified, headers)
+        return not_modified
+
+    content_type, encoding = mimetypes.guess_type(file_path)
+    content_type = content_type or 'application/octet-stream'
+    handoff = _handoff(file_path, path)
+    if handoff is not None:
+        response = HttpResponse(content_type=content_type)
+        response[handoff[0]] = handoff[1]
+        _set_headers(response, headers)
+        return response
+
+    size = stat.st_size
+    byte_range = None
+    if _if_range_matches(request, etag, last_modified):
+        try:
+            byte_range = serving.parse_range(request.headers.get('Range'), size)
+        except serving.RangeNotSatisfiable:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            _set_headers(response, headers)
+            return response
+
+    if byte_range is None:
+        response = FileResponse(open(file_path, 'rb'), content_type=content_type)
+    else:
+        start, end = byte_range
+        response = StreamingHttpResponse(
+            serving.FileRange(file_path, start, end), status=206, content_type=content_type
+        )
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = str(end - start + 1)
+    if encoding:
+        # A .gz upload is served as-is rather than transparently decoded.
+        response['Content-Type'] = 'application/octet-stream'
+    _set_headers(response, headers)
+    return response
+
+
+def _upload_error(exc):
+    return JsonResponse({'success': False, 'error': exc.message}, status=exc.status)
+
+
+@login_required
+@require_POST
+def create_upload(request):
+    """Open an upload session; size and type are checked before any bytes are sent."""
+    try:
+        data = json.loads(request.body or b'{}')
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'Invalid JSON'}, status=400)
+    if not isinstance(data, dict):
+        return JsonResponse({'success': False, 'error': 'Request body must be a JSON object'}, status=400)
+    try:
+        session = uploads.start(
+            request.user,
+            data.get('purpose'),
+            data.get('file_name'),
+            data.get('size'),
+            content_type=data.get('content_type', ''),
+            sha256=data.get('sha256', ''),
+        )
+    except uploads.UploadError as exc:
+        return _upload_error(exc)
+    return JsonResponse({'success': True, **uploads.state(session)}, status=201)
+
+
+@login_required
+@require_GET
+def upload_status(request, upload_id):
+    try:
+        session = uploads.get_session(request.user, upload_id)
+    except uploads.UploadError as exc:
+        return _upload_error(exc)
+    return JsonResponse({'success': True, **uploads.state(session)})
+
+
+@login_required
+@require_POST
+def upload_chunk(request, upload_id, index):
+    """Store one chunk; the raw request body is streamed to disk."""
+    try:
+        content_length = int(request.META.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        content_length = -1
+    try:
+        session = uploads.get_session(request.user, upload_id)
+        session = uploads.write_chunk(session, index, request, content_length)
+    except uploads.UploadError as exc:
+        return _upload_error(exc)
+    return JsonResponse({'success': True, **uploads.state(session)})
+
+
+@login_required
+@require_POST
+def abort_upload(request, upload_id):
+    try:
+        session = uploads.get_session(request.user, upload_id)
+    except uploads.UploadError as exc:
+        return _upload_error(exc)
+    if session.status == session.STATUS_UPLOADING:
+        uploads.abort(session)
+    return JsonResponse({'success': True, **uploads.state(session)})
@@ -0,0 +1,74 @@
+"""
+Fragment cache for the viewer-independent part of post cards.
+
+``{% postcard_cache "feed" post %}...{% endpostcard_cache %}`` (posts.templatetags.post_cards)
+caches the wrapped markup under a key built from the card template name, the
+post id and ``post.updated_at``, so an edited post misses on its own. Like and
+comment counts and the viewer's liked/bookmarked state stay outside the
+cached block and are rendered per request from the row's columns, so likes
+and comments never need to touch the cache. So is the video player: its
+``?v=`` content version only appears once the file has been hashed in the
+background, which does not change ``updated_at``. Edits and deletes also
+drop the current entry right away through ``invalidate``.
+
+``{% prefetch_postcards "feed" posts %}`` loads a whole page of entries with
+one get_many before the loop. Hits and misses are counted per template name.
+"""
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+
+CARD_TEMPLATES = ('feed', 'my_feed', 'saved')
+
+_lock = threading.Lock()
+_stats = {}  # template name -> {'hits': n, 'misses': n}
+
+
+def _ttl():
+    return getattr(settings, 'POST_CARD_CACHE_TTL', 60 * 60)
+
+
+def card_key(name, post):
+    version = int(post.updated_at.timestamp() * 1_000_000) if post.updated_at else 0
+    return f"postcard:{name}:{post.id}:{version}"
+
+
+def record(name, hit):
+    with _lock:
+        counts = _stats.setdefault(name, {'hits': 0, 'misses': 0})
+        counts['hits' if hit else 'misses'] += 1
+
+
+def get_many(name, posts):
+    """Return {post_id: html} for the cards of ``posts`` already cached."""
+    keys = {card_key(name, post): post.id for post in posts}
+    found = cache.get_many(list(keys))
+    return {keys[key]: html for key, html in found.items()}
+
+
+def get(name, post):
+    return cache.get(card_key(name, post))
+
+
+def put(name, post, html):
+    cache.set(card_key(name, post), html, _ttl())
+
+
+def invalidate(post):
+    """Drop every cached card for ``post`` at its current version."""
+    cache.delete_many([card_key(name, post) for name in CARD_TEMPLATES])
+
+
+def get_stats():
+    with _lock:
+        stats = {}
+        for name, counts in _stats.items():
+            total = counts['hits'] + counts['misses']
+            stats[name] = dict(counts, hit_ratio=round(counts['hits'] / total, 4) if total else None)
+    return stats
+
+
+def reset_stats():
+    with _lock:
+        _stats.clear()
@@ -0,0 +1,442 @@
+"""
+Cross-posting to Facebook, Instagram and LinkedIn.
+
+The share views call ``enqueue``. It stores a CrossPostJob and returns at once,
+so no request waits on the Graph or LinkedIn APIs. ``drain`` runs in the
+run_crossposts worker. It claims due jobs one at a time and makes the API
+calls with timeouts.
+
+Failures come in two kinds:
+
+- Worth retrying: network errors, rate limiting (429), 5xx responses and Graph
+  errors marked transient. These get exponential backoff from the platform's
+  entry in RETRY_POLICIES (override any entry with CROSSPOST_RETRY_POLICIES),
+  and a Retry-After header is honoured. The job fails once the platform's
+  ``max_attempts`` is used up.
+- Not worth retrying: other API errors, a missing configuration or an
+  unsupported post. The job fails straight away, since another try would get
+  the same answer.
+
+Instagram processes reel videos in the background. Rather than sleep until
+the media container is ready, the job stores the container id in ``state``
+and comes back every CROSSPOST_INSTAGRAM_POLL_INTERVAL seconds. These checks
+are not counted as attempts. The job gives up when
+CROSSPOST_INSTAGRAM_READY_TIMEOUT runs out. LinkedIn uploads likewise keep
+their asset id, so a retry never uploads the media twice.
+"""
+import logging
+import mimetypes
+from datetime import timedelta
+
+import requests
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from accounts.models import Post
+from posts.models import CrossPostJob, FacebookAndInstagramConfiguration, LinkedInConfiguration
+from socio.backoff import next_attempt_at
+
+logger = logging.getLogger(__name__)
+
+FACEBOOK_GRAPH_URL = 'https://graph.facebook.com/v18.0'
+INSTAGRAM_GRAPH_URL = 'https://graph.facebook.com/v19.0'
+LINKEDIN_API_URL = 'https://api.linkedin.com/v2'
+LINKEDIN_UPLOAD_MECHANISM = 'com.linkedin.digitalmedia.uploading.MediaUploadHttpRequest'
+# Instagram fetches media by URL, so it needs the public address of the site.
+DEFAULT_MEDIA_BASE_URL = 'https://sociov1.pythonanywhere.com'
+
+RETRY_POLICIES = {
+    CrossPostJob.PLATFORM_FACEBOOK: {'max_attempts': 5, 'base': 30, 'cap': 1800},
+    CrossPostJob.PLATFORM_INSTAGRAM: {'max_attempts': 5, 'base': 60, 'cap': 3600},
+    CrossPostJob.PLATFORM_LINKEDIN: {'max_attempts': 4, 'base': 60, 'cap': 3600},
+}
+# Graph API error codes for throttling and temporary outages.
+GRAPH_TRANSIENT_CODES = {1, 2, 4, 17, 32, 341, 613}
+
+ACTIVE_STATUSES = (CrossPostJob.STATUS_PENDING, CrossPostJob.STATUS_RUNNING)
+
+
+class CrossPostError(Exception):
+    """The platform refused the post, or it cannot be sent; retrying will not help."""
+
+
+class RetryableError(CrossPostError):
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class NotReady(Exception):
+    """The platform is still processing; look again in ``delay`` seconds."""
+
+    def __init__(self, delay):
+        super().__init__(f'Not ready, checking again in {delay}s')
+        self.delay = delay
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def retry_policy(platform):
+    overrides = _setting('CROSSPOST_RETRY_POLICIES', {}).get(platform, {})
+    return {**RETRY_POLICIES[platform], **overrides}
+
+
+def _timeout():
+    return _setting('CROSSPOST_HTTP_TIMEOUT', 60)
+
+
+def enqueue(user, post, platform):
+    """Queue ``post`` for ``platform``. Returns the job already queued for it, if there is one."""
+    with transaction.atomic():
+        job = CrossPostJob.objects.filter(post=post, platform=platform, status__in=ACTIVE_STATUSES).first()
+        if job is None:
+            job = CrossPostJob.objects.create(user=user, post=post, platform=platform)
+    return job
+
+
+def claim(now=None):
+    """Lease the next due job to this worker, or return None if nothing is due."""
+    now = now or timezone.now()
+    lease = timedelta(seconds=_setting('CROSSPOST_LEASE', 900))
+    # A running job whose lease ran out was left behind by a worker that died.
+    due = (
+        CrossPostJob.objects
+        .filter(status__in=ACTIVE_STATUSES, next_attempt_at__lte=now)
+        .order_by('next_attempt_at', 'id')
+    )
+    for job in due[:10]:
+        # Only one worker can move a job off the lease it saw.
+        claimed = CrossPostJob.objects.filter(
+            id=job.id, status=job.status, next_attempt_at=job.next_attempt_at
+        ).update(status=CrossPostJob.STATUS_RUNNING, next_attempt_at=now + lease, updated_at=now)
+        if claimed:
+            job.status = CrossPostJob.STATUS_RUNNING
+            job.next_attempt_at = now + lease
+            return job
+    return None
+
+
+def _record_failure(job, error, now, retry):
+    job.attempts += 1
+    job.last_error = str(error)[:2000]
+    policy = retry_policy(job.platform)
+    if not retry or job.attempts >= policy['max_attempts']:
+        job.status = CrossPostJob.STATUS_FAILED
+        job.finished_at = now
+        return
+    job.status = CrossPostJob.STATUS_PENDING
+    job.next_attempt_at = next_attempt_at(now, job.attempts, base=policy['base'], cap=policy['cap'])
+    retry_after = getattr(error, 'retry_after', None)
+    if retry_after:
+        job.next_attempt_at = max(job.next_attempt_at, now + timedelta(seconds=retry_after))
+
+
+def run(job):
+    """Make one attempt at a claimed ``job`` and save the outcome."""
+    try:
+        remote_id = PUBLISHERS[job.platform](job)
+    except NotReady as exc:
+        job.status = CrossPostJob.STATUS_PENDING
+        job.next_attempt_at = timezone.now() + timedelta(seconds=exc.delay)
+    except RetryableError as exc:
+        _record_failure(job, exc, timezone.now(), retry=True)
+    except CrossPostError as exc:
+        _record_failure(job, exc, timezone.now(), retry=False)
+    except requests.RequestException as exc:
+        _record_failure(job, f'Could not reach {job.get_platform_display()}: {exc}', timezone.now(), retry=True)
+    except Exception as exc:
+        logger.exception("Cross-post job %s failed", job.id)
+        _record_failure(job, exc, timezone.now(), retry=True)
+    else:
+        job.attempts += 1
+        job.status = CrossPostJob.STATUS_SUCCEEDED
+        job.remote_id = str(remote_id or '')[:255]
+        job.last_error = ''
+        job.finished_at = timezone.now()
+    job.save(update_fields=[
+        'status', 'attempts', 'last_error', 'state', 'remote_id', 'next_attempt_at', 'finished_at', 'updated_at',
+    ])
+    return job
+
+
+def drain(max_jobs=None):
+    """Run due jobs until none are left. Returns (succeeded, failed, rescheduled) counts."""
+    succeeded = failed = rescheduled = 0
+    while max_jobs is None or succeeded + failed + rescheduled < max_jobs:
+        job = claim()
+        if job is None:
+            break
+        run(job)
+        if job.status == CrossPostJob.STATUS_SUCCEEDED:
+            succeeded += 1
+        elif job.status == CrossPostJob.STATUS_FAILED:
+            failed += 1
+        else:
+            rescheduled += 1
+    return succeeded, failed, rescheduled
+
+
+def job_state(job):
+    return {
+        'job_id': job.id,
+        'post_id': job.post_id,
+        'platform': job.platform,
+        'status': job.status,
+        'finished': job.is_finished,
+        'attempts': job.attempts,
+        'max_attempts': retry_policy(job.platform)['max_attempts'],
+        'last_error': job.last_error,
+        'next_attempt_at': job.next_attempt_at.isoformat() if not job.is_finished else None,
+        'remote_id': job.remote_id,
+    }
+
+
+# -- Responses ---------------------------------------------------------------
+
+def _json(response):
+    try:
+        data = response.json()
+    except ValueError:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def _retry_after(response):
+    try:
+        return int(response.headers.get('Retry-After', ''))
+    except ValueError:
+        return None
+
+
+def _graph_json(response, label):
+    """Decoded body of a Graph API response. Raises if the response is an error."""
+    data = _json(response)
+    if response.status_code < 400 and 'error' not in data:
+        return data
+    error = data.get('error') or {}
+    message = f"{label} error: {error.get('message') or response.reason or response.status_code}"
+    if (response.status_code == 429 or response.status_code >= 500
+            or error.get('is_transient') or error.get('code') in GRAPH_TRANSIENT_CODES):
+        raise RetryableError(message, retry_after=_retry_after(response))
+    raise CrossPostError(message)
+
+
+def _linkedin_json(response):
+    data = _json(response)
+    if response.status_code < 400:
+        return data
+    message = f"LinkedIn error: {data.get('message') or response.reason or response.status_code}"
+    if response.status_code == 429 or response.status_code >= 500:
+        raise RetryableError(message, retry_after=_retry_after(response))
+    if response.status_code == 401:
+        message = 'LinkedIn access has expired; share the post again to reconnect.'
+    raise CrossPostError(message)
+
+
+# -- Platforms ---------------------------------------------------------------
+
+def _post(job):
+    post = Post.objects.filter(id=job.post_id, is_active=True).first()
+    if post is None:
+        raise CrossPostError('The post is no longer available.')
+    return post
+
+
+def _media(post):
+    """The file an image or video post shares, or None."""
+    return {'image': post.image, 'video': post.video}.get(post.post_type) or None
+
+
+def _meta_config(job):
+    config = FacebookAndInstagramConfiguration.objects.filter(created_by=job.user).last()
+    if config is None:
+        raise CrossPostError('Facebook and Instagram are not configured.')
+    return config
+
+
+def _save_state(job, **values):
+    job.state = {**job.state, **values}
+    job.save(update_fields=['state', 'updated_at'])
+
+
+def publish_to_facebook(job):
+    post = _post(job)
+    config = _meta_config(job)
+    page_url = f'{FACEBOOK_GRAPH_URL}/{config.page_id}'
+    if post.post_type == 'text':
+        response = requests.post(
+            f'{page_url}/feed',
+            data={'message': post.text_content, 'access_token': config.access_token},
+            timeout=_timeout(),
+        )
+    elif post.post_type == 'image' and post.image:
+        with post.image.open('rb') as source:
+            response = requests.post(
+                f'{page_url}/photos',
+                files={'source': source},
+                data={'message': post.caption or '', 'access_token': config.access_token},
+                timeout=_timeout(),
+            )
+    elif post.post_type == 'video' and post.video:
+        with post.video.open('rb') as source:
+            response = requests.post(
+                f'{page_url}/videos',
+                files={'source': source},
+                data={'description': post.caption or '', 'access_token': config.access_token},
+                timeout=_timeout(),
+            )
+    else:
+        raise CrossPostError('Unsupported post type or missing media.')
+    data = _graph_json(response, 'Facebook')
+    return data.get('post_id') or data.get('id')
+
+
+def _wait_for_instagram_media(job, creation_id, access_token):
+    """Return once the container is FINISHED; otherwise reschedule the job or fail it."""
+    response = requests.get(
+        f'{INSTAGRAM_GRAPH_URL}/{creation_id}',
+        params={'fields': 'status_code', 'access_token': access_token},
+        timeout=_timeout(),
+    )
+    status = _graph_json(response, 'Instagram').get('status_code')
+    if status == 'FINISHED':
+        return
+    if status == 'EXPIRED':
+        # Containers live for a day; make a new one on the next attempt.
+        _save_state(job, creation_id=None)
+        raise RetryableError('Instagram media container expired.')
+    if status == 'ERROR':
+        raise CrossPostError('Instagram could not process the video.')
+    ready_by = parse_datetime(job.state.get('ready_by') or '')
+    if ready_by and timezone.now() >= ready_by:
+        raise CrossPostError('Instagram is still processing the video; share it again later.')
+    raise NotReady(_setting('CROSSPOST_INSTAGRAM_POLL_INTERVAL', 10))
+
+
+def publish_to_instagram(job):
+    post = _post(job)
+    config = _meta_config(job)
+    if post.post_type == 'text':
+        raise CrossPostError('Instagram does not support text-only posts.')
+
+    creation_id = job.state.get('creation_id')
+    if not creation_id:
+        media = _media(post)
+        if not media:
+            raise CrossPostError('Missing media file.')
+        media_url = _setting('CROSSPOST_MEDIA_BASE_URL', DEFAULT_MEDIA_BASE_URL).rstrip('/') + media.url
+        data = {'caption': post.caption or '', 'access_token': config.access_token}
+        if post.post_type == 'image':
+            data['image_url'] = media_url
+        else:
+            data['video_url'] = media_url
+            data['media_type'] = 'REELS'
+        response = requests.post(f'{INSTAGRAM_GRAPH_URL}/{config.user_id}/media', data=data, timeout=_timeout())
+        creation_id = _graph_json(response, 'Instagram').get('id')
+        if not creation_id:
+            raise CrossPostError('Instagram error: failed to create the media container.')
+        timeout = timedelta(seconds=_setting('CROSSPOST_INSTAGRAM_READY_TIMEOUT', 1800))
+        _save_state(job, creation_id=creation_id, ready_by=(timezone.now() + timeout).isoformat())
+
+    if post.post_type == 'video':
+        _wait_for_instagram_media(job, creation_id, config.access_token)
+
+    response = requests.post(
+        f'{INSTAGRAM_GRAPH_URL}/{config.user_id}/media_publish',
+        data={'creation_id': creation_id, 'access_token': config.access_token},
+        timeout=_timeout(),
+    )
+    return _graph_json(response, 'Instagram').get('id')
+
+
+def _linkedin_asset(job, media, kind, author, access_token, headers):
+    """Register and upload ``media`` once; the asset id is kept in job.state."""
+    asset = job.state.get('asset')
+    if asset:
+        return asset
+    register = {
+        'registerUploadRequest': {
+            'recipes': [f'urn:li:digitalmediaRecipe:feedshare-{kind}'],
+            'owner': author,
+            'serviceRelationships': [{'relationshipType': 'OWNER', 'identifier': 'urn:li:userGeneratedContent'}],
+        }
+    }
+    response = requests.post(
+        f'{LINKEDIN_API_URL}/assets?action=registerUpload', json=register, headers=headers, timeout=_timeout()
+    )
+    try:
+        value = _linkedin_json(response)['value']
+        upload_url = value['uploadMechanism'][LINKEDIN_UPLOAD_MECHANISM]['uploadUrl']
+        asset = value['asset']
+    except (KeyError, TypeError):
+        raise CrossPostError(f'LinkedIn did not accept the {kind} upload.')
+
+    content_type = mimetypes.guess_type(media.name)[0] or 'application/octet-stream'
+    with media.open('rb') as source:
+        response = requests.put(
+            upload_url,
+            headers={'Authorization': f'Bearer {access_token}', 'Content-Type': content_type},
+            data=source,
+            timeout=_timeout(),
+        )
+    _linkedin_json(response)
+    _save_state(job, asset=asset)
+    return asset
+
+
+def publish_to_linkedin(job):
+    post = _post(job)
+    config = LinkedInConfiguration.objects.filter(created_by=job.user).last()
+    if config is None or not config.access_token:
+        raise CrossPostError('LinkedIn is not connected.')
+    if config.expires_at and config.expires_at <= timezone.now():
+        raise CrossPostError('LinkedIn access has expired; share the post again to reconnect.')
+
+    author = f'urn:li:person:{config.user_urn}'
+    headers = {
+        'Authorization': f'Bearer {config.access_token}',
+        'Content-Type': 'application/json',
+        'X-Restli-Protocol-Version': '2.0.0',
+    }
+    media = _media(post)
+    if post.post_type == 'text':
+        content = {'shareCommentary': {'text': post.text_content}, 'shareMediaCategory': 'NONE'}
+    elif media:
+        asset = _linkedin_asset(job, media, post.post_type, author, config.access_token, headers)
+        content = {
+            'shareCommentary': {'text': post.caption or ''},
+            'shareMediaCategory': post.post_type.upper(),
+            'media': [{
+                'status': 'READY',
+                'description': {'text': post.caption or ''},
+                'media': asset,
+                'title': {'text': f'{post.post_type.title()} Post'},
+            }],
+        }
+    else:
+        raise CrossPostError('Unsupported post type or missing media.')
+
+    response = requests.post(
+        f'{LINKEDIN_API_URL}/ugcPosts',
+        json={
+            'author': author,
+            'lifecycleState': 'PUBLISHED',
+            'specificContent': {'com.linkedin.ugc.ShareContent': content},
+            'visibility': {'com.linkedin.ugc.MemberNetworkVisibility': 'PUBLIC'},
+        },
+        headers=headers,
+        timeout=_timeout(),
+    )
+    data = _linkedin_json(response)
+    return response.headers.get('X-RestLi-Id') or data.get('id')
+
+
+PUBLISHERS = {
+    CrossPostJob.PLATFORM_FACEBOOK: publish_to_facebook,
+    CrossPostJob.PLATFORM_INSTAGRAM: publish_to_instagram,
+    CrossPostJob.PLATFORM_LINKEDIN: publish_to_linkedin,
+}
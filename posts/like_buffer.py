@@ -0,0 +1,220 @@
+"""
+Write-coalescing buffer for likes.
+
+With LIKE_BUFFER_ENABLED = True, ``toggle_like`` no longer writes anything
+itself. It flips the user's like in an in-process buffer keyed by
+(user, post), where the last write wins, and returns right away. A
+background flush runs at most LIKE_BUFFER_FLUSH_INTERVAL seconds later, or
+sooner once LIKE_BUFFER_MAX_PENDING intents are waiting. It applies the
+intents one post at a time in transactions of up to LIKE_BUFFER_BATCH_SIZE
+rows. Each transaction does one Like insert, one delete, one counter update
+and one notification insert. A burst of likes on a viral post therefore
+takes the database write lock a handful of times instead of once per click.
+Taps that cancel out inside a flush window never reach the database.
+
+Intents that were not flushed yet are lost if the process dies, so a
+restart can drop up to one flush window of likes. The Like table, counters
+and notifications stay consistent among themselves, and
+reconcile_post_counters repairs counter drift from races between processes.
+Each worker keeps its own buffer, so a user's toggles that land on
+different workers can be reordered inside a single window.
+
+With TASKS_EAGER = True the buffer is flushed inline after every toggle.
+"""
+import atexit
+import logging
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_flush_lock = threading.Lock()
+_pending = {}   # (user_id, post_id) -> [liked in the database, liked now]
+_inflight = {}  # the batch being flushed, still authoritative until it commits
+_post_deltas = {}  # post_id -> net like_count change waiting in _pending
+_timer = None
+
+
+def enabled():
+    return getattr(settings, 'LIKE_BUFFER_ENABLED', False)
+
+
+def _interval():
+    return getattr(settings, 'LIKE_BUFFER_FLUSH_INTERVAL', 1.0)
+
+
+def _max_pending():
+    return getattr(settings, 'LIKE_BUFFER_MAX_PENDING', 5000)
+
+
+def _batch_size():
+    return getattr(settings, 'LIKE_BUFFER_BATCH_SIZE', 500)
+
+
+def _buffered(key):
+    return _pending.get(key) or _inflight.get(key)
+
+
+def toggle(user_id, post_id):
+    """
+    Flip ``user_id``'s like on ``post_id``. Returns (liked, delta), where
+    delta is the change to the post's like_count that is still unflushed.
+    """
+    from accounts.models import Like
+
+    key = (user_id, post_id)
+    with _lock:
+        entry = _buffered(key)
+    stored = entry[1] if entry else Like.objects.filter(user_id=user_id, post_id=post_id).exists()
+    with _lock:
+        entry = _pending.get(key)
+        if entry is None:
+            # Re-check: a flush may have moved the key while we were reading.
+            current = _inflight[key][1] if key in _inflight else stored
+            entry = _pending[key] = [current, current]
+        entry[1] = not entry[1]
+        liked = entry[1]
+        delta = _post_deltas[post_id] = _post_deltas.get(post_id, 0) + (1 if liked else -1)
+        full = len(_pending) >= _max_pending()
+    _schedule(now=full)
+    return liked, delta
+
+
+def pending_count():
+    with _lock:
+        return len(_pending)
+
+
+def _schedule(now=False):
+    global _timer
+    if getattr(settings, 'TASKS_EAGER', False):
+        flush()
+        return
+    with _lock:
+        if _timer is not None:
+            if not now:
+                return
+            _timer.cancel()
+        _timer = threading.Timer(0 if now else _interval(), _run_flush)
+        _timer.daemon = True
+        _timer.start()
+
+
+def _run_flush():
+    global _timer
+    with _lock:
+        _timer = None
+    close_old_connections()
+    try:
+        flush()
+    except Exception:
+        logger.exception("Like buffer flush failed")
+    finally:
+        close_old_connections()
+
+
+def flush():
+    """Write every buffered intent to the database. Returns Like rows changed."""
+    global _pending, _inflight, _post_deltas
+    with _flush_lock:
+        with _lock:
+            batch, _pending, _post_deltas = _pending, {}, {}
+            _inflight = batch
+        by_post = {}
+        for (user_id, post_id), (was_liked, liked) in batch.items():
+            if was_liked != liked:
+                by_post.setdefault(post_id, {})[user_id] = liked
+        changed = 0
+        applied = set()
+        try:
+            for post_id, intents in by_post.items():
+                changed += _apply(post_id, intents, applied)
+        except Exception as exc:
+            # Try again later. Rows already written are not retried.
+            _restore(batch, applied)
+            error = exc
+        else:
+            error = None
+        with _lock:
+            _inflight = {}
+    if error is not None:
+        # Outside _flush_lock: with TASKS_EAGER this flushes again inline.
+        _schedule()
+        raise error
+    return changed
+
+
+def _restore(batch, applied):
+    """
+    Put the intents of a failed flush that were not committed back in the
+    buffer, with their like_count deltas, so the next flush retries them.
+    A key toggled again meanwhile keeps its newer intent but the database
+    state from the batch.
+    """
+    with _lock:
+        for key, entry in batch.items():
+            if key in applied:
+                continue
+            newer = _pending.get(key)
+            if newer is None:
+                _pending[key] = entry
+            else:
+                newer[0] = entry[0]
+            if entry[0] != entry[1]:
+                post_id = key[1]
+                _post_deltas[post_id] = _post_deltas.get(post_id, 0) + (1 if entry[1] else -1)
+
+
+def _apply(post_id, intents, applied):
+    from accounts import ranking
+    from accounts.models import Like, Post, UserDetails, UserStats
+    from notifications.models import Notification
+
+    author_id = Post.objects.filter(id=post_id).values_list('user_id', flat=True).first()
+    if author_id is None:
+        return 0
+    changed = 0
+    items = list(intents.items())
+    size = _batch_size()
+    for start in range(0, len(items), size):
+        chunk = items[start:start + size]
+        likers = [user_id for user_id, liked in chunk if liked]
+        unlikers = [user_id for user_id, liked in chunk if not liked]
+        with transaction.atomic():
+            existing = set(
+                Like.objects.filter(post_id=post_id, user_id__in=likers).values_list('user_id', flat=True)
+            )
+            added = [user_id for user_id in likers if user_id not in existing]
+            Like.objects.bulk_create([Like(user_id=user_id, post_id=post_id) for user_id in added], ignore_conflicts=True)
+            removed = Like.objects.filter(post_id=post_id, user_id__in=unlikers).delete()[0] if unlikers else 0
+            delta = len(added) - removed
+            if delta:
+                Post.bump(post_id, like_count=delta)
+                UserStats.bump(author_id, likes_received_count=delta)
+            if added:
+                ranking.record(post_id, 'like', count=len(added))
+
+            notify = [user_id for user_id in added if user_id != author_id]
+            names = dict(UserDetails.objects.filter(id__in=notify).values_list('id', 'username'))
+            Notification.objects.bulk_create([
+                Notification(
+                    user_id=author_id,
+                    sender_id=user_id,
+                    notification_type='like',
+                    content=f"{names[user_id]} liked your post.",
+                    related_object_id=post_id
+                )
+                for user_id in notify if user_id in names
+            ])
+        applied.update((user_id, post_id) for user_id, _ in chunk)
+        changed += len(added) + removed
+    return changed
+
+
+@atexit.register
+def _flush_at_exit():
+    if _pending:
+        _run_flush()
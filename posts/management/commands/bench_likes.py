@@ -0,0 +1,81 @@
+import threading
+import time
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.test import RequestFactory, override_settings
+
+from accounts.models import Post, UserDetails
+from posts import like_buffer
+from posts.views import toggle_like
+
+BENCH_PREFIX = 'bench_liker_'
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure sustained like toggles per second on one post, with the direct "
+        "write path and with the coalescing like buffer. Writes temporary users "
+        "and a post to the configured database and removes them afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--rounds', type=int, default=5, help="Toggles per user.")
+
+    def handle(self, *args, **options):
+        UserDetails.objects.filter(username__startswith=BENCH_PREFIX).delete()
+        password = make_password(None)
+        users = UserDetails.objects.bulk_create([
+            UserDetails(username=f'{BENCH_PREFIX}{i}', email=f'{BENCH_PREFIX}{i}@example.invalid', password=password)
+            for i in range(options['users'])
+        ])
+        users = list(UserDetails.objects.filter(username__startswith=BENCH_PREFIX))
+        post = Post.objects.create(user=users[0], text_content='like benchmark')
+        try:
+            for label, buffered in (('direct', False), ('buffered', True)):
+                with override_settings(LIKE_BUFFER_ENABLED=buffered, TASKS_EAGER=False):
+                    succeeded, attempts, elapsed = self.run_mode(
+                        post, users, options['threads'], options['rounds'], buffered
+                    )
+                post.refresh_from_db()
+                self.stdout.write(
+                    f"{label:>8}: {succeeded / elapsed:8.1f} likes/sec "
+                    f"({attempts / elapsed:.1f} attempts/sec, {attempts - succeeded} of {attempts} failed), "
+                    f"final like_count={post.like_count}, likes={post.likes.count()}"
+                )
+        finally:
+            UserDetails.objects.filter(username__startswith=BENCH_PREFIX).delete()
+
+    def run_mode(self, post, users, thread_count, rounds, buffered):
+        """Returns (successful toggles, attempted toggles, elapsed seconds)."""
+        factory = RequestFactory()
+        succeeded = []
+        shards = [users[i::thread_count] for i in range(thread_count)]
+
+        def worker(shard):
+            for _ in range(rounds):
+                for user in shard:
+                    request = factory.post(f'/posts/post/{post.id}/like/')
+                    request.user = user
+                    try:
+                        ok = toggle_like(request, post.id).status_code == 200
+                    except Exception:
+                        ok = False  # e.g. "database is locked" on the direct path
+                    if ok:
+                        succeeded.append(user.id)
+            close_old_connections()
+
+        threads = [threading.Thread(target=worker, args=(shard,)) for shard in shards]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if buffered:
+            # Sustained rate: the time to drain the buffer counts too.
+            like_buffer.flush()
+        elapsed = time.perf_counter() - started
+        return len(succeeded), len(users) * rounds, elapsed
@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 
 
 from django.contrib.auth import get_user_model
@@ -28,4 +29,58 @@ class LinkedInConfiguration(models.Model):
 
     def __str__(self):
         return self.client_id
-    
\ No newline at end of file
+    
+
+class CrossPostJob(models.Model):
+    """
+    A post queued for sharing to Facebook, Instagram or LinkedIn (see
+    posts.crosspost). The share views only insert a row and return its id;
+    the run_crossposts worker makes the API calls. As in OutboundEmail,
+    ``next_attempt_at`` is both the retry schedule and the claim lease.
+    ``state`` remembers finished steps, such as an Instagram media container,
+    so a retry picks up where the last attempt stopped.
+    """
+    PLATFORM_FACEBOOK = 'facebook'
+    PLATFORM_INSTAGRAM = 'instagram'
+    PLATFORM_LINKEDIN = 'linkedin'
+    PLATFORM_CHOICES = [
+        (PLATFORM_FACEBOOK, 'Facebook'),
+        (PLATFORM_INSTAGRAM, 'Instagram'),
+        (PLATFORM_LINKEDIN, 'LinkedIn'),
+    ]
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_SUCCEEDED = 'succeeded'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_SUCCEEDED, 'Succeeded'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+    user = models.ForeignKey(UserDetails, related_name='crosspost_jobs', on_delete=models.CASCADE)
+    post = models.ForeignKey('accounts.Post', related_name='crosspost_jobs', on_delete=models.CASCADE)
+    platform = models.CharField(max_length=10, choices=PLATFORM_CHOICES)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    state = models.JSONField(default=dict, blank=True)
+    # Id of the published object on the platform.
+    remote_id = models.CharField(max_length=255, blank=True)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='crosspost_due_idx'),
+            models.Index(fields=['post', 'platform', 'status'], name='crosspost_post_idx'),
+        ]
+
+    def __str__(self):
+        return f"Post {self.post_id} -> {self.platform} ({self.status})"
+
+    @property
+    def is_finished(self):
+        return self.status in (self.STATUS_SUCCEEDED, self.STATUS_FAILED)
@@ -0,0 +1,131 @@
+"""
+Full-text post search.
+
+On SQLite, post text/captions and comments each have an external-content
+FTS5 index (migration 0034) kept in sync by triggers, so edits, deletes and
+queryset updates are picked up without signal handlers. A post matches when
+its own text or any of its comments match. It is ranked by its best bm25
+hit, with comment hits scaled by COMMENT_RANK_FACTOR so a post's own words
+count for more, and returned with a highlighted snippet of that hit.
+
+Results are limited to what feed_view would show the viewer: their own and
+their friends' active posts, or every active post when signed out. Other
+database backends fall back to icontains over text and caption (no comment
+matches, no ranking). Like people search, pages use an offset cursor and
+stop at MAX_RESULTS.
+"""
+from django.db import connection
+from django.db.models import Q
+from django.utils.html import escape
+
+from accounts.models import Comment, Friendship, Post
+from socio import fts
+from socio.pagination import InvalidCursor, decode_cursor, encode_cursor
+
+POST_FTS = 'accounts_post_fts'
+COMMENT_FTS = 'accounts_comment_fts'
+# bm25 weights for text_content, caption.
+POST_WEIGHTS = (2.0, 1.0)
+COMMENT_RANK_FACTOR = 0.5
+MAX_RESULTS = 200
+SNIPPET_TOKENS = 16
+
+# Markers that cannot appear in user text; swapped for <mark> after escaping.
+_OPEN, _CLOSE = '\x02', '\x03'
+
+
+def _offset(cursor):
+    if not cursor:
+        return 0
+    values = decode_cursor(cursor)
+    if len(values) != 1 or not isinstance(values[0], int) or values[0] < 0:
+        raise InvalidCursor('Cursor does not match search')
+    return values[0]
+
+
+def highlight(snippet):
+    """HTML-escape an FTS snippet and turn its match markers into <mark> tags."""
+    return escape(snippet or '').replace(_OPEN, '<mark>').replace(_CLOSE, '</mark>')
+
+
+def _visibility(viewer):
+    if viewer is None or not viewer.is_authenticated:
+        return 'p.is_active = 1', []
+    sql = (
+        f'p.is_active = 1 AND (p.user_id = %s OR p.user_id IN '
+        f'(SELECT friend_id FROM {Friendship._meta.db_table} WHERE user_id = %s))'
+    )
+    return sql, [viewer.id, viewer.id]
+
+
+def _fts_hits(viewer, query, limit, offset):
+    match = fts.match_query(query)
+    if not match:
+        return []
+    visible, visible_params = _visibility(viewer)
+    post_rank = f"bm25({POST_FTS}{''.join(', %s' % w for w in POST_WEIGHTS)})"
+    snippet = "snippet({table}, -1, '%s', '%s', '…', %d)" % (_OPEN, _CLOSE, SNIPPET_TOKENS)
+    # SQLite returns the other columns of a MIN() aggregate from the row that
+    # held the minimum, so each post comes back with its best hit's snippet.
+    sql = f"""
+        SELECT post_id, MIN(score) AS best, snip FROM (
+            SELECT p.id AS post_id, {post_rank} AS score, {snippet.format(table=POST_FTS)} AS snip
+            FROM {POST_FTS} JOIN {Post._meta.db_table} p ON p.id = {POST_FTS}.rowid
+            WHERE {POST_FTS} MATCH %s AND {visible}
+            UNION ALL
+            SELECT p.id, bm25({COMMENT_FTS}) * %s, {snippet.format(table=COMMENT_FTS)}
+            FROM {COMMENT_FTS}
+            JOIN {Comment._meta.db_table} c ON c.id = {COMMENT_FTS}.rowid
+            JOIN {Post._meta.db_table} p ON p.id = c.post_id
+            WHERE {COMMENT_FTS} MATCH %s AND {visible}
+        )
+        GROUP BY post_id
+        ORDER BY best, post_id
+        LIMIT %s OFFSET %s
+    """
+    params = [match, *visible_params, COMMENT_RANK_FACTOR, match, *visible_params, limit, offset]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [(post_id, highlight(snip)) for post_id, _, snip in cursor.fetchall()]
+
+
+def _fallback_hits(viewer, query, limit, offset):
+    posts = Post.objects.visible()
+    if viewer is not None and viewer.is_authenticated:
+        posts = posts.filter(Q(user=viewer) | Q(user__friendships__friend=viewer))
+    for word in query.split():
+        posts = posts.filter(Q(text_content__icontains=word) | Q(caption__icontains=word))
+    rows = posts.order_by('-created_at', '-id').values_list('id', 'text_content', 'caption')
+    return [
+        (post_id, escape((text or caption or '')[:200]))
+        for post_id, text, caption in rows[offset:offset + limit]
+    ]
+
+
+def search_posts(viewer, query, cursor=None, per_page=10):
+    """
+    Return (posts, next_cursor) for ``query``, best matches first. Each post
+    carries ``search_snippet``, an HTML-safe excerpt with matches in <mark>.
+    """
+    query = (query or '').strip()
+    offset = _offset(cursor)
+    if not query or offset >= MAX_RESULTS:
+        return [], None
+    limit = min(per_page, MAX_RESULTS - offset) + 1
+    if fts.available():
+        hits = _fts_hits(viewer, query, limit, offset)
+    else:
+        hits = _fallback_hits(viewer, query, limit, offset)
+
+    next_cursor = None
+    if len(hits) > per_page:
+        hits = hits[:per_page]
+        next_cursor = encode_cursor([offset + per_page])
+    found = Post.objects.filter(id__in=[post_id for post_id, _ in hits]).with_engagement(viewer).in_bulk()
+    posts = []
+    for post_id, snippet in hits:
+        if post_id in found:
+            post = found[post_id]
+            post.search_snippet = snippet
+            posts.append(post)
+    return posts, next_cursor
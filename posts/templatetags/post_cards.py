@@ -0,0 +1,52 @@
+from django import template
+
+from posts import card_cache
+
+register = template.Library()
+
+PREFETCH_KEY = '_postcard_prefetch'
+
+
+class PostCardCacheNode(template.Node):
+    def __init__(self, nodelist, name, post):
+        self.nodelist = nodelist
+        self.name = name
+        self.post = post
+
+    def render(self, context):
+        name = self.name.resolve(context)
+        post = self.post.resolve(context)
+        prefetched = context.get(PREFETCH_KEY, {}).get(name)
+        if prefetched is not None:
+            html = prefetched.get(post.id)
+        else:
+            html = card_cache.get(name, post)
+        card_cache.record(name, html is not None)
+        if html is None:
+            html = self.nodelist.render(context)
+            card_cache.put(name, post, html)
+        return html
+
+
+@register.tag
+def postcard_cache(parser, token):
+    """
+    {% postcard_cache "feed" post %} ... {% endpostcard_cache %}
+
+    Caches the enclosed, viewer-independent markup per post version.
+    """
+    bits = token.split_contents()
+    if len(bits) != 3:
+        raise template.TemplateSyntaxError(f"'{bits[0]}' takes a template name and a post")
+    nodelist = parser.parse(('endpostcard_cache',))
+    parser.delete_first_token()
+    return PostCardCacheNode(nodelist, parser.compile_filter(bits[1]), parser.compile_filter(bits[2]))
+
+
+@register.simple_tag(takes_context=True)
+def prefetch_postcards(context, name, posts):
+    """Fetch a whole page of cached cards in one round trip before the loop."""
+    prefetch = context.get(PREFETCH_KEY) or {}
+    prefetch[name] = card_cache.get_many(name, posts)
+    context[PREFETCH_KEY] = prefetch
+    return ''
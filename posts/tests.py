@@ -1,3 +1,715 @@
-from django.test import TestCase
+import json
+import shutil
+import tempfile
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts import timeline
+from accounts.models import Bookmark, Comment, Friendship, Like, Post, UserDetails, UserStats
+from mediastore import serving
+from notifications.models import Notification
+from posts import card_cache, crosspost, like_buffer
+from posts.models import CrossPostJob, FacebookAndInstagramConfiguration, LinkedInConfiguration
+from socio.pagination import encode_cursor
+from PIL import Image
+
+
+class FeedQueryCountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer = UserDetails.objects.create_user(username='viewer', email='viewer@example.com', password='pw')
+        cls.friends = [
+            UserDetails.objects.create_user(username=f'friend{i}', email=f'friend{i}@example.com', password='pw')
+            for i in range(3)
+        ]
+        for friend in cls.friends:
+            Friendship.link(cls.viewer.id, friend.id)
+
+    def setUp(self):
+        self.client.force_login(self.viewer)
+
+    def make_posts(self, count):
+        authors = [self.viewer, *self.friends]
+        for i in range(count):
+            author = authors[i % len(authors)]
+            post = Post.objects.create(user=author, text_content=f'post {i}')
+            for liker in authors[:1 + i % len(authors)]:
+                Like.objects.create(user=liker, post=post)
+            Comment.objects.create(user=self.friends[0], post=post, content='nice')
+            if i % 2:
+                Bookmark.objects.create(user=self.viewer, post=post)
+        timeline.rebuild()
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def assertConstantQueries(self, url_name):
+        url = reverse(url_name)
+        self.make_posts(2)
+        small = self.count_queries(url)
+        self.make_posts(18)
+        large = self.count_queries(url)
+        self.assertEqual(small, large)
+        return large
+
+    def test_home_feed_query_count_is_constant(self):
+        self.assertConstantQueries('posts:feed')
+
+    def test_my_feed_query_count_is_constant(self):
+        self.assertConstantQueries('posts:my_feed')
+
+    def test_saved_posts_query_count_is_constant(self):
+        self.assertConstantQueries('posts:saved_posts')
+
+    def test_home_feed_page_queries(self):
+        self.make_posts(20)
+        # session, user, high-fanout friends, timeline slice, posts with
+        # engagement, unread-notification count from the context processor
+        with self.assertNumQueries(6):
+            response = self.client.get(reverse('posts:feed'))
+        self.assertEqual(len(response.context['posts']), 10)
+
+    def test_viewer_state_annotations(self):
+        post = Post.objects.create(user=self.friends[0], text_content='hello')
+        Like.objects.create(user=self.viewer, post=post)
+        Bookmark.objects.create(user=self.friends[1], post=post)
+
+        annotated = Post.objects.with_engagement(self.viewer).get(id=post.id)
+        self.assertTrue(annotated.viewer_has_liked)
+        self.assertFalse(annotated.viewer_has_bookmarked)
+
+        other = Post.objects.with_engagement(self.friends[1]).get(id=post.id)
+        self.assertFalse(other.viewer_has_liked)
+        self.assertTrue(other.viewer_has_bookmarked)
+
+
+class PostCounterTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = UserDetails.objects.create_user(username='author', email='author@example.com', password='pw')
+        cls.reader = UserDetails.objects.create_user(username='reader', email='reader@example.com', password='pw')
+
+    def setUp(self):
+        self.post = Post.objects.create(user=self.author, text_content='hello')
+        self.client.force_login(self.reader)
+
+    def test_like_toggle_maintains_counter(self):
+        url = reverse('posts:toggle_like', args=[self.post.id])
+        response = self.client.post(url)
+        self.assertEqual(response.json()['like_count'], 1)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.like_count, 1)
+
+        response = self.client.post(url)
+        self.assertEqual(response.json()['like_count'], 0)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.like_count, 0)
+
+    def test_comment_maintains_counter(self):
+        url = reverse('posts:add_comment', args=[self.post.id])
+        for expected in (1, 2):
+            response = self.client.post(url, json.dumps({'content': 'nice'}), content_type='application/json')
+            self.assertEqual(response.json()['comment_count'], expected)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 2)
+
+    def test_deleting_a_post_takes_its_likes_off_the_author(self):
+        self.client.post(reverse('posts:toggle_like', args=[self.post.id]))
+        other = Post.objects.create(user=self.author, text_content='kept')
+        self.client.post(reverse('posts:toggle_like', args=[other.id]))
+        self.assertEqual(UserStats.objects.get(user=self.author).likes_received_count, 2)
+
+        self.client.force_login(self.author)
+        self.client.get(reverse('posts:delete_post', args=[self.post.id]))
+        self.assertEqual(UserStats.objects.get(user=self.author).likes_received_count, 1)
+
+    def test_reconcile_fixes_drift(self):
+        Like.objects.create(user=self.reader, post=self.post)
+        Comment.objects.create(user=self.reader, post=self.post, content='a')
+        untouched = Post.objects.create(user=self.author, text_content='other')
+
+        call_command('reconcile_post_counters', chunk_size=1, stdout=StringIO())
+        self.post.refresh_from_db()
+        untouched.refresh_from_db()
+        self.assertEqual((self.post.like_count, self.post.comment_count), (1, 1))
+        self.assertEqual((untouched.like_count, untouched.comment_count), (0, 0))
+
+
+class FeedSliceTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = UserDetails.objects.create_user(username='slicer', email='slicer@example.com', password='pw')
+        for i in range(15):
+            Post.objects.create(user=cls.user, text_content=f'post {i}')
+        timeline.rebuild()
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def test_fragment_returns_cards_and_cursor(self):
+        response = self.client.get(reverse('posts:feed'), headers={'X-Feed-Fragment': 'posts'})
+        body = response.content.decode()
+        self.assertEqual(body.count('class="post-card"'), 10)
+        self.assertNotIn('<html', body)
+        cursor = response['X-Next-Cursor']
+        self.assertTrue(cursor)
+        self.assertIn('X-Feed-Fragment', response['Vary'])
+
+        response = self.client.get(reverse('posts:my_feed'), {'cursor': cursor}, headers={'X-Feed-Fragment': 'posts'})
+        self.assertEqual(response.content.decode().count('class="post-card"'), 5)
+        self.assertEqual(response['X-Next-Cursor'], '')
+
+    def test_tampered_cursor_is_a_bad_request(self):
+        chronological = encode_cursor([timezone.now(), 1])
+        tampered = [
+            ('posts:feed', {}, encode_cursor(['not a date', 1])),
+            ('posts:feed', {'mode': 'ranked'}, chronological),
+            ('posts:my_feed', {}, encode_cursor([{'dt': 'x'}, 1])),
+            ('posts:my_feed', {}, encode_cursor([timezone.now(), {'id': 1}])),
+            ('posts:saved_posts', {}, encode_cursor([timezone.now(), 'one'])),
+        ]
+        for name, params, cursor in tampered:
+            with self.subTest(view=name, params=params):
+                response = self.client.get(reverse(name), {**params, 'cursor': cursor})
+                self.assertEqual(response.status_code, 400)
+
+    def test_json_slice(self):
+        response = self.client.get(reverse('posts:my_feed'), headers={'Accept': 'application/json'})
+        data = response.json()
+        self.assertEqual(len(data['posts']), 10)
+        self.assertEqual(data['posts'][0]['text_content'], 'post 14')
+        self.assertEqual(data['posts'][0]['like_count'], 0)
+        self.assertFalse(data['posts'][0]['viewer_has_liked'])
+        self.assertTrue(data['next_cursor'])
+
+
+class PostCardCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = UserDetails.objects.create_user(username='carder', email='carder@example.com', password='pw')
+
+    def setUp(self):
+        cache.clear()
+        card_cache.reset_stats()
+        self.post = Post.objects.create(user=self.user, text_content='first version')
+        self.client.force_login(self.user)
+
+    def test_second_render_hits_cache(self):
+        self.client.get(reverse('posts:my_feed'))
+        response = self.client.get(reverse('posts:my_feed'))
+        self.assertContains(response, 'first version')
+        self.assertEqual(card_cache.get_stats()['my_feed'], {'hits': 1, 'misses': 1, 'hit_ratio': 0.5})
+
+    def test_edit_renders_new_content(self):
+        self.client.get(reverse('posts:my_feed'))
+        self.client.post(reverse('posts:edit_post', args=[self.post.id]), {
+            'post_type': 'text', 'text_content': 'second version',
+        })
+        response = self.client.get(reverse('posts:my_feed'))
+        self.assertContains(response, 'second version')
+        self.assertNotContains(response, 'first version')
+
+    def test_viewer_state_is_not_cached(self):
+        self.client.get(reverse('posts:my_feed'))
+        self.client.post(reverse('posts:toggle_like', args=[self.post.id]))
+        response = self.client.get(reverse('posts:my_feed'), headers={'X-Feed-Fragment': 'posts'})
+        self.assertContains(response, 'like-button liked')
+        self.assertEqual(card_cache.get_stats()['my_feed']['hits'], 1)
+
+    def test_video_url_is_versioned_once_hashed_without_invalidating(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        with self.settings(MEDIA_ROOT=media_root):
+            video = Post.objects.create(user=self.user, post_type='video', caption='clip')
+            video.video.save('clip.mp4', ContentFile(b'not really a video'))
+            self.assertNotContains(self.client.get(reverse('posts:my_feed')), '?v=')
+
+            serving.content_hash(*serving.resolve(video.video.name))
+            response = self.client.get(reverse('posts:my_feed'))
+        self.assertContains(response, f'{video.video.url}?v=')
+        self.assertEqual(card_cache.get_stats()['my_feed']['hits'], 2)
+
+
+class CommentThreadTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = UserDetails.objects.create_user(username='talker', email='talker@example.com', password='pw')
+        cls.post = Post.objects.create(user=cls.user, text_content='discuss')
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def comment(self, content, parent=None):
+        url = reverse('posts:add_comment', args=[self.post.id])
+        payload = {'content': content, 'parent_id': parent['id'] if parent else None}
+        response = self.client.post(url, json.dumps(payload), content_type='application/json')
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()['comment']
+
+    def test_pages_follow_cursor_in_both_orders(self):
+        for i in range(25):
+            self.comment(f'c{i}')
+        url = reverse('posts:get_comments', args=[self.post.id])
+
+        first = self.client.get(url).json()
+        self.assertEqual([c['content'] for c in first['comments']][:2], ['c0', 'c1'])
+        self.assertEqual(first['comment_count'], 25)
+        second = self.client.get(url, {'cursor': first['next_cursor']}).json()
+        self.assertEqual(len(second['comments']), 5)
+        self.assertIsNone(second['next_cursor'])
+
+        newest = self.client.get(url, {'order': 'newest'}).json()
+        self.assertEqual(newest['comments'][0]['content'], 'c24')
+        self.assertEqual(self.client.get(url, {'cursor': 'junk'}).status_code, 400)
+
+    def test_replies_and_subtree(self):
+        root = self.comment('root')
+        other = self.comment('other')
+        reply = self.comment('reply', parent=root)
+        nested = self.comment('nested', parent=reply)
+        self.assertEqual((reply['depth'], nested['depth']), (1, 2))
+
+        url = reverse('posts:get_comments', args=[self.post.id])
+        top = self.client.get(url).json()['comments']
+        self.assertEqual([c['id'] for c in top], [root['id'], other['id']])
+        self.assertEqual(top[0]['reply_count'], 1)
+        replies = self.client.get(url, {'parent': root['id']}).json()['comments']
+        self.assertEqual([c['id'] for c in replies], [reply['id']])
+
+        thread_url = reverse('posts:get_comment_thread', args=[self.post.id, root['id']])
+        with self.assertNumQueries(5):
+            # session, user, post, root comment, subtree page
+            thread = self.client.get(thread_url).json()
+        self.assertEqual([c['id'] for c in thread['comments']], [root['id'], reply['id'], nested['id']])
+        self.assertEqual(thread['comment_count'], 4)
+
+    def test_reply_must_belong_to_post(self):
+        root = self.comment('root')
+        other_post = Post.objects.create(user=self.user, text_content='elsewhere')
+        response = self.client.post(
+            reverse('posts:add_comment', args=[other_post.id]),
+            json.dumps({'content': 'stray', 'parent_id': root['id']}), content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class LikersTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer = UserDetails.objects.create_user(username='looker', email='looker@example.com', password='pw')
+        cls.post = Post.objects.create(user=cls.viewer, text_content='likeable')
+        cls.likers = [
+            UserDetails.objects.create_user(username=f'fan{i}', email=f'fan{i}@example.com', password='pw')
+            for i in range(25)
+        ]
+        for liker in cls.likers:
+            Like.objects.create(user=liker, post=cls.post)
+        Friendship.link(cls.viewer.id, cls.likers[0].id)
+        Friendship.link(cls.viewer.id, cls.likers[3].id)
+        Post.objects.filter(id=cls.post.id).update(like_count=25)
+
+    def setUp(self):
+        self.client.force_login(self.viewer)
+
+    def test_friends_first_then_recency(self):
+        url = reverse('posts:get_likers', args=[self.post.id])
+        first = self.client.get(url).json()
+        names = [liker['username'] for liker in first['likers']]
+        self.assertEqual(names[:3], ['fan3', 'fan0', 'fan24'])
+        self.assertEqual(first['friend_count'], 2)
+        self.assertEqual(first['like_count'], 25)
+
+        second = self.client.get(url, {'cursor': first['next_cursor']}).json()
+        names += [liker['username'] for liker in second['likers']]
+        self.assertIsNone(second['next_cursor'])
+        self.assertEqual(sorted(names), sorted(liker.username for liker in self.likers))
+
+    def test_friend_count_covers_more_friends_than_a_page(self):
+        Friendship.link_many(self.viewer.id, [liker.id for liker in self.likers])
+        url = reverse('posts:get_likers', args=[self.post.id])
+        first = self.client.get(url).json()
+        self.assertEqual(first['friend_count'], 25)
+        # 20 friends up front, then the first page of the rest (also friends).
+        self.assertEqual(len(first['likers']), 25)
+        self.assertTrue(all(liker['is_friend'] for liker in first['likers']))
+        self.assertIsNone(first['next_cursor'])
+
+
+@override_settings(LIKE_BUFFER_ENABLED=True, TASKS_EAGER=True)
+class LikeBufferTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = UserDetails.objects.create_user(username='poster', email='poster@example.com', password='pw')
+        cls.fans = [
+            UserDetails.objects.create_user(username=f'clicker{i}', email=f'clicker{i}@example.com', password='pw')
+            for i in range(3)
+        ]
+
+    def setUp(self):
+        self.post = Post.objects.create(user=self.author, text_content='viral')
+
+    def test_view_goes_through_buffer(self):
+        self.client.force_login(self.fans[0])
+        response = self.client.post(reverse('posts:toggle_like', args=[self.post.id]))
+        self.assertEqual(response.json(), {'success': True, 'liked': True, 'like_count': 1})
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.like_count, 1)
+        self.assertTrue(Notification.objects.filter(user=self.author, notification_type='like').exists())
+
+    def test_flush_coalesces_intents(self):
+        Like.objects.create(user=self.fans[2], post=self.post)
+        Post.bump(self.post.id, like_count=1)
+        with mock.patch.object(like_buffer, '_schedule'):
+            like_buffer.toggle(self.fans[0].id, self.post.id)
+            like_buffer.toggle(self.fans[1].id, self.post.id)
+            like_buffer.toggle(self.fans[1].id, self.post.id)
+            liked, pending = like_buffer.toggle(self.fans[2].id, self.post.id)
+        self.assertEqual((liked, pending), (False, 0))
+        self.assertEqual(Like.objects.filter(post=self.post).count(), 1)
+
+        # fans[1] liked and unliked inside one window, so only two rows change.
+        self.assertEqual(like_buffer.flush(), 2)
+        self.assertEqual(
+            set(Like.objects.filter(post=self.post).values_list('user_id', flat=True)), {self.fans[0].id}
+        )
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.like_count, 1)
+
+    def test_failed_flush_keeps_unwritten_intents_and_deltas(self):
+        other = Post.objects.create(user=self.author, text_content='also viral')
+        real_apply = like_buffer._apply
+
+        def fail_on_other(post_id, intents, applied):
+            if post_id == other.id:
+                raise RuntimeError('database is locked')
+            return real_apply(post_id, intents, applied)
+
+        with mock.patch.object(like_buffer, '_schedule'):
+            like_buffer.toggle(self.fans[0].id, self.post.id)
+            like_buffer.toggle(self.fans[0].id, other.id)
+            like_buffer.toggle(self.fans[1].id, other.id)
+            with mock.patch.object(like_buffer, '_apply', side_effect=fail_on_other):
+                with self.assertRaises(RuntimeError):
+                    like_buffer.flush()
+
+            # self.post was written; other's two likes are still buffered.
+            self.assertEqual(Like.objects.filter(post=self.post).count(), 1)
+            self.assertEqual(like_buffer._post_deltas, {other.id: 2})
+            self.assertEqual(like_buffer.pending_count(), 2)
+            self.assertEqual(like_buffer.toggle(self.fans[1].id, other.id), (False, 1))
+            self.assertEqual(like_buffer.toggle(self.fans[2].id, self.post.id), (True, 1))
+
+            self.assertEqual(like_buffer.flush(), 2)
+        self.assertEqual(set(Like.objects.filter(post=other).values_list('user_id', flat=True)), {self.fans[0].id})
+        other.refresh_from_db()
+        self.post.refresh_from_db()
+        self.assertEqual((other.like_count, self.post.like_count), (1, 2))
+        self.assertEqual(like_buffer._post_deltas, {})
+
+
+class RankedFeedTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer = UserDetails.objects.create_user(username='ranker', email='ranker@example.com', password='pw')
+        cls.friend = UserDetails.objects.create_user(username='ranked', email='ranked@example.com', password='pw')
+        Friendship.link(cls.viewer.id, cls.friend.id)
+
+    def setUp(self):
+        self.client.force_login(self.viewer)
+        self.old, self.middle, self.new = [
+            Post.objects.create(user=self.friend, text_content=name) for name in ('old', 'middle', 'new')
+        ]
+        timeline.rebuild()
+
+    def feed(self, **params):
+        response = self.client.get(reverse('posts:feed'), params, headers={'Accept': 'application/json'})
+        return [post['text_content'] for post in response.json()['posts']]
+
+    def test_engagement_lifts_post_in_ranked_mode_only(self):
+        self.client.post(reverse('posts:toggle_like', args=[self.middle.id]))
+        self.client.post(
+            reverse('posts:add_comment', args=[self.middle.id]),
+            json.dumps({'content': 'great'}), content_type='application/json'
+        )
+        self.assertEqual(self.feed(), ['new', 'middle', 'old'])
+        self.assertEqual(self.feed(mode='ranked')[0], 'middle')
+
+    def test_rescore_matches_incremental_scores(self):
+        self.client.post(reverse('posts:toggle_like', args=[self.old.id]))
+        self.client.post(reverse('posts:toggle_bookmark', args=[self.old.id]))
+        self.old.refresh_from_db()
+        incremental = self.old.rank_score
+
+        call_command('rescore_posts', stdout=StringIO())
+        self.old.refresh_from_db()
+        self.assertAlmostEqual(self.old.rank_score, incremental, places=3)
+
+
+class PostSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer = UserDetails.objects.create_user(username='seeker', email='seeker@example.com', password='pw')
+        cls.friend = UserDetails.objects.create_user(username='pal', email='pal@example.com', password='pw')
+        cls.stranger = UserDetails.objects.create_user(username='stranger', email='stranger@example.com', password='pw')
+        Friendship.link(cls.viewer.id, cls.friend.id)
+
+    def setUp(self):
+        self.client.force_login(self.viewer)
+
+    def search(self, q, **params):
+        response = self.client.get(reverse('posts:search_posts'), {'q': q, **params}, headers={'Accept': 'application/json'})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_matches_text_caption_and_comments_within_friends(self):
+        own = Post.objects.create(user=self.viewer, text_content='Baking sourdough bread today')
+        captioned = Post.objects.create(user=self.friend, post_type='image', caption='Fresh sourdough')
+        commented = Post.objects.create(user=self.friend, text_content='Weekend plans')
+        Comment.add(self.viewer, commented, 'bring some sourdough please')
+        Post.objects.create(user=self.stranger, text_content='Sourdough secrets')
+        Post.objects.create(user=self.friend, text_content='hidden sourdough', is_active=False)
+
+        data = self.search('sourdo')
+        self.assertEqual({post['id'] for post in data['posts']}, {own.id, captioned.id, commented.id})
+        snippets = {post['id']: post['snippet'] for post in data['posts']}
+        self.assertIn('<mark>sourdough</mark>', snippets[commented.id])
+
+    def test_index_follows_edits_and_escapes_snippets(self):
+        post = Post.objects.create(user=self.viewer, text_content='<b>tulips</b> everywhere')
+        self.assertEqual(self.search('tulips')['posts'][0]['snippet'], '&lt;b&gt;<mark>tulips</mark>&lt;/b&gt; everywhere')
+        post.text_content = 'roses now'
+        post.save()
+        self.assertEqual(self.search('tulips')['posts'], [])
+        self.assertEqual(len(self.search('roses')['posts']), 1)
+
+    def test_cursor_pages(self):
+        for i in range(12):
+            Post.objects.create(user=self.friend, text_content=f'garden update {i}')
+        first = self.search('garden')
+        self.assertEqual(len(first['posts']), 10)
+        second = self.search('garden', cursor=first['next_cursor'])
+        self.assertEqual(len(second['posts']), 2)
+        self.assertIsNone(second['next_cursor'])
+        self.assertFalse({p['id'] for p in first['posts']} & {p['id'] for p in second['posts']})
+
+
+class ImageVariantTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = UserDetails.objects.create_user(username='snapper', email='snapper@example.com', password='pw')
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        override = self.settings(MEDIA_ROOT=media_root, TASKS_EAGER=True)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.client.force_login(self.user)
+
+    def upload(self):
+        # Stored 1600x1200 with EXIF orientation 6, i.e. displayed as 1200x1600.
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        exif[0x010F] = 'SecretCam'
+        buffer = BytesIO()
+        Image.new('RGB', (1600, 1200), (200, 80, 40)).save(buffer, 'JPEG', exif=exif)
+        image = SimpleUploadedFile('photo.jpg', buffer.getvalue(), content_type='image/jpeg')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('posts:create_post'), {'post_type': 'image', 'caption': 'sunset', 'image': image})
+        return Post.objects.get(user=self.user)
+
+    def test_variants_are_generated_after_upload(self):
+        post = self.upload()
+        meta = post.image_meta
+        self.assertEqual(meta['source'], post.image.name)
+        self.assertEqual((meta['width'], meta['height']), (1200, 1600))
+        self.assertTrue(meta['placeholder'].startswith('data:image/webp;base64,'))
+        self.assertEqual([v['width'] for v in meta['variants']], [320, 640, 1080])
+
+        from django.core.files.storage import default_storage
+        with default_storage.open(meta['variants'][0]['jpeg']) as handle:
+            variant = Image.open(handle)
+            self.assertEqual(variant.size, (320, 427))
+            self.assertEqual(len(variant.getexif()), 0)
+
+        html = self.client.get(reverse('posts:my_feed')).content.decode()
+        self.assertIn('type="image/webp"', html)
+        self.assertIn('width="1200" height="1600"', html)
+
+    def test_replaced_image_falls_back_until_processed(self):
+        post = self.upload()
+        Post.objects.filter(id=post.id).update(image='post_images/other.jpg')
+        post.refresh_from_db()
+        html = self.client.get(reverse('posts:my_feed')).content.decode()
+        self.assertNotIn('<picture>', html)
+        self.assertIn('post_images/other.jpg', html)
+
+
+class FakeResponse:
+    def __init__(self, status_code=200, data=None, headers=None):
+        self.status_code = status_code
+        self.data = data or {}
+        self.headers = headers or {}
+        self.reason = 'Error'
+
+    def json(self):
+        return self.data
+
+
+@override_settings(CROSSPOST_RETRY_POLICIES={'facebook': {'max_attempts': 3, 'base': 60}})
+class CrossPostJobTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = UserDetails.objects.create_user(username='sharer', email='sharer@example.com', password='pw')
+        cls.other = UserDetails.objects.create_user(username='other', email='other@example.com', password='pw')
+        FacebookAndInstagramConfiguration.objects.create(
+            created_by=cls.user, access_token='token', page_id='page', user_id='iguser'
+        )
+        cls.post = Post.objects.create(user=cls.user, text_content='hello world')
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def share(self, platform='facebook', post=None):
+        return self.client.post(reverse(f'posts:post_to_{platform}', args=[(post or self.post).id]))
+
+    def test_share_only_queues_a_job(self):
+        with mock.patch.object(crosspost.requests, 'post') as api:
+            response = self.share()
+            again = self.share()
+        api.assert_not_called()
+        self.assertEqual(response.status_code, 202)
+        job = response.json()['job']
+        self.assertEqual((job['platform'], job['status']), ('facebook', 'pending'))
+        # Sharing again while the first job is waiting returns the same job.
+        self.assertEqual(again.json()['job']['job_id'], job['job_id'])
+
+        status = self.client.get(reverse('posts:crosspost_status', args=[job['job_id']])).json()
+        self.assertEqual(status['job']['status'], 'pending')
+        self.client.force_login(self.other)
+        self.assertEqual(self.client.get(reverse('posts:crosspost_status', args=[job['job_id']])).status_code, 404)
+
+    def test_share_rejects_text_on_instagram_and_other_users_posts(self):
+        self.assertEqual(self.share('instagram').status_code, 400)
+        self.client.force_login(self.other)
+        self.assertEqual(self.share().status_code, 404)
+        self.assertFalse(CrossPostJob.objects.exists())
+
+    def test_worker_publishes_job(self):
+        job = crosspost.enqueue(self.user, self.post, CrossPostJob.PLATFORM_FACEBOOK)
+        with mock.patch.object(crosspost.requests, 'post', return_value=FakeResponse(data={'id': 'page_1'})) as api:
+            out = StringIO()
+            call_command('run_crossposts', stdout=out)
+        self.assertIn('Shared 1 posts', out.getvalue())
+        self.assertEqual(api.call_args.kwargs['data']['message'], 'hello world')
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.remote_id, job.attempts), ('succeeded', 'page_1', 1))
+        self.assertIsNotNone(job.finished_at)
+
+    def test_transient_errors_back_off_until_attempts_run_out(self):
+        job = crosspost.enqueue(self.user, self.post, CrossPostJob.PLATFORM_FACEBOOK)
+        busy = FakeResponse(503, {'error': {'message': 'Service unavailable'}})
+        with mock.patch.object(crosspost.requests, 'post', return_value=busy):
+            self.assertEqual(crosspost.drain(), (0, 0, 1))
+            job.refresh_from_db()
+            self.assertEqual((job.status, job.attempts), ('pending', 1))
+            self.assertGreater(job.next_attempt_at, timezone.now() + timedelta(seconds=50))
+            # Not due yet: the worker leaves it alone.
+            self.assertEqual(crosspost.drain(), (0, 0, 0))
+
+            for _ in range(2):
+                CrossPostJob.objects.filter(id=job.id).update(next_attempt_at=timezone.now())
+                crosspost.drain()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('failed', 3))
+        self.assertIn('Service unavailable', job.last_error)
+
+    def test_permanent_error_fails_at_once(self):
+        job = crosspost.enqueue(self.user, self.post, CrossPostJob.PLATFORM_FACEBOOK)
+        refused = FakeResponse(400, {'error': {'message': 'Invalid OAuth access token', 'code': 190}})
+        with mock.patch.object(crosspost.requests, 'post', return_value=refused):
+            self.assertEqual(crosspost.drain(), (0, 1, 0))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('failed', 1))
+        self.assertEqual(job.last_error, 'Facebook error: Invalid OAuth access token')
+
+    def test_rate_limit_honours_retry_after(self):
+        job = crosspost.enqueue(self.user, self.post, CrossPostJob.PLATFORM_FACEBOOK)
+        limited = FakeResponse(429, {'error': {'message': 'Slow down'}}, {'Retry-After': '7200'})
+        with mock.patch.object(crosspost.requests, 'post', return_value=limited):
+            crosspost.drain()
+        job.refresh_from_db()
+        self.assertGreater(job.next_attempt_at, timezone.now() + timedelta(seconds=7000))
+
+    def test_expired_lease_is_claimed_again(self):
+        job = crosspost.enqueue(self.user, self.post, CrossPostJob.PLATFORM_FACEBOOK)
+        self.assertEqual(crosspost.claim().id, job.id)
+        self.assertIsNone(crosspost.claim())
+        CrossPostJob.objects.filter(id=job.id).update(next_attempt_at=timezone.now())
+        self.assertEqual(crosspost.claim().id, job.id)
+
+    def test_instagram_video_is_rescheduled_until_ready(self):
+        post = Post.objects.create(user=self.user, post_type='video', video='post_videos/clip.mp4', caption='reel')
+        job = crosspost.enqueue(self.user, post, CrossPostJob.PLATFORM_INSTAGRAM)
+        posted = [FakeResponse(data={'id': 'container'}), FakeResponse(data={'id': 'media_1'})]
+        with mock.patch.object(crosspost.requests, 'post', side_effect=posted) as api, \
+                mock.patch.object(crosspost.requests, 'get', return_value=FakeResponse(data={'status_code': 'IN_PROGRESS'})):
+            self.assertEqual(crosspost.drain(), (0, 0, 1))
+            job.refresh_from_db()
+            self.assertEqual((job.status, job.attempts, job.state['creation_id']), ('pending', 0, 'container'))
+
+            CrossPostJob.objects.filter(id=job.id).update(next_attempt_at=timezone.now())
+            with mock.patch.object(crosspost.requests, 'get', return_value=FakeResponse(data={'status_code': 'FINISHED'})):
+                self.assertEqual(crosspost.drain(), (1, 0, 0))
+        # The container was created once and reused for the publish call.
+        self.assertEqual(api.call_count, 2)
+        self.assertEqual(api.call_args.kwargs['data']['creation_id'], 'container')
+        self.assertTrue(api.call_args_list[0].kwargs['data']['video_url'].endswith(post.video.url))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.remote_id), ('succeeded', 'media_1'))
+
+    def test_linkedin_share_is_limited_to_the_author(self):
+        LinkedInConfiguration.objects.create(created_by=self.other, client_id='cid', client_secret='secret', user_urn='abc')
+        self.client.force_login(self.other)
+        response = self.client.get(reverse('posts:linkedin_login', args=[self.post.id]))
+        self.assertEqual(response.status_code, 404)
+
+        session = self.client.session
+        session['post_id'] = self.post.id
+        session.save()
+        with mock.patch('posts.views.requests.post') as api:
+            response = self.client.get(reverse('posts:linkedin_callback'), {'code': 'xyz'})
+        self.assertEqual(response.status_code, 404)
+        api.assert_not_called()
+        self.assertFalse(CrossPostJob.objects.exists())
+
+    def test_linkedin_callback_queues_the_post(self):
+        LinkedInConfiguration.objects.create(created_by=self.user, client_id='cid', client_secret='secret', user_urn='abc')
+        session = self.client.session
+        session['post_id'] = self.post.id
+        session.save()
+        with mock.patch('posts.views.requests.post', return_value=FakeResponse(data={'access_token': 'li-token'})):
+            response = self.client.get(reverse('posts:linkedin_callback'), {'code': 'xyz'})
+        job = CrossPostJob.objects.get(platform=CrossPostJob.PLATFORM_LINKEDIN)
+        self.assertRedirects(response, f"{reverse('posts:my_feed')}?crosspost_job={job.id}", fetch_redirect_response=False)
+
+        published = FakeResponse(201, headers={'X-RestLi-Id': 'urn:li:share:1'})
+        with mock.patch.object(crosspost.requests, 'post', return_value=published) as api:
+            crosspost.drain()
+        self.assertEqual(api.call_args.kwargs['headers']['Authorization'], 'Bearer li-token')
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.remote_id), ('succeeded', 'urn:li:share:1'))
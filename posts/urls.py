@@ -4,6 +4,7 @@ app_name = 'posts'
 
 urlpatterns = [
     path('create/', views.create_post, name='create_post'),
+    path('upload/<uuid:upload_id>/finalize/', views.finalize_video_upload, name='finalize_video_upload'),
    
     path('feed/', views.feed_view, name='feed'),
     path('my_feed/', views.my_feed, name='my_feed'),
@@ -14,11 +15,14 @@ urlpatterns = [
     path('post/<int:post_id>/like/', views.toggle_like, name='toggle_like'),
     path('post/<int:post_id>/comment/', views.add_comment, name='add_comment'),
     path('post/<int:post_id>/comments/', views.get_comments, name='get_comments'),
+    path('post/<int:post_id>/comments/<int:comment_id>/thread/', views.get_comment_thread, name='get_comment_thread'),
     path('post/<int:post_id>/likers/', views.get_likers, name='get_likers'),
 
 
     path('post/<int:post_id>/bookmark/', views.toggle_bookmark, name='toggle_bookmark'),
     path('saved-posts/', views.saved_posts_view, name='saved_posts'),
+    path('search/', views.search_posts, name='search_posts'),
+    path('card-cache/stats/', views.card_cache_stats, name='card_cache_stats'),
 
 
     path('linkedin_config/',views.linkedin_config,name='linkedin_config'),
@@ -31,6 +35,7 @@ urlpatterns = [
     path('post/<int:post_id>/share/facebook/', views.post_to_facebook, name='post_to_facebook'),
 
     path('post/<int:post_id>/share/linkedin/', views.linkedin_login, name='linkedin_login'),
+    path('crosspost/<int:job_id>/', views.crosspost_status, name='crosspost_status'),
     path("linkedin/callback/", views.linkedin_callback, name="linkedin_callback"),
 
    
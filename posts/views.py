@@ -1,14 +1,32 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.http import JsonResponse
-from django.core.paginator import Paginator
-from django.db.models import Q
+from django.http import HttpResponse, HttpResponseBadRequest, JsonResponse
+from django.template.loader import render_to_string
+from django.urls import reverse
+from django.utils.cache import patch_vary_headers
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef, Q
 import json
 from django.views.decorators.http import require_POST
 from accounts.forms import PostForm
-from accounts.models import Post, Like, Comment, Bookmark
+from accounts import ranking, timeline
+from accounts.models import Post, Like, Comment, Bookmark, Friendship, UserStats
 from notifications.models import Notification 
+from posts import card_cache, crosspost, like_buffer
+from posts.search import search_posts as run_post_search
+from mediastore import images, serving, uploads
+from socio.pagination import CursorPaginator, InvalidCursor
+
+FEED_PAGE_SIZE = 10
+COMMENT_PAGE_SIZE = 20
+LIKERS_PAGE_SIZE = 20
+# Keyset order for post lists; the id tiebreak makes the cursor unique.
+POST_ORDERING = ('-created_at', '-id')
+COMMENT_ORDERINGS = {
+    'oldest': ('created_at', 'id'),
+    'newest': ('-created_at', '-id'),
+}
 
 @login_required
 def create_post(request):
@@ -16,81 +34,163 @@ def create_post(request):
     if request.method == 'POST':
         form = PostForm(request.POST, request.FILES)
         if form.is_valid():
-            post = form.save(commit=False)
-            post.user = request.user
-            post.save()
-
-            # NEW: Notify friends about the new post
-            friends = request.user.get_friends()
-            for friend in friends:
-                Notification.objects.create(
-                    user=friend,
-                    sender=request.user,
-                    notification_type='new_post',
-                    content=f"{request.user.username} posted a new {post.post_type}.",
-                    related_object_id=post.id
-                )
+            _publish_post(request, form)
             messages.success(request, 'Post created successfully!')
             return redirect('posts:feed')
         else:
             messages.error(request, 'Please correct the errors below.')
     else:
         form = PostForm()
-    return render(request, 'posts/create_post.html', {'form': form})
+    return render(request, 'posts/create_post.html', {'form': form, 'video_max_size': uploads.max_size('post_video')})
+
+def _publish_post(request, form):
+    post = form.save(commit=False)
+    post.user = request.user
+    with transaction.atomic():
+        post.save()
+        UserStats.bump(request.user.id, posts_count=1)
+        timeline.enqueue_fanout(post)
+
+    # Friends' timeline rows and notifications (see accounts.timeline), image
+    # variants and the video's content hash are produced in the background
+    images.schedule(post, 'image')
+    serving.prime(post.video)
+    return post
 
-def feed_view(request):
-    """Main feed view"""
-    if request.user.is_authenticated:
-        friends = request.user.get_friends()
-        friend_ids = [friend.id for friend in friends]
-        friend_ids.append(request.user.id)
-        posts = Post.objects.filter(
-            user_id__in=friend_ids,
-            is_active=True
-        ).select_related('user').prefetch_related('likes', 'comments', 'bookmarks')
+@login_required
+@require_POST
+def finalize_video_upload(request, upload_id):
+    """
+    Create a video post from a finished chunked upload (see mediastore.uploads).
+    Retrying after a lost response returns the same post.
+    """
+    try:
+        data = json.loads(request.body or b'{}')
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'Invalid JSON'}, status=400)
+    if not isinstance(data, dict):
+        return JsonResponse({'success': False, 'error': 'Request body must be a JSON object'}, status=400)
+    try:
+        session = uploads.get_session(request.user, upload_id)
+        if session.purpose != session.PURPOSE_POST_VIDEO:
+            raise uploads.UploadError('Upload is not a post video')
+        if session.status == session.STATUS_COMPLETE:
+            return JsonResponse({'success': True, 'post_id': session.result['post_id'], 'redirect_url': reverse('posts:feed')})
+        with uploads.finishing(session, data.get('sha256')) as upload:
+            form = PostForm(
+                {'post_type': 'video', 'text_content': data.get('text_content', ''), 'caption': data.get('caption', '')},
+                {'video': upload},
+            )
+            if not form.is_valid():
+                errors = [error for field_errors in form.errors.values() for error in field_errors]
+                return JsonResponse({'success': False, 'error': ' '.join(errors)}, status=400)
+            with transaction.atomic():
+                post = _publish_post(request, form)
+                uploads.complete(session, {'post_id': post.id})
+    except uploads.UploadError as exc:
+        return JsonResponse({'success': False, 'error': exc.message}, status=exc.status)
+    messages.success(request, 'Post created successfully!')
+    return JsonResponse({'success': True, 'post_id': post.id, 'redirect_url': reverse('posts:feed')}, status=201)
+
+def _post_json(post):
+    return {
+        'id': post.id,
+        'post_type': post.post_type,
+        'text_content': post.text_content,
+        'caption': post.caption,
+        'image': images.variant_url(post.image, post.image_meta, 1080),
+        'video': serving.versioned_url(post.video),
+        'created_at': post.created_at.isoformat(),
+        'user': {
+            'id': post.user.id,
+            'username': post.user.username,
+            'first_name': post.user.first_name,
+            'profile_photo': images.avatar_url(post.user),
+        },
+        'like_count': post.like_count,
+        'comment_count': post.comment_count,
+        'viewer_has_liked': post.viewer_has_liked,
+        'viewer_has_bookmarked': post.viewer_has_bookmarked,
+    }
+
+
+def _feed_response(request, posts, page_template, card_name):
+    """
+    Render a page of posts in the form the client asked for: compact JSON for
+    Accept: application/json, bare post cards for infinite scroll
+    (X-Feed-Fragment header, next cursor in X-Next-Cursor), else the full page.
+    """
+    accept = request.headers.get('Accept', '')
+    if 'application/json' in accept and 'text/html' not in accept:
+        response = JsonResponse({
+            'success': True,
+            'posts': [_post_json(post) for post in posts],
+            'next_cursor': posts.next_cursor,
+        })
+    elif request.headers.get('X-Feed-Fragment'):
+        # Rendered without context processors: the slice has no page chrome.
+        response = HttpResponse(render_to_string('posts/partials/post_slice.html', {
+            'posts': posts,
+            'card_template': f'posts/partials/{card_name}_post_card.html',
+            'card_name': card_name,
+            'request': request,
+        }))
+        response['X-Next-Cursor'] = posts.next_cursor or ''
     else:
-        posts = Post.objects.filter(is_active=True).select_related('user').prefetch_related('likes', 'comments', 'bookmarks')
-    paginator = Paginator(posts, 10)
-    page_number = request.GET.get('page')
-    posts = paginator.get_page(page_number)
-    for post in posts:
-        post.user_has_liked = post.likes.filter(user=request.user).exists()
-        post.user_has_bookmarked = post.bookmarks.filter(user=request.user).exists()
-    return render(request, 'feed.html', {'posts': posts})
+        response = render(request, page_template, {'posts': posts})
+    patch_vary_headers(response, ('Accept', 'X-Feed-Fragment'))
+    return response
 
 
-from django.core.paginator import Paginator
-from django.shortcuts import render
+def feed_view(request):
+    """Main feed view. ?mode=ranked orders by engagement score instead of time."""
+    ranked = request.GET.get('mode') == 'ranked'
+    cursor = request.GET.get('cursor')
+    try:
+        if request.user.is_authenticated:
+            home = timeline.HomeTimeline(request.user)
+            if ranked:
+                posts = home.get_ranked_page(cursor, FEED_PAGE_SIZE)
+            else:
+                posts = home.get_page(cursor, FEED_PAGE_SIZE)
+        else:
+            posts = CursorPaginator(
+                Post.objects.visible().with_engagement(request.user),
+                timeline.HomeTimeline.RANKED_ORDERING if ranked else POST_ORDERING, FEED_PAGE_SIZE
+            ).get_page(cursor)
+    except InvalidCursor:
+        return HttpResponseBadRequest('Invalid cursor')
+    return _feed_response(request, posts, 'feed.html', 'feed')
+
 
 def my_feed(request):
     """Main feed view - only user's own posts"""
     if request.user.is_authenticated:
-        posts = Post.objects.filter(
-            user=request.user,
-            is_active=True
-        ).select_related('user').prefetch_related('likes', 'comments', 'bookmarks')
+        posts = Post.objects.visible().filter(user=request.user).with_engagement(request.user)
     else:
         # If not logged in, probably no posts should be shown or handle accordingly
         posts = Post.objects.none()
-    
-    paginator = Paginator(posts, 10)
-    page_number = request.GET.get('page')
-    posts = paginator.get_page(page_number)
-
-    for post in posts:
-        post.user_has_liked = post.likes.filter(user=request.user).exists()
-        post.user_has_bookmarked = post.bookmarks.filter(user=request.user).exists()
-    
-    return render(request, 'my_feed.html', {'posts': posts})
+    try:
+        posts = CursorPaginator(posts, POST_ORDERING, FEED_PAGE_SIZE).get_page(request.GET.get('cursor'))
+    except InvalidCursor:
+        return HttpResponseBadRequest('Invalid cursor')
+    return _feed_response(request, posts, 'my_feed.html', 'my_feed')
 
 @login_required
 def delete_post(request, post_id):
     post = get_object_or_404(Post, id=post_id, user=request.user)
-    print("Deleting post with ID:", post_id)
     if request.method == 'GET':
-        post.delete()
+        was_active = post.is_active
+        card_cache.invalidate(post)
+        with transaction.atomic():
+            # The post's likes go with it, so the author loses them from their total.
+            likes = Like.objects.filter(post=post).count()
+            post.delete()
+            deltas = {'likes_received_count': -likes}
+            if was_active:
+                deltas['posts_count'] = -1
+            UserStats.bump(request.user.id, **deltas)
         messages.success(request, "Post deleted successfully.")
-        print("Post deleted successfully:", post_id)
     else:
         messages.error(request, "Invalid request method.")
     
@@ -104,7 +204,13 @@ def edit_post(request, post_id):
     if request.method == 'POST':
         form = PostEditForm(request.POST, request.FILES, instance=post)
         if form.is_valid():
+            # updated_at moves on save, which versions the key; drop the old card now.
+            card_cache.invalidate(post)
             form.save()
+            if 'image' in form.changed_data:
+                images.schedule(post, 'image')
+            if 'video' in form.changed_data:
+                serving.prime(post.video)
             messages.success(request, "Post updated successfully.")
             return redirect('posts:my_feed')
     else:
@@ -141,17 +247,34 @@ def toggle_like(request, post_id):
     """Toggle like/unlike for a post"""
     try:
         post = get_object_or_404(Post, id=post_id)
-        like, created = Like.objects.get_or_create(user=request.user, post=post)
-        if not created:
-            like.delete()
-            liked = False
-        else:
-            liked = True
+        if like_buffer.enabled():
+            # Coalesced write path: the like is stored by the next buffer flush.
+            liked, pending = like_buffer.toggle(request.user.id, post.id)
+            return JsonResponse({
+                'success': True,
+                'liked': liked,
+                'like_count': max(post.like_count + pending, 0)
+            })
+        with transaction.atomic():
+            like, created = Like.objects.get_or_create(user=request.user, post=post)
+            if not created:
+                # Only the request that actually removed the row decrements.
+                deleted, _ = Like.objects.filter(id=like.id).delete()
+                delta = -1 if deleted else 0
+                liked = False
+            else:
+                delta = 1
+                liked = True
+            counters = Post.bump(post.id, like_count=delta)
+            UserStats.bump(post.user_id, likes_received_count=delta)
+            if delta > 0:
+                ranking.record(post.id, 'like')
+        if liked:
 
             # ✅ Create notification when liked (but NOT for your own post)
-            if post.user != request.user:
+            if post.user_id != request.user.id:
                 Notification.objects.create(
-                    user=post.user,
+                    user_id=post.user_id,
                     sender=request.user,
                     notification_type='like',
                     content=f"{request.user.username} liked your post.",
@@ -161,7 +284,7 @@ def toggle_like(request, post_id):
         return JsonResponse({
             'success': True,
             'liked': liked,
-            'like_count': post.get_like_count()
+            'like_count': counters['like_count']
         })
     except Exception as e:
         return JsonResponse({
@@ -221,16 +344,29 @@ def add_comment(request, post_id):
                 'error': 'Comment content cannot be empty'
             }, status=400)
 
-        comment = Comment.objects.create(
-            user=request.user,
-            post=post,
-            content=content
-        )
+        parent = None
+        if data.get('parent_id'):
+            parent = Comment.objects.filter(id=data['parent_id'], post=post).first()
+            if parent is None:
+                return JsonResponse({
+                    'success': False,
+                    'error': 'Reply target not found'
+                }, status=400)
+            if parent.depth >= Comment.max_depth():
+                return JsonResponse({
+                    'success': False,
+                    'error': 'Replies are nested too deeply'
+                }, status=400)
+
+        with transaction.atomic():
+            comment = Comment.add(request.user, post, content, parent=parent)
+            counters = Post.bump(post.id, comment_count=1)
+            ranking.record(post.id, 'comment')
 
         # ✅ Create notification when commented (but NOT for your own post)
-        if post.user != request.user:
+        if post.user_id != request.user.id:
             Notification.objects.create(
-                user=post.user,
+                user_id=post.user_id,
                 sender=request.user,
                 notification_type='comment',
                 content=f"{request.user.username} commented on your post.",
@@ -239,17 +375,8 @@ def add_comment(request, post_id):
 
         return JsonResponse({
             'success': True,
-            'comment': {
-                'id': comment.id,
-                'content': comment.content,
-                'user': {
-                    'username': comment.user.username,
-                    'profile_photo': comment.user.profile_photo.url if comment.user.profile_photo else None
-                },
-                'created_at': comment.created_at.strftime('%Y-%m-%d %H:%M:%S'),
-                'time_ago': 'just now'
-            },
-            'comment_count': post.get_comment_count()
+            'comment': _comment_json(comment),
+            'comment_count': counters['comment_count']
         })
     except Exception as e:
         return JsonResponse({
@@ -258,57 +385,143 @@ def add_comment(request, post_id):
         }, status=400)
 
 
+def _comment_json(comment):
+    # Clients format created_at themselves; rendering display strings for
+    # every row was a large share of the old serialization time.
+    return {
+        'id': comment.id,
+        'content': comment.content,
+        'user': {
+            'username': comment.user.username,
+            'profile_photo': images.avatar_url(comment.user)
+        },
+        'created_at': comment.created_at.isoformat(),
+        'parent_id': comment.parent_id,
+        'depth': comment.depth,
+        'reply_count': comment.reply_count,
+    }
+
+
+def _comments_response(post, page):
+    return JsonResponse({
+        'success': True,
+        'comments': [_comment_json(comment) for comment in page],
+        'next_cursor': page.next_cursor,
+        'comment_count': post.comment_count
+    })
+
+
 @login_required
 def get_comments(request, post_id):
-    """Get all comments for a post"""
+    """
+    One page of a post's top-level comments, or of the direct replies to
+    ?parent=<comment id>. ?order=oldest|newest, then follow next_cursor.
+    """
+    post = get_object_or_404(Post, id=post_id)
+    ordering = COMMENT_ORDERINGS.get(request.GET.get('order', 'oldest'))
+    if ordering is None:
+        return JsonResponse({'success': False, 'error': 'Unknown order'}, status=400)
+    parent_id = request.GET.get('parent') or None
+    if parent_id is not None and not parent_id.isdigit():
+        return JsonResponse({'success': False, 'error': 'Invalid parent'}, status=400)
+
+    comments = Comment.objects.filter(post=post, parent_id=parent_id).select_related('user')
     try:
-        post = get_object_or_404(Post, id=post_id)
-        comments = post.comments.select_related('user').order_by('created_at')
-        comments_data = []
-        for comment in comments:
-            comments_data.append({
-                'id': comment.id,
-                'content': comment.content,
-                'user': {
-                    'username': comment.user.username,
-                    'profile_photo': comment.user.profile_photo.url if comment.user.profile_photo else None
-                },
-                'created_at': comment.created_at.strftime('%Y-%m-%d %H:%M:%S'),
-                'time_ago': comment.created_at.strftime('%b %d, %Y at %I:%M %p')
-            })
-        return JsonResponse({
-            'success': True,
-            'comments': comments_data,
-            'comment_count': len(comments_data)
-        })
-    except Exception as e:
-        return JsonResponse({
-            'success': False,
-            'error': str(e)
-        }, status=400)
+        page = CursorPaginator(comments, ordering, COMMENT_PAGE_SIZE).get_page(request.GET.get('cursor'))
+    except InvalidCursor:
+        return JsonResponse({'success': False, 'error': 'Invalid cursor'}, status=400)
+    return _comments_response(post, page)
+
+
+@login_required
+def get_comment_thread(request, post_id, comment_id):
+    """A comment and all of its replies in depth-first order, paged by path."""
+    post = get_object_or_404(Post, id=post_id)
+    root = get_object_or_404(Comment, id=comment_id, post=post)
+    try:
+        page = CursorPaginator(
+            root.subtree().select_related('user'), ('path',), COMMENT_PAGE_SIZE
+        ).get_page(request.GET.get('cursor'))
+    except InvalidCursor:
+        return JsonResponse({'success': False, 'error': 'Invalid cursor'}, status=400)
+    return _comments_response(post, page)
+
+def _liker_json(like, is_friend):
+    return {
+        'id': like.user.id,
+        'username': like.user.username,
+        'profile_photo': images.avatar_url(like.user),
+        'is_friend': is_friend,
+    }
+
 
 @login_required
 def get_likers(request, post_id):
-    """Get users who liked a post"""
+    """
+    Users who liked a post. The first page leads with the viewer's friends
+    (most recent first, up to LIKERS_PAGE_SIZE of them); everyone else follows
+    newest first and is paged with next_cursor. like_count comes from the
+    post's counter so the client can say "and N others".
+    """
+    post = get_object_or_404(Post, id=post_id)
+    # A correlated EXISTS on the friendship key instead of an IN list of the
+    # viewer's whole friend set, which grows with the friend count.
+    likes = Like.objects.filter(post=post).select_related('user').annotate(
+        is_friend=Exists(Friendship.objects.filter(user=request.user, friend_id=OuterRef('user_id')))
+    )
+    friend_likes = likes.filter(is_friend=True)
+
+    # The friends shown up front are the same few rows on every page, so
+    # later pages can leave them out without carrying them in the cursor.
+    shown_friends = list(friend_likes.order_by('-created_at', '-id')[:LIKERS_PAGE_SIZE])
+    cursor = request.GET.get('cursor')
     try:
-        post = get_object_or_404(Post, id=post_id)
-        likes = post.likes.select_related('user').order_by('-created_at')
-        likers_data = []
-        for like in likes:
-            likers_data.append({
-                'username': like.user.username,
-                'profile_photo': like.user.profile_photo.url if like.user.profile_photo else None
-            })
-        return JsonResponse({
+        page = CursorPaginator(
+            likes.exclude(id__in=[like.id for like in shown_friends]),
+            ('-created_at', '-id'), LIKERS_PAGE_SIZE
+        ).get_page(cursor)
+    except InvalidCursor:
+        return JsonResponse({'success': False, 'error': 'Invalid cursor'}, status=400)
+
+    likers = [] if cursor else [_liker_json(like, True) for like in shown_friends]
+    likers += [_liker_json(like, like.is_friend) for like in page]
+    return JsonResponse({
+        'success': True,
+        'likers': likers,
+        # All friends who liked it, not just the ones shown first.
+        'friend_count': len(shown_friends) if len(shown_friends) < LIKERS_PAGE_SIZE else friend_likes.count(),
+        'next_cursor': page.next_cursor,
+        'like_count': post.like_count
+    })
+
+def search_posts(request):
+    """Full-text post search: ?q=<text>&cursor=<token>. JSON for Accept: application/json."""
+    query = request.GET.get('q', '')
+    try:
+        posts, next_cursor = run_post_search(request.user, query, request.GET.get('cursor'), FEED_PAGE_SIZE)
+    except InvalidCursor:
+        return JsonResponse({'success': False, 'error': 'Invalid cursor'}, status=400)
+    accept = request.headers.get('Accept', '')
+    if 'application/json' in accept and 'text/html' not in accept:
+        response = JsonResponse({
             'success': True,
-            'likers': likers_data,
-            'like_count': post.get_like_count()
+            'posts': [{**_post_json(post), 'snippet': post.search_snippet} for post in posts],
+            'next_cursor': next_cursor,
         })
-    except Exception as e:
-        return JsonResponse({
-            'success': False,
-            'error': str(e)
-        }, status=400)
+    else:
+        response = render(request, 'posts/search.html', {
+            'posts': posts,
+            'next_cursor': next_cursor,
+            'search_query': query,
+        })
+    patch_vary_headers(response, ('Accept',))
+    return response
+
+@login_required
+def card_cache_stats(request):
+    if not request.user.is_staff:
+        return JsonResponse({'error': 'Permission denied'}, status=403)
+    return JsonResponse(card_cache.get_stats())
 
 @login_required
 @require_POST
@@ -322,6 +535,7 @@ def toggle_bookmark(request, post_id):
             bookmarked = False
         else:
             bookmarked = True
+            ranking.record(post.id, 'bookmark')
         return JsonResponse({
             'success': True,
             'bookmarked': bookmarked,
@@ -335,13 +549,15 @@ def toggle_bookmark(request, post_id):
 @login_required
 def saved_posts_view(request):
     """View to display all bookmarked posts for the current user"""
-    bookmarked_posts = Post.objects.filter(bookmarks__user=request.user).order_by('-bookmarks__created_at')
-    paginator = Paginator(bookmarked_posts, 10)
-    page_number = request.GET.get('page')
-    posts = paginator.get_page(page_number)
-    for post in posts:
-        post.user_has_liked = post.likes.filter(user=request.user).exists()
-        post.user_has_bookmarked = post.bookmarks.filter(user=request.user).exists()
+    # The bookmark's columns are annotated on so the cursor can key on them.
+    posts = Post.objects.filter(bookmarks__user=request.user).annotate(
+        bookmarked_at=F('bookmarks__created_at'),
+        bookmark_id=F('bookmarks__id'),
+    ).with_engagement(request.user)
+    try:
+        posts = CursorPaginator(posts, ('-bookmarked_at', '-bookmark_id'), FEED_PAGE_SIZE).get_page(request.GET.get('cursor'))
+    except InvalidCursor:
+        return HttpResponseBadRequest('Invalid cursor')
     return render(request, 'saved_posts.html', {'posts': posts})
 
 
@@ -395,213 +611,54 @@ def linkedin_config(request):
 
 
 
-from django.shortcuts import redirect, get_object_or_404
-from django.contrib import messages
-import requests
-
-def post_to_facebook(request, post_id):
-    try:
-        # Get the post and user
-        post = get_object_or_404(Post, id=post_id, is_active=True)
-        user = request.user
-        
-        # Get Facebook configuration for this user
-        fb_config = get_object_or_404(FacebookAndInstagramConfiguration, created_by=user)
-        
-        # Prepare the API endpoint
-        page_id = fb_config.page_id
-        access_token = fb_config.access_token
-        api_url = f"https://graph.facebook.com/v18.0/{page_id}/feed"
-        
-        # Handle different post types
-        if post.post_type == 'text':
-            payload = {
-                'message': post.text_content,
-                'access_token': access_token
-            }
-            response = requests.post(api_url, data=payload)
-            print("Text Post Response:", response.json())
-            
-        elif post.post_type == 'image' and post.image:
-            upload_url = f"https://graph.facebook.com/v18.0/{page_id}/photos"
-            files = {'source': post.image.file}
-            data = {
-                'message': post.caption if post.caption else '',
-                'access_token': access_token
-            }
-            response = requests.post(upload_url, files=files, data=data)
-            
-        elif post.post_type == 'video' and post.video:
-            upload_url = f"https://graph.facebook.com/v18.0/{page_id}/videos"
-            files = {'source': post.video.file}
-            data = {
-                'description': post.caption if post.caption else '',
-                'access_token': access_token
-            }
-            response = requests.post(upload_url, files=files, data=data)
-            
-        else:
-            messages.error(request, 'Unsupported post type or missing media')
-            return redirect('some_view_name')  # Redirect to appropriate view
-
-        if response.status_code == 200:
-            return JsonResponse({
-                'success': True, 
-                'message': 'Post shared to Facebook successfully!'
-            })
-        else:
-            response_data = response.json()
-            error_msg = response_data.get('error', {}).get('message', 'Unknown error')
-            return JsonResponse({
-                'success': False, 
-                'error': f'Facebook error: {error_msg}'
-            })
-
-    except Exception as e:
-        messages.error(request, f'Error: {str(e)}')
-
-    return redirect('posts:my_feed')  # Redirect back to where you came from
+import datetime
 
 import requests
 from django.conf import settings
-from django.shortcuts import get_object_or_404, redirect
-from django.contrib import messages
-
-import time
-
-
-def wait_for_video_ready(media_id, access_token, timeout=180):
-    """
-    Poll Instagram Graph API until the video media container status is FINISHED or timeout reached.
-    Checks every 2 seconds up to 'timeout' seconds.
-    """
-    status_url = f"https://graph.facebook.com/v19.0/{media_id}"
-    for _ in range(timeout // 2):
-        response = requests.get(status_url, params={
-            "fields": "status_code",
-            "access_token": access_token
-        })
-        data = response.json()
-        print("Media Status Check:", data)
-
-        if data.get("status_code") == "FINISHED":
-            return True
-        time.sleep(2)
-    return False
-
-def post_to_instagram(request, post_id):
-    try:
-        post = get_object_or_404(Post, id=post_id, is_active=True)
-        user = request.user
-        config = get_object_or_404(FacebookAndInstagramConfiguration, created_by=user)
-        
-        access_token = config.access_token
-        ig_user_id = config.user_id  # Instagram Business User ID
-
-        if post.post_type == 'text':
-            messages.error(request, "Instagram does not support text-only posts.")
-            return redirect('posts:my_feed')
-
-        # Domain for public URLs
-        domain = "https://sociov1.pythonanywhere.com"
-
-        # Construct full media URL
-        media_url = ""
-        if post.post_type == 'image' and post.image:
-            media_path = post.image.url
-            media_url = f"{domain}{media_path}"
-            print("Image URL:", media_url)
-        elif post.post_type == 'video' and post.video:
-            media_path = post.video.url
-            media_url = f"{domain}{media_path}"
-            print("Video URL:", media_url)
-        else:
-            messages.error(request, "Missing media file.")
-            return redirect('posts:my_feed')
-
-        # Step 1: Create media container
-        media_api_url = f"https://graph.facebook.com/v19.0/{ig_user_id}/media"
-        data = {
-            "caption": post.caption or "",
-            "access_token": access_token
-        }
-
-        if post.post_type == 'image':
-            data["image_url"] = media_url
-
-        elif post.post_type == 'video':
-            data["video_url"] = media_url
-            data["media_type"] = "REELS"  # Use REELS for videos
+from django.utils.timezone import now
 
-        media_response = requests.post(media_api_url, data=data)
-        media_json = media_response.json()
-        print("Media Response:", media_json)
+from posts.models import CrossPostJob
 
-        if 'id' not in media_json:
-            error_msg = media_json.get('error', {}).get('message', 'Failed to create Instagram media container.')
-            messages.error(request, f"Instagram error: {error_msg}")
-            return redirect('posts:my_feed')
 
-        creation_id = media_json['id']
+def _enqueue_crosspost(request, post_id, platform):
+    post = get_object_or_404(Post, id=post_id, user=request.user, is_active=True)
+    if not FacebookAndInstagramConfiguration.objects.filter(created_by=request.user).exists():
+        return JsonResponse({'success': False, 'error': 'Set up Facebook and Instagram first.'}, status=400)
+    if platform == CrossPostJob.PLATFORM_INSTAGRAM and post.post_type == 'text':
+        return JsonResponse({'success': False, 'error': 'Instagram does not support text-only posts.'}, status=400)
+    job = crosspost.enqueue(request.user, post, platform)
+    return JsonResponse({
+        'success': True,
+        'job': crosspost.job_state(job),
+        'status_url': reverse('posts:crosspost_status', args=[job.id]),
+    }, status=202)
 
-        # For videos, wait until media is ready before publishing
-        if post.post_type == 'video':
-            is_ready = wait_for_video_ready(creation_id, access_token)
-            if not is_ready:
-                messages.error(request, "Instagram video not ready to publish. Please try again later.")
-                return redirect('posts:my_feed')
-
-        # Step 2: Publish media
-        publish_url = f"https://graph.facebook.com/v19.0/{ig_user_id}/media_publish"
-        publish_response = requests.post(publish_url, data={
-            "creation_id": creation_id,
-            "access_token": access_token
-        })
-        publish_json = publish_response.json()
-        print("Publish Response:", publish_json)
 
-        if 'id' in publish_json:
-            messages.success(request, "Post published to Instagram successfully!")
-        else:
-            error_msg = publish_json.get('error', {}).get('message', 'Failed to publish to Instagram.')
-            messages.error(request, f"Instagram error: {error_msg}")
+@login_required
+@require_POST
+def post_to_facebook(request, post_id):
+    """Queue the post for the run_crossposts worker and return the job id to poll."""
+    return _enqueue_crosspost(request, post_id, CrossPostJob.PLATFORM_FACEBOOK)
 
-        if publish_response.status_code == 200:
-            return JsonResponse({
-                'success': True, 
-                'message': 'Post shared to Instagram successfully!'
-            })
-        else:
-            response_data = publish_response.json()
-            error_msg = response_data.get('error', {}).get('message', 'Unknown error')
-            return JsonResponse({
-                'success': False, 
-                'error': f'Instagram error: {error_msg}'
-            })
 
+@login_required
+@require_POST
+def post_to_instagram(request, post_id):
+    """Queue the post for the run_crossposts worker and return the job id to poll."""
+    return _enqueue_crosspost(request, post_id, CrossPostJob.PLATFORM_INSTAGRAM)
 
-    except Exception as e:
-        messages.error(request, f"Error: {str(e)}")
 
+@login_required
+def crosspost_status(request, job_id):
+    job = get_object_or_404(CrossPostJob, id=job_id, user=request.user)
+    return JsonResponse({'success': True, 'job': crosspost.job_state(job)})
 
-    return redirect('posts:my_feed')
-import requests
-from django.shortcuts import redirect, get_object_or_404
-from django.conf import settings
-from django.contrib import messages
-from django.utils.timezone import now
-import datetime
-import requests
-from django.shortcuts import redirect, get_object_or_404
-from django.conf import settings
-from django.contrib import messages
-from django.utils.timezone import now
-import datetime
 
 # Step 1: Redirect to LinkedIn's OAuth
+@login_required
 def linkedin_login(request, post_id):
-    # Get the post and user
-    post = get_object_or_404(Post, id=post_id, is_active=True)
+    # Only the author can share a post
+    post = get_object_or_404(Post, id=post_id, user=request.user, is_active=True)
     user = request.user
     request.session["post_id"] = post_id
 
@@ -622,6 +679,7 @@ def linkedin_login(request, post_id):
     return redirect(auth_url)
 
 # Step 2: Callback to get token
+@login_required
 def linkedin_callback(request):
     code = request.GET.get('code')
     post_id = request.session.get("post_id")
@@ -630,10 +688,13 @@ def linkedin_callback(request):
         messages.error(request, "Post ID not found in session")
         return redirect('posts:my_feed')
         
-    post_obj = get_object_or_404(Post, id=post_id)
+    post_obj = get_object_or_404(Post, id=post_id, user=request.user, is_active=True)
     
     # FIXED: Use post_obj.user instead of post_obj.created_by
     linkedin_config = LinkedInConfiguration.objects.filter(created_by=post_obj.user).last()
+    if not linkedin_config:
+        messages.error(request, "LinkedIn configuration not found. Please set it up first.")
+        return redirect('posts:my_feed')
 
     if not code:
         messages.error(request, "No code returned from LinkedIn")
@@ -649,7 +710,7 @@ def linkedin_callback(request):
     }
     
     try:
-        r = requests.post(token_url, data=payload)
+        r = requests.post(token_url, data=payload, timeout=30)
         token_data = r.json()
         
         access_token = token_data.get("access_token")
@@ -669,176 +730,12 @@ def linkedin_callback(request):
             }
         )
         
-        print("LinkedIn access token saved:", access_token)
-        messages.success(request, "LinkedIn connected successfully!")
+        messages.success(request, "LinkedIn connected. Your post is being shared.")
         
-        # Proceed to post
-        return post_to_linkedin(request, post_id, access_token)
+        # The worker shares the post; my_feed polls the job.
+        job = crosspost.enqueue(post_obj.user, post_obj, CrossPostJob.PLATFORM_LINKEDIN)
+        return redirect(f"{reverse('posts:my_feed')}?crosspost_job={job.id}")
         
     except Exception as e:
         messages.error(request, f"Error during LinkedIn authentication: {str(e)}")
         return redirect('posts:my_feed')
-
-def post_to_linkedin(request, post_id, access_token=None):
-    try:
-        print("Post to LinkedIn called with post_id:", post_id)
-        post = get_object_or_404(Post, id=post_id, is_active=True)
-        
-        # FIXED: Use post.user instead of post.created_by
-        user = post.user
-
-        # If access_token is not provided, get it from the database
-        if not access_token:
-            linkedin_config = get_object_or_404(LinkedInConfiguration, created_by=user)
-            access_token = linkedin_config.access_token
-            person_urn = linkedin_config.user_urn
-        else:
-            # FIXED: Get linkedin_config even when access_token is provided
-            linkedin_config = get_object_or_404(LinkedInConfiguration, created_by=user)
-            person_urn = linkedin_config.user_urn
-
-        headers = {
-            "Authorization": f"Bearer {access_token}", 
-            "Content-Type": "application/json",
-            "X-Restli-Protocol-Version": "2.0.0"
-        }
-
-        # TEXT ONLY POST
-        if post.post_type == "text":
-            print("Processing text post for LinkedIn")
-            data = {
-                "author": f"urn:li:person:{person_urn}",
-                "lifecycleState": "PUBLISHED",
-                "specificContent": {
-                    "com.linkedin.ugc.ShareContent": {
-                        "shareCommentary": {"text": post.text_content},
-                        "shareMediaCategory": "NONE"
-                    }
-                },
-                "visibility": {"com.linkedin.ugc.MemberNetworkVisibility": "PUBLIC"}
-            }
-            r = requests.post("https://api.linkedin.com/v2/ugcPosts", json=data, headers=headers)
-
-        # IMAGE POST
-        elif post.post_type == "image" and post.image:
-            print("Processing image post for LinkedIn")
-            # 1. Register Upload
-            register_data = {
-                "registerUploadRequest": {
-                    "recipes": ["urn:li:digitalmediaRecipe:feedshare-image"],
-                    "owner": f"urn:li:person:{person_urn}",
-                    "serviceRelationships": [{"relationshipType": "OWNER", "identifier": "urn:li:userGeneratedContent"}]
-                }
-            }
-            
-            reg_res = requests.post(
-                "https://api.linkedin.com/v2/assets?action=registerUpload",
-                json=register_data, 
-                headers=headers
-            ).json()
-            
-            if "value" not in reg_res:
-                messages.error(request, "Failed to register image upload")
-                return redirect('posts:my_feed')
-                
-            upload_url = reg_res["value"]["uploadMechanism"]["com.linkedin.digitalmedia.uploading.MediaUploadHttpRequest"]["uploadUrl"]
-            asset_id = reg_res["value"]["asset"]
-            print("Asset ID for image:", asset_id)
-            
-            # 2. Upload Image
-            image_headers = {"Authorization": f"Bearer {access_token}", "Content-Type": "image/jpeg"}
-            with post.image.open('rb') as img_file:
-                upload_response = requests.put(upload_url, headers=image_headers, data=img_file)
-                
-            if upload_response.status_code != 201:
-                messages.error(request, "Failed to upload image to LinkedIn")
-                return redirect('posts:my_feed')
-
-            # 3. Create Post
-            post_data = {
-                "author": f"urn:li:person:{person_urn}",
-                "lifecycleState": "PUBLISHED",
-                "specificContent": {
-                    "com.linkedin.ugc.ShareContent": {
-                        "shareCommentary": {"text": post.caption or ""},
-                        "shareMediaCategory": "IMAGE",
-                        "media": [{
-                            "status": "READY",
-                            "description": {"text": post.caption or ""},
-                            "media": asset_id,
-                            "title": {"text": "Image Post"}
-                        }]
-                    }
-                },
-                "visibility": {"com.linkedin.ugc.MemberNetworkVisibility": "PUBLIC"}
-            }
-            r = requests.post("https://api.linkedin.com/v2/ugcPosts", json=post_data, headers=headers)
-
-        # VIDEO POST
-        elif post.post_type == "video" and post.video:
-            print("Processing video post for LinkedIn")
-            # 1. Register Upload
-            register_data = {
-                "registerUploadRequest": {
-                    "recipes": ["urn:li:digitalmediaRecipe:feedshare-video"],
-                    "owner": f"urn:li:person:{person_urn}",
-                    "serviceRelationships": [{"relationshipType": "OWNER", "identifier": "urn:li:userGeneratedContent"}]
-                }
-            }
-            
-            reg_res = requests.post(
-                "https://api.linkedin.com/v2/assets?action=registerUpload",
-                json=register_data, 
-                headers=headers
-            ).json()
-            
-            if "value" not in reg_res:
-                messages.error(request, "Failed to register video upload")
-                return redirect('posts:my_feed')
-                
-            upload_url = reg_res["value"]["uploadMechanism"]["com.linkedin.digitalmedia.uploading.MediaUploadHttpRequest"]["uploadUrl"]
-            asset_id = reg_res["value"]["asset"]
-            print("Asset ID for video:", asset_id)
-            
-            # 2. Upload Video
-            video_headers = {"Authorization": f"Bearer {access_token}", "Content-Type": "application/octet-stream"}
-            with post.video.open('rb') as video_file:
-                upload_response = requests.put(upload_url, headers=video_headers, data=video_file)
-                
-            if upload_response.status_code != 201:
-                messages.error(request, "Failed to upload video to LinkedIn")
-                return redirect('posts:my_feed')
-
-            # 3. Create Post
-            post_data = {
-                "author": f"urn:li:person:{person_urn}",
-                "lifecycleState": "PUBLISHED",
-                "specificContent": {
-                    "com.linkedin.ugc.ShareContent": {
-                        "shareCommentary": {"text": post.caption or ""},
-                        "shareMediaCategory": "VIDEO",
-                        "media": [{
-                            "status": "READY",
-                            "description": {"text": post.caption or ""},
-                            "media": asset_id,
-                            "title": {"text": "Video Post"}
-                        }]
-                    }
-                },
-                "visibility": {"com.linkedin.ugc.MemberNetworkVisibility": "PUBLIC"}
-            }
-            r = requests.post("https://api.linkedin.com/v2/ugcPosts", json=post_data, headers=headers)
-
-        else:
-            messages.error(request, "Unsupported post type or missing media")
-            return redirect('posts:my_feed')
-
-        print("LinkedIn post response status:", r.status_code)
-        print("LinkedIn post response:", r.json())
-
-
-    except Exception as e:
-        messages.error(request, f"Error: {str(e)}")
-        print("Exception in post_to_linkedin:", str(e))
-    
-    return redirect('posts:my_feed')
\ No newline at end of file
@@ -0,0 +1,19 @@
+"""Exponential backoff with jitter for retrying background work."""
+import random
+from datetime import timedelta
+
+
+def backoff_delay(attempts, base=30, cap=3600, jitter=0.1):
+    """
+    Seconds to wait before retry number ``attempts`` (1 for the first retry):
+    base * 2**(attempts-1), capped at ``cap``, spread by +/- ``jitter`` so many
+    failures at once do not retry in lockstep.
+    """
+    delay = min(cap, base * (2 ** max(attempts - 1, 0)))
+    if jitter:
+        delay *= 1 + random.uniform(-jitter, jitter)
+    return delay
+
+
+def next_attempt_at(now, attempts, **kwargs):
+    return now + timedelta(seconds=backoff_delay(attempts, **kwargs))
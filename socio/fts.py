@@ -0,0 +1,116 @@
+"""
+SQLite FTS5 helpers.
+
+An index is an external-content FTS5 table over an existing model table,
+kept in sync by SQL triggers so bulk updates and raw SQL stay covered too.
+``create_index_sql``/``drop_index_sql`` produce the statements for a
+migration, ``rebuild`` repopulates an index from its content table, and
+``search_ids`` runs a ranked prefix query. On other database
+backends ``available()`` is False and callers fall back to ORM lookups.
+
+An indexed column can hold a value computed from the row instead of the
+raw column (``expressions``, e.g. only the local part of an email). Such an
+index is filled with an INSERT ... SELECT rather than FTS5's 'rebuild',
+which would read the raw columns, so pass the same expressions to
+``rebuild``.
+
+SQLite drops a table's triggers when a migration rebuilds it (e.g. adding a
+column with a default), so such migrations must recreate the index too; see
+accounts 0035 and 0038.
+"""
+import re
+
+from django.db import connection
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def available(using=connection):
+    return using.vendor == 'sqlite'
+
+
+def _values(columns, expressions, row):
+    return ', '.join((expressions or {}).get(c, '{row}.%s' % c).format(row=row) for c in columns)
+
+
+def populate_sql(fts_table, table, columns, expressions=None):
+    """Statements that refill ``fts_table`` from every row of ``table``."""
+    if not expressions:
+        return [f"INSERT INTO {fts_table}({fts_table}) VALUES('rebuild');"]
+    return [
+        f"INSERT INTO {fts_table}({fts_table}) VALUES('delete-all');",
+        f"INSERT INTO {fts_table}(rowid, {', '.join(columns)}) "
+        f"SELECT {table}.id, {_values(columns, expressions, table)} FROM {table};",
+    ]
+
+
+def create_index_sql(fts_table, table, columns, prefix='2 3', expressions=None):
+    """
+    ``expressions`` maps an indexed column to the SQL that computes it, with
+    ``{row}`` standing for the row (e.g. ``"lower({row}.email)"``). The
+    update trigger still fires on changes to the column of that name.
+    """
+    cols = ', '.join(columns)
+    new_vals = _values(columns, expressions, 'new')
+    old_vals = _values(columns, expressions, 'old')
+    delete_row = f"INSERT INTO {fts_table}({fts_table}, rowid, {cols}) VALUES('delete', old.id, {old_vals});"
+    insert_row = f"INSERT INTO {fts_table}(rowid, {cols}) VALUES (new.id, {new_vals});"
+    return [
+        f"CREATE VIRTUAL TABLE {fts_table} USING fts5({cols}, content='{table}', content_rowid='id', "
+        f"tokenize='unicode61 remove_diacritics 2', prefix='{prefix}');",
+        f"CREATE TRIGGER {fts_table}_ai AFTER INSERT ON {table} BEGIN {insert_row} END;",
+        f"CREATE TRIGGER {fts_table}_ad AFTER DELETE ON {table} BEGIN {delete_row} END;",
+        f"CREATE TRIGGER {fts_table}_au AFTER UPDATE OF {cols} ON {table} BEGIN {delete_row} {insert_row} END;",
+        *populate_sql(fts_table, table, columns, expressions),
+    ]
+
+
+def drop_index_sql(fts_table):
+    return [
+        f"DROP TRIGGER IF EXISTS {fts_table}_ai;",
+        f"DROP TRIGGER IF EXISTS {fts_table}_ad;",
+        f"DROP TRIGGER IF EXISTS {fts_table}_au;",
+        f"DROP TABLE IF EXISTS {fts_table};",
+    ]
+
+
+def rebuild(fts_table, table=None, columns=None, expressions=None, using=connection):
+    """Re-read every row of the content table into ``fts_table``."""
+    with using.cursor() as cursor:
+        for statement in populate_sql(fts_table, table, columns, expressions):
+            cursor.execute(statement)
+
+
+def match_query(text, prefix_last=True):
+    """
+    Turn free text into a safe FTS5 query: every word quoted, all required,
+    and the last one a prefix so partially typed words match. Returns '' if
+    there is nothing to search for.
+    """
+    tokens = _TOKEN_RE.findall(text or '')
+    if not tokens:
+        return ''
+    terms = ['"%s"' % t.replace('"', '""') for t in tokens]
+    if prefix_last:
+        terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def search_ids(fts_table, table, query, weights=(), where='', params=(), limit=20, offset=0):
+    """
+    Return matching row ids, best first by bm25 (column ``weights`` in index
+    order). ``where`` is an extra SQL condition on the content table, aliased
+    ``t``.
+    """
+    match = match_query(query)
+    if not match:
+        return []
+    rank = f"bm25({fts_table}{''.join(', %s' % float(w) for w in weights)})"
+    sql = (
+        f"SELECT t.id FROM {fts_table} JOIN {table} t ON t.id = {fts_table}.rowid "
+        f"WHERE {fts_table} MATCH %s {('AND ' + where) if where else ''} "
+        f"ORDER BY {rank}, t.id LIMIT %s OFFSET %s"
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [match, *params, limit, offset])
+        return [row[0] for row in cursor.fetchall()]
@@ -0,0 +1,149 @@
+"""
+Keyset (cursor) pagination.
+
+A page is addressed by an opaque token holding the ordering values of the last
+row served, so the next page is a range scan on the ordering index no matter
+how deep the client has scrolled. No total count is computed.
+"""
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from django.core.exceptions import FieldDoesNotExist, FieldError, ValidationError
+from django.db import models
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def _dump(value):
+    if hasattr(value, 'isoformat'):
+        return {'dt': value.isoformat()}
+    return value
+
+
+def _load(value):
+    if isinstance(value, dict) and 'dt' in value:
+        parsed = parse_datetime(value['dt'])
+        if parsed is None:
+            raise InvalidCursor('Bad datetime in cursor')
+        return parsed
+    return value
+
+
+def encode_cursor(values):
+    payload = json.dumps([_dump(v) for v in values], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise InvalidCursor('Malformed cursor')
+    if not isinstance(values, list):
+        raise InvalidCursor('Malformed cursor')
+    return [_load(v) for v in values]
+
+
+class CursorPage:
+    def __init__(self, object_list, next_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+
+class CursorPaginator:
+    """
+    Paginate ``queryset`` by ``ordering``, a sequence of field names each
+    optionally prefixed with '-'. The fields must form a unique key (end with
+    the primary key) and be readable as attributes of the returned rows, so
+    ordering on a related column means annotating it first.
+    """
+
+    def __init__(self, queryset, ordering, per_page=10):
+        self.queryset = queryset
+        self.ordering = tuple(ordering)
+        self.per_page = per_page
+
+    def _fields(self):
+        return [(name.lstrip('-'), name.startswith('-')) for name in self.ordering]
+
+    def _column(self, name):
+        """The model field or annotation behind ordering column ``name``, if it can be found."""
+        annotation = self.queryset.query.annotations.get(name)
+        try:
+            if annotation is not None:
+                return annotation.output_field
+            return self.queryset.model._meta.get_field(name)
+        except (FieldDoesNotExist, FieldError):
+            return None
+
+    def _coerce(self, name, value):
+        """
+        ``value`` as the Python type of column ``name``. A cursor can be decoded
+        fine and still carry the wrong types, e.g. one issued for another
+        ordering or edited by hand; that is an InvalidCursor, not a query error.
+        """
+        if value is None or isinstance(value, (bool, dict, list)):
+            raise InvalidCursor('Bad value in cursor')
+        field = self._column(name)
+        if field is None:
+            return value
+        if isinstance(field, models.DateTimeField) and not isinstance(value, datetime):
+            raise InvalidCursor('Bad datetime in cursor')
+        try:
+            return field.to_python(value)
+        except (ValidationError, TypeError, ValueError):
+            raise InvalidCursor('Bad value in cursor')
+
+    def _after(self, values):
+        fields = self._fields()
+        if len(values) != len(fields):
+            raise InvalidCursor('Cursor does not match ordering')
+        values = [self._coerce(name, value) for (name, _), value in zip(fields, values)]
+        condition = Q()
+        for i, (name, descending) in enumerate(fields):
+            step = Q(**{f"{name}__{'lt' if descending else 'gt'}": values[i]})
+            for j, (prev_name, _) in enumerate(fields[:i]):
+                step &= Q(**{prev_name: values[j]})
+            condition |= step
+        return condition
+
+    def _key(self, row):
+        if isinstance(row, dict):
+            return [row[name] for name, _ in self._fields()]
+        return [getattr(row, name) for name, _ in self._fields()]
+
+    def get_page(self, cursor=None):
+        queryset = self.queryset.order_by(*self.ordering)
+        if cursor:
+            try:
+                queryset = queryset.filter(self._after(decode_cursor(cursor)))
+            except InvalidCursor:
+                raise
+            except (ValidationError, TypeError, ValueError):
+                raise InvalidCursor('Bad value in cursor')
+        rows = list(queryset[:self.per_page + 1])
+        next_cursor = None
+        if len(rows) > self.per_page:
+            rows = rows[:self.per_page]
+            next_cursor = encode_cursor(self._key(rows[-1]))
+        return CursorPage(rows, next_cursor)
@@ -54,6 +54,7 @@ INSTALLED_APPS = [
     'chat',
     
      'notifications',
+    'mediastore',
 ]
 # Add ASGI application and Channel Layers
 ASGI_APPLICATION = 'socio.asgi.application'
@@ -64,6 +65,18 @@ CHANNEL_LAYERS = {
     },
 }
 
+# Like the channel layer above, the cache is process-local. Online presence
+# (chat.presence), friend sets, post cards and media hashes all live in it, so
+# this setup assumes a single server process. With several workers each one
+# would see only the users connected to it. Point both at a shared store
+# first, e.g. 'django.core.cache.backends.redis.RedisCache' with
+# 'LOCATION': 'redis://127.0.0.1:6379' and channels_redis for the layer.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}
+
 
 import os
 MEDIA_URL = '/media/'
@@ -0,0 +1,53 @@
+"""
+Minimal background execution for work that should not hold up a response.
+
+``defer(fn, *args)`` runs ``fn`` on a small in-process thread pool once the
+current transaction commits, so the job always sees the rows the request
+wrote. Jobs take plain ids, not model instances, and should be idempotent:
+a process restart drops whatever is still queued, and each job has a
+management command or rebuild path that repairs a missed run.
+
+With TASKS_EAGER = True (handy in tests and scripts) jobs run inline at
+commit time instead.
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=getattr(settings, 'TASKS_MAX_WORKERS', 4),
+            thread_name_prefix='socio-task',
+        )
+    return _executor
+
+
+def _run(fn, args, kwargs):
+    close_old_connections()
+    try:
+        fn(*args, **kwargs)
+    except Exception:
+        logger.exception("Background task %s failed", getattr(fn, '__qualname__', fn))
+    finally:
+        close_old_connections()
+
+
+def _submit(fn, args, kwargs):
+    if getattr(settings, 'TASKS_EAGER', False):
+        fn(*args, **kwargs)
+    else:
+        _get_executor().submit(_run, fn, args, kwargs)
+
+
+def defer(fn, *args, **kwargs):
+    """Run ``fn(*args, **kwargs)`` in the background after the current transaction commits."""
+    transaction.on_commit(lambda: _submit(fn, args, kwargs))
@@ -16,8 +16,8 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
-from django.conf.urls.static import static
 from django.conf import settings
+from mediastore import views as media_views
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -25,4 +25,7 @@ urlpatterns = [
     path('posts/', include('posts.urls')),
     path('chat/', include('chat.urls')),
     path('notifications/', include('notifications.urls')),  # Include notifications app URLs
-    ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    path('uploads/', include('mediastore.urls')),  # Resumable chunked uploads
+    # Uploaded media, with range requests and cache validators (see mediastore.views)
+    path(settings.MEDIA_URL.lstrip('/') + '<path:path>', media_views.serve_media, name='serve_media'),
+    ]